@@ -0,0 +1,317 @@
+# bench.py
+"""
+Benchmarks against a local fake Bot API (see fakeapi.py).
+
+Starts the fake server in a subprocess, points the bot at it (BOT_API_URL)
+with a throwaway STATE_DB, checks that a permanent Bot API error (400) is
+not retried, and for each size N:
+
+* POSTs synthetic private-message updates to build_app()'s webhook server,
+  one or more per user for N users, and reports collect_reply updates/s
+  and p50/p99 latency (from the POST until the handlers are done);
+* runs job_reveal and job_cleanup for those N participants end to end and
+  reports their wall time and the Bot API calls they made.
+
+By default neither side enforces Telegram's flood limits, so the numbers
+show the bot's own overhead (with them, revealing 10k replies into one
+group takes hours by design). --limits turns them on.
+
+    python bench.py                              # N = 10, 1000, 10000
+    python bench.py --sizes 10,1000 --save base.json
+    python bench.py --compare base.json          # exit 1 if something got >20% worse
+    python bench.py --reveal-mode digest         # text replies packed into ~4096-char messages
+    python bench.py --http-profile fanout        # transport preset (pool, keep-alive, calls in flight)
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import tempfile
+import shutil
+import subprocess
+import urllib.request
+from typing import Optional
+
+SIZES = (10, 1000, 10000)
+MIN_UPDATES = 1000  # small sizes send several replies per user, so the rate is measured over enough updates
+CONCURRENCY = 64  # webhook POSTs in flight
+TOLERANCE = 0.2  # --compare: allowed relative change before a result counts as a regression
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# result key -> True if higher is better
+TRACKED = {"updates_per_s": True, "p50_ms": False, "p99_ms": False, "reveal_s": False, "cleanup_s": False}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_server(latency: float = 0.05, flood: float = 0.0,
+                      limits: bool = False) -> tuple[subprocess.Popen, str]:
+    """Run fakeapi.py in its own process (so it doesn't compete with the bot for the GIL)."""
+    port = _free_port()
+    cmd = [sys.executable, os.path.join(HERE, "fakeapi.py"),
+           "--port", str(port), "--latency", str(latency), "--flood", str(flood)]
+    if limits:
+        cmd.append("--limits")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    if proc.stdout.readline().strip() != "ready":
+        proc.kill()
+        raise RuntimeError("fake Bot API server did not start")
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def load_bot(api_url: str, workdir: str):
+    """Import bot.py configured against `api_url`, with its database in `workdir` (it reads env at import)."""
+    os.environ.update(BOT_TOKEN="123456:bench", PUBLIC_URL="http://127.0.0.1", BOT_API_URL=api_url,
+                      STATE_DB=os.path.join(workdir, "bench.db"), METRICS_PORT="0", WORKERS="1")
+    os.environ.setdefault("PROMPTS_FILE", os.path.join(HERE, "prompts.json"))
+    for name in ("GROUP_ID", "WORKER_ID"):
+        os.environ.pop(name, None)
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+    return bot
+
+
+def fetch_calls(api_url: str) -> dict:
+    with urllib.request.urlopen(f"{api_url}/stats") as response:
+        return json.load(response)
+
+
+def _diff(after: dict, before: dict) -> dict:
+    return {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)}
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def private_update(update_id: int, user_id: int, message_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    return {"update_id": update_id, "message": {
+        "message_id": message_id, "date": int(time.time()), "text": f"Reply {message_id} from {user_id}",
+        "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]}, "from": user,
+    }}
+
+
+# =========================
+# ⏱ ONE SIZE
+# =========================
+
+async def bench_size(bot, app, client, webhook_url: str, api_url: str, size: int, index: int,
+                     finished: dict, concurrency: int) -> dict:
+    """Replies from `size` users through the webhook, then the round's reveal and cleanup."""
+    tenant_id = -1001000000000 - index
+    state = bot.TENANTS.add(tenant_id, f"Bench {size}")
+    bot.TENANTS.set_discussion(state, tenant_id - 500)
+    now = bot.group_schedule(state).now()
+    round_key = bot.today_key(state, now)
+    state.set_last_prompt_time(now, round_key)
+    users = [(index + 1) * 1_000_000 + i for i in range(size)]
+    for uid in users:
+        bot.TENANTS.see_user(uid, tenant_id)
+
+    # collect_reply: interleave users so their replies arrive concurrently, like a busy evening
+    per_user = max(1, MIN_UPDATES // size)
+    updates = [private_update(index * 100_000_000 + n, uid, m + 1)
+               for n, (m, uid) in enumerate((m, uid) for m in range(per_user) for uid in users)]
+    sent: dict[int, float] = {}
+    finished.clear()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def post(update: dict):
+        async with limit:
+            sent[update["update_id"]] = time.perf_counter()
+            response = await client.post(webhook_url, json=update)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(post(u) for u in updates))
+    while len(finished) < len(updates):
+        await asyncio.sleep(0.01)
+    elapsed = max(finished.values()) - start
+    latencies = [finished[uid] - sent[uid] for uid in sent]
+
+    t0 = time.perf_counter()
+    await asyncio.to_thread(bot.TENANTS.flush)
+    flush_s = time.perf_counter() - t0
+
+    # Reveal, then everyone joins the discussion group, then cleanup kicks them all
+    due = time.time()
+    before = await asyncio.to_thread(fetch_calls, api_url)
+    t0 = time.perf_counter()
+    await bot.job_reveal(app.bot, state, due)
+    reveal_s = time.perf_counter() - t0
+    middle = await asyncio.to_thread(fetch_calls, api_url)
+    for uid in users:
+        state.add_member(round_key, uid)
+    t0 = time.perf_counter()
+    await bot.job_cleanup(app.bot, state, due + 1)
+    cleanup_s = time.perf_counter() - t0
+    after = await asyncio.to_thread(fetch_calls, api_url)
+
+    return {
+        "size": size,
+        "updates": len(updates),
+        "updates_per_s": len(updates) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "flush_s": flush_s,
+        "reveal_s": reveal_s,
+        "reveal_calls": _diff(middle["calls"], before["calls"]),
+        "cleanup_s": cleanup_s,
+        "cleanup_calls": _diff(after["calls"], middle["calls"]),
+        "throttled": sum(_diff(after["throttled"], before["throttled"]).values()),
+    }
+
+
+async def check_bad_request(bot, app, api_url: str) -> Optional[str]:
+    """A 400 must reach the caller after one call, not go through the network-error retries. None if it does."""
+    from telegram.error import BadRequest
+
+    before = await asyncio.to_thread(fetch_calls, api_url)
+    t0 = time.perf_counter()
+    try:
+        await bot.DISPATCHER.call(app.bot.get_chat_member, -1, 0)  # the fake API doesn't know user 0
+    except BadRequest:
+        pass
+    else:
+        return "getChatMember for an unknown user succeeded"
+    elapsed = time.perf_counter() - t0
+    after = await asyncio.to_thread(fetch_calls, api_url)
+    calls = _diff(after["calls"], before["calls"]).get("getChatMember", 0)
+    print(f"BadRequest reached the caller after {calls} call(s) in {elapsed:.2f}s")
+    return None if calls == 1 else f"BadRequest was retried: {calls} getChatMember calls"
+
+
+# =========================
+# 🏁 RUNNER
+# =========================
+
+async def run(bot, api_url: str, args) -> tuple[list[dict], list[str]]:
+    import httpx
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from dispatcher import Dispatcher
+
+    if args.reveal_mode:
+        bot.REVEAL_MODE = args.reveal_mode
+    if not args.limits:
+        bot.DISPATCHER = Dispatcher(global_rate=1e6, concurrency=bot.TRANSPORT.concurrency, chat_limits=False)
+
+    profile = bot.TRANSPORT
+    print(f"HTTP profile {profile.name}: {profile.concurrency} calls in flight, pool {profile.pool_size}, "
+          f"HTTP/{'2' if profile.http2 else '1.1'} requested")
+    finished: dict[int, float] = {}
+
+    async def mark_finished(update: Update, context):
+        finished[update.update_id] = time.perf_counter()
+
+    app = bot.build_app()
+    app.add_handler(TypeHandler(Update, mark_finished), group=99)  # runs after every other handler group
+    port = _free_port()
+    webhook_url = f"http://127.0.0.1:{port}/bench"
+    bot.TENANTS.start()
+    await app.initialize()
+    await app.updater.start_webhook(listen="127.0.0.1", port=port, url_path="bench", webhook_url=webhook_url)
+    await app.start()
+    results, failures = [], []
+    try:
+        failure = await check_bad_request(bot, app, api_url)
+        if failure:
+            failures.append(failure)
+        async with httpx.AsyncClient(timeout=60) as client:
+            for index, size in enumerate(args.sizes):
+                result = await bench_size(bot, app, client, webhook_url, api_url, size, index, finished,
+                                          args.concurrency)
+                results.append(result)
+                print_result(result)
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await bot.DISPATCHER.close()
+        await app.shutdown()
+        bot.TENANTS.close()
+    return results, failures
+
+
+def print_result(r: dict):
+    def calls(counts: dict) -> str:
+        return ", ".join(f"{k} {v}" for k, v in sorted(counts.items()))
+
+    print(f"N={r['size']:>6}  collect_reply {r['updates']} updates: {r['updates_per_s']:8,.0f}/s  "
+          f"p50 {r['p50_ms']:7.1f}ms  p99 {r['p99_ms']:7.1f}ms  (state flush {r['flush_s']:.2f}s)")
+    print(f"          reveal  {r['reveal_s']:8.2f}s  [{calls(r['reveal_calls'])}]")
+    print(f"          cleanup {r['cleanup_s']:8.2f}s  [{calls(r['cleanup_calls'])}]"
+          + (f"  429s: {r['throttled']}" if r["throttled"] else ""))
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """Descriptions of every tracked number that got worse than `baseline` by more than `tolerance`."""
+    old = {r["size"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        base = old.get(r["size"])
+        if base is None:
+            continue
+        for key, higher_is_better in TRACKED.items():
+            if not base.get(key):
+                continue
+            change = (r[key] - base[key]) / base[key]
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"N={r['size']} {key}: {base[key]:.2f} -> {r[key]:.2f} ({change:+.0%})")
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the bot against a fake Bot API")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="participant counts, comma separated")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake API median latency in seconds")
+    parser.add_argument("--flood", type=float, default=0.0, help="fraction of API calls answered with a 429")
+    parser.add_argument("--limits", action="store_true", help="enforce Telegram's flood limits on both sides")
+    parser.add_argument("--reveal-mode", choices=("forward", "batch", "anonymous", "digest"),
+                        help="REVEAL_MODE for job_reveal (default: the bot's)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="webhook POSTs in flight")
+    parser.add_argument("--http-profile", help="HTTP_PROFILE for the bot's Bot API calls (see transport.py)")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from --save; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    proc, api_url = start_fake_server(args.latency, args.flood, args.limits)
+    workdir = tempfile.mkdtemp(prefix="ripple-bench-")
+    if args.http_profile:
+        os.environ["HTTP_PROFILE"] = args.http_profile
+    try:
+        bot = load_bot(api_url, workdir)
+        results, failures = asyncio.run(run(bot, api_url, args))
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for line in failures:
+        print(f"FAILED {line}")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions or failures else 0
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,47 @@
 # bot.py
 import os
-import json
-import random
+import sys
+import signal
+import socket
+import time as time_module
+import asyncio
 import logging
-from datetime import time, datetime, timedelta
+import threading
+import html
+import functools
+import subprocess
+from datetime import time, datetime
 from typing import Optional
 
 from pytz import timezone
-from telegram import Update, ChatInviteLink
+from telegram import Update, ChatInviteLink, ChatMember, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import (
-    ApplicationBuilder, Application, CommandHandler, MessageHandler,
-    ContextTypes, CallbackContext, filters
+    ApplicationBuilder, Application, CommandHandler, MessageHandler, ChatMemberHandler,
+    CallbackQueryHandler, ContextTypes, filters
+)
+
+import clock
+from storage import StateStore, open_store, import_legacy_json
+from state import RoundState, Tenants, KeyedLocks
+from records import ReplyRecord, KIND_TEXT
+from prompts import PromptCatalog, PromptDeck
+from dispatcher import Dispatcher, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_BULK
+from scheduler import GroupSchedule, RoundScheduler, ROUND_EVENTS, group_jitter
+from lease import LeaderLease
+from outbox import Outbox, BatchRun
+from ingest import IngestQueue
+from digest import pack_digest
+from transport import ProfiledRequest, profile_from_env
+from startup import STARTUP, WebhookBot, WebhookUpdater
+from render import RenderCache
+from welcome import WelcomeBatcher
+from logs import setup_logging, log_context
+from profiler import Profiler, ProfileReport, MODES as PROFILE_MODES, http_handlers as profile_handlers
+from metrics import (
+    HANDLER_SECONDS, HANDLER_ERRORS, EVENT_SECONDS, UPDATE_QUEUE_DEPTH, UPDATE_QUEUE_PEAK, UPDATE_QUEUE_CAPACITY,
+    DISPATCH_QUEUE_DEPTH,
+    watch_loop_lag, start_metrics_server
 )
 
 # =========================
@@ -19,161 +49,181 @@ from telegram.ext import (
 # =========================
 
 BOT_TOKEN = os.environ["BOT_TOKEN"]
-MAIN_GROUP_ID = int(os.environ["GROUP_ID"])
+# Optional: a main group that is always served (and owns any data from before multi-group support).
+# Other groups join with /register.
+MAIN_GROUP_ID = int(os.environ["GROUP_ID"]) if os.environ.get("GROUP_ID") else None
 PUBLIC_URL = os.environ["PUBLIC_URL"].rstrip("/")  # e.g., https://ripple-bot.onrender.com
 PORT = int(os.environ.get("PORT", "10000"))  # Render injects PORT
-
-# Timezone
+# Bot API server (default: Telegram's). bench.py points this at the fake server in fakeapi.py
+BOT_API_URL = os.environ.get("BOT_API_URL", "").rstrip("/")
+
+# Worker processes sharing PORT (SO_REUSEPORT) and STATE_DB. Only the one holding the
+# leader lease runs the round jobs; another takes over if it dies.
+WORKERS = int(os.environ.get("WORKERS", "1"))
+WORKER_ID = os.environ.get("WORKER_ID")  # set by the supervisor for the processes it starts
+
+# Events missed while nobody held the lease (or the bot was down) still run when the lease is taken,
+# unless the next occurrence of the same event is already due too; at most CATCH_UP_MAX of them
+# (most recent first) per takeover. Every missed event that doesn't run is logged
+CATCH_UP_MAX = int(os.environ.get("CATCH_UP_MAX", "100"))
+
+# Log output: "json" (one object per line, with round/chat/handler fields) or "text" (the old one-line format).
+# Repeats of a message are capped per minute either way (see logs.py)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+
+# Bot operators (comma-separated Telegram user ids): may run /profile in a DM with the bot
+ADMIN_IDS = {int(x) for x in os.environ.get("ADMIN_IDS", "").split(",") if x.strip()}
+
+# Prometheus metrics at http://METRICS_HOST:METRICS_PORT/metrics (0 disables). With WORKERS > 1,
+# worker N listens on METRICS_PORT + N. Only local by default: set METRICS_HOST=0.0.0.0 for a remote scraper
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9090"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+# Profile reports (METRICS_PORT/profile/...) show code paths and thread names. If set, requests need
+# "Authorization: Bearer <PROFILE_TOKEN>"; without it they are only served when METRICS_HOST is local
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN") or None
+
+# Outbound HTTP (see transport.py): HTTP_PROFILE picks a preset ("default", "production", "fanout") for
+# Bot API calls in flight, pool size, keep-alive, HTTP/2 and per-method-class timeouts; HTTP_* override fields
+TRANSPORT = profile_from_env(os.environ)
+
+# How many updates are handled at once. Writes for the same user+round are still serialized.
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "64"))
+
+# Webhook ingest (see ingest.py): at most INGEST_CAPACITY updates in flight; when full,
+# INGEST_POLICY "wait" holds deliveries, "reject" makes Telegram redeliver later, "drop" loses them
+INGEST_CAPACITY = int(os.environ.get("INGEST_CAPACITY", "1000"))
+INGEST_POLICY = os.environ.get("INGEST_POLICY", "wait")
+
+# New members are welcomed together (see welcome.py): once nobody has joined a chat for
+# WELCOME_WINDOW seconds, one message names everyone who joined (0 welcomes right away)
+WELCOME_WINDOW = float(os.environ.get("WELCOME_WINDOW", "3"))
+
+# Timezone (default; each group can pick its own with /schedule)
 TZ = timezone("Europe/Amsterdam")
 
 # --- Daily Schedule (EDIT THESE FOR YOUR FLOW) ---
 # All intervals are relative to when the PROMPT is posted
-PROMPT_TIME = time(20, 0, tzinfo=TZ)  # 20:00 - Daily prompt posted
+PROMPT_TIME = time(20, 0)  # 20:00 local time - Daily prompt posted
+
+# Groups sharing a prompt time are spread over this many seconds (fixed offset per group)
+PROMPT_JITTER = float(os.environ.get("PROMPT_JITTER", "120"))
+
+# How replies are revealed in the discussion group:
+#   "forward"   - one forward_message per reply
+#   "batch"     - one forward_messages call per user (up to 100 replies each)
+#   "anonymous" - like "batch" but with copy_messages, so names are not shown
+#   "digest"    - text replies packed into a few HTML messages under each sender's name
+#                 (see digest.py); voice/audio are still forwarded, one call per user
+REVEAL_MODE = os.environ.get("REVEAL_MODE", "batch")
 
 # Intervals (hours after prompt time)
 REMINDER_HOURS = 20  # 20 hours after prompt = 16:00 next day
 REVEAL_HOURS = 22  # 22 hours after prompt = 18:00 next day
 CLEANUP_HOURS = 45  # 45 hours after prompt = 17:00 day after next (1hr before next reveal)
 
-# Files for lightweight persistence (Render's disk is ephemeral across restarts, okay for tests)
+# Used by every group until an admin changes it with /schedule
+DEFAULT_SCHEDULE = GroupSchedule(PROMPT_TIME, TZ.zone, REMINDER_HOURS, REVEAL_HOURS, CLEANUP_HOURS)
+
+# State database (SQLite, WAL). Render's disk is ephemeral across restarts, okay for tests
+STATE_DB = os.environ.get("STATE_DB", "ripple.db")
+
+# Prompt catalog (JSON or CSV, reloaded automatically when the file changes)
+PROMPTS_FILE = os.environ.get("PROMPTS_FILE", "prompts.json")
+# Topic choice: "all" (one no-repeat deck over everything), "rotate" (topics take turns)
+# or "weighted" (random topic, using the weights in the catalog)
+PROMPT_ROTATION = os.environ.get("PROMPT_ROTATION", "all")
+
+# Legacy JSON files, imported once into STATE_DB (for GROUP_ID) on first start
 USED_PROMPTS_FILE = "used_prompts.json"  # {"used": [indices]}
 DISCUSSION_FILE = "discussion_group.json"  # {"chat_id": <int>}
 REPLIES_FILE = "replies.json"  # {"<user_id>": [message_dicts]}
 PARTICIPANTS_FILE = "participants.json"  # {"current":[ids], "last_invite_link":"...", "last_round":"YYYY-MM-DD"}
 SCHEDULE_FILE = "schedule.json"  # {"last_prompt_time": "ISO timestamp"}
 
-# =========================
-# 🗒️ PROMPTS (no repeats until all are used)
-# =========================
-
-PROMPTS = [
-    # 🧘 Mental Wellbeing
-    {"topic": "Mental Wellbeing", "text": "What's one small thing that secretly keeps you sane when life gets messy?"},
-    {"topic": "Mental Wellbeing",
-     "text": "When was the last time you took a proper break — like really unplugged — and what did you do?"},
-    {"topic": "Mental Wellbeing",
-     "text": "If you could press pause on everything for a day, what would you spend that day doing?"},
-    {"topic": "Mental Wellbeing",
-     "text": "Be honest — what's your brain's current 'weather forecast'? (sunny, foggy, thunderstorms…)"},
-    {"topic": "Mental Wellbeing", "text": "What's a habit you dropped that you kinda want back?"},
-
-    # 🎉 Fun Memories
-    {"topic": "Fun Memories", "text": "What's a memory with this group that instantly makes you grin?"},
-    {"topic": "Fun Memories", "text": "What's the dumbest inside joke you still remember?"},
-    {"topic": "Fun Memories",
-     "text": "If you could relive one hilarious moment from our past together, which would it be?"},
-    {"topic": "Fun Memories",
-     "text": "What's something funny that happened recently that you wish we'd all been there for?"},
-    {"topic": "Fun Memories", "text": 'What’s a "you had to be there" moment that still cracks you up?'},
-    {"topic": "Fun Memories", "text": "What's one memory you'd 100% put in a highlight reel of your life?"},
-
-    # 🚀 Future Plans
-    {"topic": "Future Plans",
-     "text": "If this group planned a trip together, where would we end up — and who's getting lost first?"},
-    {"topic": "Future Plans", "text": "What's one dream you secretly hope you'll pull off (even if it sounds crazy)?"},
-    {"topic": "Future Plans", "text": "If we met again in 10 years, what do you hope your life looks like?"},
-    {"topic": "Future Plans", "text": 'What’s a skill or hobby you’ve been "meaning to start" forever — be honest!'},
-    {"topic": "Future Plans",
-     "text": "If you had to make one bold change in your life before next summer, what would it be?"},
-    {"topic": "Future Plans", "text": "What's something you'd do if you knew you couldn't fail?"},
-    {"topic": "Future Plans", "text": "What's a goal that scares you a little (in a good way)?"},
-
-    # 💫 Friendship & Growth
-    {"topic": "Friendship & Growth", "text": "What's something you've learned from someone in this group?"},
-    {"topic": "Friendship & Growth", "text": "When did you first realize this group had become your people?"},
-    {"topic": "Friendship & Growth", "text": "What's one thing you wish we did more often together?"},
-    {"topic": "Friendship & Growth", "text": "How do you think you've changed the most since we first met?"},
-    {"topic": "Friendship & Growth",
-     "text": "If you could tell your past self one thing from what you've learned lately, what would it be?"},
-]
-
 # =========================
 # 🧰 UTILITIES
 # =========================
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-)
+# Formatted and written on a listener thread; the event loop only queues records
+setup_logging(logging.INFO, LOG_FORMAT, worker=WORKER_ID)
 
 
-def load_json(path: str):
-    if not os.path.exists(path):
-        return {}
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
+STORE: StateStore = open_store(STATE_DB)
+# Every group's round state, loaded once in main(); handlers only ever read this
+TENANTS = Tenants(STORE, shared=WORKERS > 1)
+LEASE = LeaderLease(STORE)  # whoever holds it runs the scheduled round jobs
+OUTBOX = Outbox(STORE, persist=TENANTS.flush)  # reveal/cleanup fan-outs, written down before they run
+DISPATCHER = Dispatcher(concurrency=TRANSPORT.concurrency)  # every Bot API call goes through here (limits + retries)
+PROMPT_CATALOG = PromptCatalog(PROMPTS_FILE)  # read on first use, not at import
+USER_LOCKS = KeyedLocks()  # one lock per (group, round, user) so a user's replies are stored and acked in order
+SCHEDULER = RoundScheduler()  # every group's prompt/reminder/reveal/cleanup, on one timer
+PROFILER = Profiler()  # /profile sessions; the last report is also served at METRICS_PORT/profile/...
 
 
-def save_json(path: str, data: dict):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f)
+def group_schedule(state: Optional[RoundState]) -> GroupSchedule:
+    """The group's schedule (the defaults, for groups that never set one)."""
+    if state is None or not state.schedule:
+        return DEFAULT_SCHEDULE
+    return GroupSchedule.from_dict(state.schedule, DEFAULT_SCHEDULE)
 
 
-def today_key(dt: Optional[datetime] = None) -> str:
-    dt = dt or datetime.now(TZ)
+def today_key(state: Optional[RoundState] = None, dt: Optional[datetime] = None) -> str:
+    """Round key: the date in the group's timezone."""
+    dt = dt or group_schedule(state).now()
     return dt.strftime("%Y-%m-%d")
 
 
-def next_dt_at(t: time) -> datetime:
-    """Get next occurrence of time t (today or tomorrow)"""
-    now = datetime.now(TZ)
-    target = now.replace(hour=t.hour, minute=t.minute, second=0, microsecond=0)
-    if target < now:
-        target += timedelta(days=1)
-    return target
+def next_prompt_at(state: Optional[RoundState], after: Optional[datetime] = None) -> datetime:
+    """When the group's next prompt (after `after`, default now) goes out, jitter included."""
+    schedule = group_schedule(state)
+    jitter = group_jitter(state.tenant_id, PROMPT_JITTER) if state else 0.0
+    return schedule.next_prompt(after or schedule.now(), jitter)
 
 
-def get_discussion_chat_id() -> Optional[int]:
-    data = load_json(DISCUSSION_FILE)
-    cid = data.get("chat_id")
-    return int(cid) if cid is not None else None
+def current_round_key(state: RoundState) -> str:
+    """Key of the group's round whose prompt was posted last (today's date if there is none yet)."""
+    return state.last_prompt_round or today_key(state)
 
 
-def set_discussion_chat_id(chat_id: int):
-    save_json(DISCUSSION_FILE, {"chat_id": int(chat_id)})
+def event_round_key(state: RoundState, event: str, due: float) -> str:
+    """Key of the round whose `event` is due at `due` (unix time). A cleanup runs after the next prompt."""
+    schedule = group_schedule(state)
+    prompt_ts = due - getattr(schedule, f"{event}_hours", 0.0) * 3600
+    return today_key(state, datetime.fromtimestamp(prompt_ts, schedule.zone()))
 
 
-def get_participants():
-    data = load_json(PARTICIPANTS_FILE)
-    return {
-        "current": [int(x) for x in data.get("current", [])],
-        "last_invite_link": data.get("last_invite_link"),
-        "last_round": data.get("last_round"),
-    }
+def open_round_key(state: RoundState) -> str:
+    """Key of the round whose discussion is open: the one revealed last. Joins count for it."""
+    revealed = state.event_marks.get("reveal")
+    return event_round_key(state, "reveal", revealed) if revealed else current_round_key(state)
 
 
-def set_participants(ids: list[int], invite_link: Optional[str], round_key: str):
-    save_json(PARTICIPANTS_FILE, {
-        "current": [int(x) for x in ids],
-        "last_invite_link": invite_link,
-        "last_round": round_key
-    })
+def calculate_event_times(state: Optional[RoundState], prompt_dt: datetime):
+    """Calculate all event times based on prompt time"""
+    return group_schedule(state).event_times(prompt_dt)
 
 
-def get_last_prompt_time() -> Optional[datetime]:
-    """Get the timestamp of when the last prompt was posted"""
-    data = load_json(SCHEDULE_FILE)
-    ts = data.get("last_prompt_time")
-    if ts:
-        return datetime.fromisoformat(ts)
-    return None
+async def reply(update: Update, text: str, **kwargs):
+    """Answer the user who sent this update (high priority lane)."""
+    return await DISPATCHER.call(update.effective_message.reply_text, text, key=update.effective_chat.id,
+                                 priority=PRIORITY_HIGH, **kwargs)
 
 
-def set_last_prompt_time(dt: datetime):
-    """Save when the prompt was posted"""
-    save_json(SCHEDULE_FILE, {"last_prompt_time": dt.isoformat()})
+async def is_admin(bot, chat_id: int, user_id: int) -> bool:
+    try:
+        member = await DISPATCHER.call(bot.get_chat_member, chat_id=chat_id, user_id=user_id)
+    except Exception:
+        return False
+    return member.status in (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
 
 
-def calculate_event_times(prompt_dt: datetime):
-    """Calculate all event times based on prompt time"""
-    return {
-        "reminder": prompt_dt + timedelta(hours=REMINDER_HOURS),
-        "reveal": prompt_dt + timedelta(hours=REVEAL_HOURS),
-        "cleanup": prompt_dt + timedelta(hours=CLEANUP_HOURS),
-    }
+async def is_member(bot, chat_id: int, user_id: int) -> bool:
+    try:
+        member = await DISPATCHER.call(bot.get_chat_member, chat_id=chat_id, user_id=user_id)
+    except Exception:
+        return False
+    return member.status in (ChatMember.MEMBER, ChatMember.RESTRICTED, ChatMember.ADMINISTRATOR,
+                             ChatMember.OWNER)
 
 
 def format_datetime(dt: datetime) -> str:
@@ -181,16 +231,76 @@ def format_datetime(dt: datetime) -> str:
     return dt.strftime("%A %H:%M")  # e.g., "Friday 18:00"
 
 
-def get_daily_prompt_text() -> str:
-    used = load_json(USED_PROMPTS_FILE).get("used", [])
-    if len(used) >= len(PROMPTS):
-        used = []
-    choices = [i for i in range(len(PROMPTS)) if i not in used]
-    idx = random.choice(choices)
-    used.append(idx)
-    save_json(USED_PROMPTS_FILE, {"used": used})
-    p = PROMPTS[idx]
-    return f"🌞 <b>Daily Prompt</b>\n🧭 <b>Topic:</b> {p['topic']}\n💬 <b>Prompt:</b> {p['text']}"
+def get_daily_prompt_text(state: RoundState) -> str:
+    """Draw the group's next prompt (no repeats until its deck is used up) and persist the deck."""
+    PROMPT_CATALOG.refresh()
+    deck = PromptDeck(state.get_prompt_deck())  # drawn on a copy, stored back with set_prompt_deck
+    if state.legacy_used_prompts:
+        # Old state stored indices into the built-in list, which prompts.json keeps in the same order
+        ids = PROMPT_CATALOG.ids()
+        deck.mark_used(PROMPT_CATALOG, [ids[i] for i in state.legacy_used_prompts if i < len(ids)])
+    p = deck.draw(PROMPT_CATALOG, PROMPT_ROTATION)
+    state.set_prompt_deck(deck.to_dict())
+    state.set_round_topic(p.topic)  # archived with the round's replies, for the per-topic stats
+    return f"🌞 <b>Daily Prompt</b>\n🧭 <b>Topic:</b> {p.topic}\n💬 <b>Prompt:</b> {p.text}"
+
+
+def render_texts(state: Optional[RoundState], bot_link: str) -> tuple[dict[str, str], Optional[float]]:
+    """The group's cached texts (see render.py), and when they go stale. `{name}` is filled in per user."""
+    zone_name = group_schedule(state).tz
+    last_prompt = state.last_prompt_time if state else None
+    if last_prompt:
+        times = calculate_event_times(state, last_prompt)
+        expires = None  # only a new prompt or schedule changes these
+        timing_info = (f"• Current round reveal: <b>{format_datetime(times['reveal'])}</b>\n"
+                       f"• Discussion closes: <b>{format_datetime(times['cleanup'])}</b>")
+        schedule_head = (f"🕒 <b>Current Round Schedule ({zone_name})</b>\n"
+                         f"• Prompt was: {format_datetime(last_prompt)}")
+        welcome_timing = f"before <b>{format_datetime(times['reveal'])}</b>"
+        discussion_timing = f"until <b>{format_datetime(times['cleanup'])}</b>"
+    else:
+        next_prompt = next_prompt_at(state)
+        times = calculate_event_times(state, next_prompt)
+        expires = next_prompt.timestamp()  # "next prompt" is wrong once it has gone out
+        timing_info = f"• Next prompt: <b>{format_datetime(next_prompt)}</b>"
+        schedule_head = f"🕒 <b>Next Round Schedule ({zone_name})</b>\n• Prompt: {format_datetime(next_prompt)}"
+        welcome_timing = "when the next prompt arrives"
+        discussion_timing = "for now"
+
+    return {
+        "start": ("Hey! I'll post a daily prompt in the main group.\n\n"
+                  "• Reply to me <b>privately</b> (text or voice/audio) to participate.\n"
+                  f"{timing_info}\n\n"
+                  f"If you haven't yet, open a DM with me here: {bot_link}"),
+        "nexttimes": (f"{schedule_head}\n"
+                      f"• Reminder: {format_datetime(times['reminder'])}\n"
+                      f"• Reveal: {format_datetime(times['reveal'])}\n"
+                      f"• Cleanup: {format_datetime(times['cleanup'])}"),
+        "welcome_main": ("👋 Welcome, {name}!\n"
+                         f"To join the daily prompt, please DM the bot first: {bot_link}\n"
+                         f"Then send your answer there {welcome_timing}."),
+        "welcome_discussion": f"👋 Welcome, {{name}}! Today's chat stays open {discussion_timing}. Enjoy!",
+    }, expires
+
+
+RENDERS = RenderCache(render_texts)  # rendered once per round; invalidated wherever a round's times change
+
+
+async def send_welcome(bot, chat_id: int, text: str):
+    await DISPATCHER.call(bot.send_message, chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
+
+
+WELCOMES = WelcomeBatcher(send_welcome, WELCOME_WINDOW)  # joins in a burst get one welcome per chat
+
+
+class _MainGroupFilter(filters.MessageFilter):
+    """Messages in any registered main group (the set changes at runtime, so filters.Chat won't do)."""
+
+    def filter(self, message) -> bool:
+        return message.chat.id in TENANTS.states
+
+
+MAIN_GROUPS = _MainGroupFilter(name="MainGroups")
 
 
 # =========================
@@ -199,74 +309,81 @@ def get_daily_prompt_text() -> str:
 
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Reply in DMs or group with basic instructions."""
-    bot = await context.bot.get_me()
-    bot_link = f"https://t.me/{bot.username}"
-
-    # Get next event times
-    last_prompt = get_last_prompt_time()
-    if last_prompt:
-        times = calculate_event_times(last_prompt)
-        reveal_str = format_datetime(times["reveal"])
-        cleanup_str = format_datetime(times["cleanup"])
-        timing_info = f"• Current round reveal: <b>{reveal_str}</b>\n• Discussion closes: <b>{cleanup_str}</b>"
+    # The group this is about: the chat itself in a group, the user's group in a DM
+    if update.effective_chat.type == "private":
+        state = TENANTS.route(update.effective_user.id)
     else:
-        next_prompt = next_dt_at(PROMPT_TIME)
-        timing_info = f"• Next prompt: <b>{format_datetime(next_prompt)}</b>"
+        state = TENANTS.get(update.effective_chat.id)
 
-    text = (
-        "Hey! I'll post a daily prompt in the main group.\n\n"
-        "• Reply to me <b>privately</b> (text or voice/audio) to participate.\n"
-        f"{timing_info}\n\n"
-        f"If you haven't yet, open a DM with me here: {bot_link}"
-    )
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    text = RENDERS.get(state, "start", context.bot)
+    if update.effective_chat.type == "private" and len(TENANTS) > 1:
+        text += "\n\nIn more than one group with me? Use /join to pick the one your replies go to."
+    await reply(update, text, parse_mode=ParseMode.HTML)
+
+
+async def note_group_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before the other handlers: remember which main group each user is active in (for DM routing)."""
+    user = update.effective_user
+    if user and not user.is_bot and update.effective_chat and update.effective_chat.id in TENANTS.states:
+        TENANTS.see_user(user.id, update.effective_chat.id)
 
 
 async def welcome_new_in_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Welcome message when *main* group gets a new member."""
-    if update.effective_chat.id != MAIN_GROUP_ID:
+    """Welcome message when a *main* group gets a new member."""
+    state = TENANTS.get(update.effective_chat.id)
+    if state is None:
         return
-    bot = await context.bot.get_me()
-    bot_link = f"https://t.me/{bot.username}"
-
-    last_prompt = get_last_prompt_time()
-    if last_prompt:
-        times = calculate_event_times(last_prompt)
-        reveal_str = format_datetime(times["reveal"])
-        timing = f"before <b>{reveal_str}</b>"
-    else:
-        timing = "when the next prompt arrives"
+    welcome = RENDERS.get(state, "welcome_main", context.bot)
 
     for user in update.message.new_chat_members:
-        name = user.first_name or "there"
-        await context.bot.send_message(
-            chat_id=MAIN_GROUP_ID,
-            text=(f"👋 Welcome, {name}!\n"
-                  f"To join the daily prompt, please DM the bot first: {bot_link}\n"
-                  f"Then send your answer there {timing}."),
-            parse_mode=ParseMode.HTML
-        )
+        if not user.is_bot:
+            TENANTS.see_user(user.id, state.tenant_id)
+        WELCOMES.add(context.bot, state.tenant_id, user.first_name or "there", welcome)
 
 
 async def welcome_in_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Tiny welcome if someone joins the discussion group (optional nicety)."""
-    disc_id = get_discussion_chat_id()
-    if disc_id and update.effective_chat.id == disc_id:
-        last_prompt = get_last_prompt_time()
-        if last_prompt:
-            times = calculate_event_times(last_prompt)
-            cleanup_str = format_datetime(times["cleanup"])
-            timing = f"until <b>{cleanup_str}</b>"
-        else:
-            timing = "for now"
+    """Tiny welcome if someone joins a discussion group (optional nicety). Also records who joined."""
+    state = TENANTS.for_discussion(update.effective_chat.id)
+    if state is not None:
+        disc_id = state.discussion_chat_id
+        for user in update.message.new_chat_members:
+            if not user.is_bot:
+                state.add_member(open_round_key(state), user.id)
 
+        welcome = RENDERS.get(state, "welcome_discussion", context.bot)
         for user in update.message.new_chat_members:
-            await context.bot.send_message(
-                chat_id=disc_id,
-                text=(f"👋 Welcome, {user.first_name or 'friend'}! "
-                      f"Today's chat stays open {timing}. Enjoy!"),
-                parse_mode=ParseMode.HTML
-            )
+            WELCOMES.add(context.bot, disc_id, user.first_name or "friend", welcome)
+
+
+async def track_left_discussion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Someone left (or was removed from) a discussion group: stop tracking them."""
+    state = TENANTS.for_discussion(update.effective_chat.id)
+    if state is not None:
+        state.remove_member(update.message.left_chat_member.id)
+
+
+async def track_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """chat_member updates: the reliable source for joins/leaves (service messages can be hidden)."""
+    change = update.chat_member
+    user = change.new_chat_member.user
+    if user.is_bot:
+        return
+    joined = change.new_chat_member.status in (ChatMember.MEMBER, ChatMember.RESTRICTED)
+    left = change.new_chat_member.status in (ChatMember.LEFT, ChatMember.BANNED)
+
+    # Main group: remember the user belongs there, for routing their DMs
+    if change.chat.id in TENANTS.states:
+        if joined:
+            TENANTS.see_user(user.id, change.chat.id)
+        return
+
+    state = TENANTS.for_discussion(change.chat.id)
+    if state is None:
+        return
+    if joined:
+        state.add_member(open_round_key(state), user.id)
+    elif left:
+        state.remove_member(user.id)
 
 
 async def collect_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -274,68 +391,302 @@ async def collect_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type != "private":
         return
 
-    # Load existing replies (now a dict of lists)
-    replies = load_json(REPLIES_FILE)
-    uid = str(update.message.from_user.id)
+    user_id = update.message.from_user.id
+    state = TENANTS.route(user_id)
+    if state is None:
+        await reply(update, "I'm not sure which group this reply is for — use /join to pick your group first.")
+        return
+
+    round_key = current_round_key(state)  # the last prompt's round, also after midnight
+    async with USER_LOCKS.hold((state.tenant_id, round_key, user_id)):
+        # Append this message and track the participant for THIS round (flushed to disk in the background)
+        if state.add_reply(round_key, ReplyRecord.from_message(update.message)):
+            await reply(update, "Got it! Your reply's saved for this round 💬")
 
-    # Initialize list if first reply from this user
-    if uid not in replies:
-        replies[uid] = []
 
-    # Append this message to their list
-    replies[uid].append(update.message.to_dict())
-    save_json(REPLIES_FILE, replies)
+async def cmd_join(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """In a DM: pick which group your replies go to (/join, or /join <group id>)."""
+    if update.effective_chat.type != "private":
+        await reply(update, "Send /join to me in a private chat.")
+        return
+    user_id = update.effective_user.id
+
+    if context.args:
+        try:
+            state = TENANTS.get(int(context.args[0]))
+        except ValueError:
+            state = None
+        if state is None or not await is_member(context.bot, state.tenant_id, user_id):
+            await reply(update, "I don't know that group, or you're not in it.")
+            return
+        TENANTS.see_user(user_id, state.tenant_id, pinned=True)
+        await reply(update, f"✅ Your replies now go to <b>{state.title or state.tenant_id}</b>.",
+                    parse_mode=ParseMode.HTML)
+        return
+
+    groups = TENANTS.groups_of(user_id)
+    if not groups:
+        await reply(update, "I haven't seen you in any of my groups yet. Say something in your group, "
+                            "or use /join <group id> (a group admin can get it with /register).")
+        return
+    current = TENANTS.route(user_id)
+    buttons = [[InlineKeyboardButton(("✅ " if s is current else "") + (s.title or str(s.tenant_id)),
+                                     callback_data=f"join:{s.tenant_id}")] for s in groups]
+    await reply(update, "Which group are your replies for?", reply_markup=InlineKeyboardMarkup(buttons))
+
+
+async def on_join_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Button from /join."""
+    query = update.callback_query
+    state = TENANTS.get(int(query.data.split(":", 1)[1]))
+    if state is None:
+        await DISPATCHER.call(query.answer, "That group is gone.", priority=PRIORITY_HIGH)
+        return
+    TENANTS.see_user(query.from_user.id, state.tenant_id, pinned=True)
+    await DISPATCHER.call(query.answer, priority=PRIORITY_HIGH)
+    await DISPATCHER.call(query.edit_message_text, f"✅ Your replies now go to {state.title or state.tenant_id}.",
+                          key=query.message.chat.id, priority=PRIORITY_HIGH)
+
 
-    # Track participant for THIS round
-    p = get_participants()
-    current = set(p["current"])
-    current.add(int(uid))
-    set_participants(sorted(current), p.get("last_invite_link"), today_key())
+async def cmd_register(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Run in a group (by an admin) to make it a main group: it gets its own daily prompt and rounds."""
+    chat = update.effective_chat
+    if chat.type not in ("group", "supergroup"):
+        await reply(update, "Run /register <b>inside the group</b> that should get the daily prompt.",
+                    parse_mode=ParseMode.HTML)
+        return
+    if not await is_admin(context.bot, chat.id, update.effective_user.id):
+        await reply(update, "Only a group admin can do that.")
+        return
+    if TENANTS.for_discussion(chat.id) is not None:
+        await reply(update, "This chat is already a discussion space for another group.")
+        return
 
-    await update.message.reply_text("Got it! Your reply's saved for this round 💬")
+    new = chat.id not in TENANTS.states
+    TENANTS.add(chat.id, chat.title)
+    TENANTS.see_user(update.effective_user.id, chat.id)
+    if new:
+        schedule_next_prompt(TENANTS.get(chat.id))
+    await reply(
+        update,
+        (f"✅ This group gets the daily prompt (group id <code>{chat.id}</code>).\n"
+         f"To pick the discussion group, run <code>/setdiscussion {chat.id}</code> there."),
+        parse_mode=ParseMode.HTML
+    )
 
 
 async def cmd_setdiscussion(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Run this *inside the discussion group* once. It marks that chat as the discussion room."""
+    """
+    Run this *inside the discussion group* once. It marks that chat as the discussion room
+    of the given main group (/setdiscussion <group id>; the id can be left out if there is only one).
+    """
     chat = update.effective_chat
     if chat.type not in ("group", "supergroup"):
-        await update.message.reply_text(
+        await reply(
+            update,
             "Run /setdiscussion <b>inside the discussion group</b> you want me to use.",
             parse_mode=ParseMode.HTML
         )
         return
-    set_discussion_chat_id(chat.id)
-    await update.message.reply_text("✅ This chat is now set as the discussion space.")
+
+    if context.args:
+        try:
+            state = TENANTS.get(int(context.args[0]))
+        except ValueError:
+            state = None
+        # Pairing someone else's group needs admin rights there
+        if state is None or not await is_admin(context.bot, state.tenant_id, update.effective_user.id):
+            await reply(update, "I don't know that group, or you're not an admin there.")
+            return
+    elif len(TENANTS) == 1:
+        state = next(iter(TENANTS))
+    else:
+        await reply(update, "Which group is this for? Run /setdiscussion &lt;group id&gt; "
+                            "(/register in the main group shows its id).", parse_mode=ParseMode.HTML)
+        return
+
+    if chat.id in TENANTS.states:
+        await reply(update, "This chat is a main group; pick a separate chat for discussions.")
+        return
+    TENANTS.set_discussion(state, chat.id)
+    await reply(update, "✅ This chat is now set as the discussion space.")
+
+
+async def cmd_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Run in a main group (admins): /schedule HH:MM [timezone] [reminder reveal cleanup hours].
+    Without arguments it shows the group's current schedule.
+    """
+    state = TENANTS.get(update.effective_chat.id)
+    if state is None:
+        await reply(update, "Run /schedule in a main group (see /register).")
+        return
+    current = group_schedule(state)
+
+    if not context.args:
+        await reply(
+            update,
+            (f"🕒 Prompt at <b>{current.prompt_time.strftime('%H:%M')}</b> ({current.tz}); reminder, reveal "
+             f"and cleanup {current.reminder_hours:g}h / {current.reveal_hours:g}h / {current.cleanup_hours:g}h "
+             f"later.\nChange it with <code>/schedule HH:MM [timezone] [reminder reveal cleanup]</code>."),
+            parse_mode=ParseMode.HTML
+        )
+        return
+    if not await is_admin(context.bot, state.tenant_id, update.effective_user.id):
+        await reply(update, "Only a group admin can do that.")
+        return
+
+    args = list(context.args)
+    try:
+        changes = {"prompt_time": time.fromisoformat(args.pop(0)).strftime("%H:%M")}
+        if args and not args[0].replace(".", "", 1).isdigit():
+            changes["tz"] = args.pop(0)
+        if args:
+            if len(args) != 3:
+                raise ValueError("give all three hours: reminder reveal cleanup")
+            changes.update(zip(("reminder_hours", "reveal_hours", "cleanup_hours"), map(float, args)))
+        schedule = GroupSchedule.from_dict({**current.to_dict(), **changes}, DEFAULT_SCHEDULE)
+        schedule.validate()
+    except ValueError as e:
+        await reply(update, f"That doesn't work: {e}")
+        return
+
+    state.set_schedule(schedule.to_dict())
+    RENDERS.invalidate(state)
+    schedule_next_prompt(state)  # a round already running keeps the times it announced
+    await reply(update, f"✅ Next prompt: <b>{format_datetime(next_prompt_at(state))}</b> ({schedule.tz}).",
+                parse_mode=ParseMode.HTML)
 
 
 # =========================
 # ⏰ SCHEDULED JOBS
 # =========================
+# Jobs are run by SCHEDULER as `job(bot, state, due)` (due: the scheduled time, unix); see run_scheduled_event.
+
+def schedule_next_prompt(state: RoundState):
+    """(Re)queue the group's next prompt, replacing the one already queued (if it moved)."""
+    due = next_prompt_at(state)
+    if SCHEDULER.pending(state.tenant_id, "prompt") != due.timestamp():
+        SCHEDULER.schedule(state.tenant_id, "prompt", due, replace=True)
+
 
-async def job_send_prompt(context: CallbackContext):
-    """Post the prompt in main group, reset round storage, and schedule follow-up events."""
-    bot = context.bot
-    now = datetime.now(TZ)
+def schedule_round(state: RoundState, times: dict):
+    """Queue the reminder, reveal and cleanup of one group's round."""
+    for event in ROUND_EVENTS:
+        SCHEDULER.schedule(state.tenant_id, event, times[event])
+
+
+def last_run(state: RoundState, event: str) -> Optional[float]:
+    """Due time (unix) of the last run of `event` that started, or None if there is no record of one."""
+    last = state.event_marks.get(event)
+    if event == "prompt" and state.last_prompt_time:
+        # The post time of the last prompt is its own marker (always after its due time)
+        last = max(last or 0.0, state.last_prompt_time.timestamp())
+    return last
+
+
+def missed(state: RoundState, event: str, due: datetime, following: datetime, now: datetime) -> bool:
+    """
+    Was `event` due at `due` skipped (nobody running jobs then), and should it still run? Not once its
+    next occurrence (`following`) is due as well. Missed events that won't run are logged.
+    """
+    last = last_run(state, event)
+    if due > now or (last is not None and due.timestamp() <= last):
+        return False
+    if last is None:
+        # Without a marker we can't tell whether it ran, and running a reveal twice is worse than not at all
+        reason = "no record of an earlier run"
+    elif following <= now:
+        reason = f"the next one was due at {following}"
+    else:
+        return True
+    logging.warning("Skipping missed %s for %s (was due %s): %s", event, state.tenant_id, due, reason)
+    return False
+
+
+def queue_group(state: RoundState, now: datetime) -> list[tuple[datetime, str]]:
+    """
+    Queue a group's next prompt and what is left of its current round.
+    Returns the missed events that should still run, as (due, event), for the caller to catch up.
+    """
+    overdue = []
+    if last_run(state, "prompt") is None:
+        # A new group starts with its next prompt
+        schedule_next_prompt(state)
+    else:
+        # Every prompt since the last one that ran was missed; only the latest may still go out
+        due = next_prompt_at(state, after=datetime.fromtimestamp(last_run(state, "prompt"), TZ))
+        while due <= now:
+            after = next_prompt_at(state, after=due)
+            if missed(state, "prompt", due, after, now):
+                overdue.append((due, "prompt"))
+            due = after
+        if not overdue:
+            schedule_next_prompt(state)
+
+    if state.last_prompt_time:
+        times = calculate_event_times(state, state.last_prompt_time)
+        # The same events of the round after this one (from the prompt that follows the last one)
+        nexts = calculate_event_times(state, next_prompt_at(state, after=state.last_prompt_time))
+        for event in ROUND_EVENTS:
+            if times[event] > now:
+                SCHEDULER.schedule(state.tenant_id, event, times[event])
+            elif missed(state, event, times[event], nexts[event], now):
+                overdue.append((times[event], event))
+    return overdue
+
+
+async def run_scheduled_event(bot, tenant_id: int, event: str, due: float):
+    """SCHEDULER callback: run one group's due event (only while we hold the lease)."""
+    with log_context(chat=tenant_id, handler=f"job_{event}"):
+        await _run_scheduled_event(bot, tenant_id, event, due)
+
+
+async def _run_scheduled_event(bot, tenant_id: int, event: str, due: float):
+    if not LEASE.is_leader:
+        logging.warning("Skipping %s for %s: not the leader any more", event, tenant_id)
+        return
+    if TENANTS.shared:
+        # Replies may have come in through other workers a moment ago
+        await asyncio.to_thread(TENANTS.sync)
+    state = TENANTS.get(tenant_id)
+    if state is None:
+        logging.error("%s for unknown group %s", event, tenant_id)
+        return
+    state.mark_event(event, due)
+    if event == "prompt":
+        # Queue tomorrow's prompt first, so a failed post doesn't end the chain
+        schedule_next_prompt(state)
+    # Fan-out tasks (outbox steps, dispatcher calls) started inside inherit the round in their log lines
+    with EVENT_SECONDS.time(event=event), log_context(round=event_round_key(state, event, due)):
+        await JOBS[event](bot, state, due)
 
-    # Reset state for a new round
-    save_json(REPLIES_FILE, {})
-    set_participants([], None, today_key())
 
-    # Save when this prompt was posted
-    set_last_prompt_time(now)
+async def job_send_prompt(bot, state: RoundState, due: float):
+    """Post the prompt in the main group, reset round storage, and schedule follow-up events."""
+    main_id = state.tenant_id
+    now = group_schedule(state).now()
+
+    # Draw first: if the catalog can't give a prompt, the round in progress is left as it is
+    prompt = get_daily_prompt_text(state)
+
+    # Reset state for a new round and save when this prompt was posted
+    state.clear_replies()
+    state.set_participants([], None, today_key(state))
+    state.set_last_prompt_time(now, today_key(state, now))
+    RENDERS.invalidate(state)  # /start, /nexttimes and welcomes now describe this round
 
     # Unpin old prompt if any
     try:
-        chat = await bot.get_chat(MAIN_GROUP_ID)
+        chat = await DISPATCHER.call(bot.get_chat, main_id)
         if chat.pinned_message:
-            await bot.unpin_chat_message(MAIN_GROUP_ID)
+            await DISPATCHER.call(bot.unpin_chat_message, main_id)
     except Exception as e:
-        logging.info(f"No old pin to unpin or error: {e}")
+        logging.info("No old pin to unpin or error: %s", e)
 
     # Calculate event times for this round
-    times = calculate_event_times(now)
+    times = calculate_event_times(state, now)
 
-    prompt = get_daily_prompt_text()
     text = (
         f"{prompt}\n\n"
         "📝 <b>How it works:</b>\n"
@@ -344,156 +695,285 @@ async def job_send_prompt(context: CallbackContext):
         f"• Discussion stays open until <b>{format_datetime(times['cleanup'])}</b>.\n"
         "• Only people who replied will receive a private invite link. 💬"
     )
-    msg = await bot.send_message(chat_id=MAIN_GROUP_ID, text=text, parse_mode=ParseMode.HTML)
+    msg = await DISPATCHER.call(bot.send_message, chat_id=main_id, text=text, parse_mode=ParseMode.HTML,
+                                priority=PRIORITY_HIGH)
     try:
-        await bot.pin_chat_message(chat_id=MAIN_GROUP_ID, message_id=msg.message_id)
+        await DISPATCHER.call(bot.pin_chat_message, chat_id=main_id, message_id=msg.message_id)
     except Exception as e:
-        logging.warning(f"Pin error: {e}")
+        logging.warning("Pin error: %s", e)
 
     # Schedule the reminder, reveal, and cleanup for THIS prompt
-    context.job_queue.run_once(job_reminder, times["reminder"])
-    context.job_queue.run_once(job_reveal, times["reveal"])
-    context.job_queue.run_once(job_cleanup, times["cleanup"])
+    schedule_round(state, times)
 
-    logging.info(
-        f"Prompt posted. Reminder: {times['reminder']}, Reveal: {times['reveal']}, Cleanup: {times['cleanup']}")
+    logging.info("Prompt posted in %s. Reminder: %s, Reveal: %s, Cleanup: %s",
+                 main_id, times["reminder"], times["reveal"], times["cleanup"])
 
 
-async def job_reminder(context: CallbackContext):
+async def job_reminder(bot, state: RoundState, due: float):
     """Send reminder before reveal."""
-    last_prompt = get_last_prompt_time()
-    if not last_prompt:
+    if not state.last_prompt_time:
         return
 
-    times = calculate_event_times(last_prompt)
-    await context.bot.send_message(
-        chat_id=MAIN_GROUP_ID,
+    times = calculate_event_times(state, state.last_prompt_time)
+    await DISPATCHER.call(
+        bot.send_message,
+        chat_id=state.tenant_id,
         text=(f"⏳ <b>Reminder:</b> last minutes to reply privately before reveal at "
               f"<b>{format_datetime(times['reveal'])}</b>."),
         parse_mode=ParseMode.HTML
     )
 
 
-async def job_reveal(context: CallbackContext):
+FORWARD_BATCH_SIZE = 100  # Bot API limit for forward_messages/copy_messages
+OUTBOX_RETENTION_DAYS = 7  # finished reveal/cleanup batches are kept this long
+
+
+async def send_attributed(bot, disc_id: int, name: str, text: Optional[str], anonymous: bool = False):
+    """Fallback when forwarding fails: repost the text, attributed unless the round is anonymous."""
+    user = "Someone" if anonymous else name
+    if text:
+        await DISPATCHER.call(
+            bot.send_message,
+            chat_id=disc_id,
+            text=f"💬 <b>{user} said:</b> {text}",
+            parse_mode=ParseMode.HTML
+        )
+
+
+def plan_forwards(disc_id: int, replies: dict[int, list[ReplyRecord]], stage: int) -> list[tuple[int, str, dict]]:
+    """
+    Outbox items that put every reply in the discussion group, in order (one stage each):
+    one forward_messages (or copy_messages when anonymous) call per user and 100 replies in "batch" mode,
+    one forward_message per reply in "forward" mode.
+    """
+    anonymous = REVEAL_MODE == "anonymous"
+    if REVEAL_MODE == "digest":
+        return plan_digest(disc_id, replies, stage)
+    if REVEAL_MODE in ("batch", "anonymous"):
+        method, size = ("copy_messages" if anonymous else "forward_messages"), FORWARD_BATCH_SIZE
+    else:
+        method, size = "forward_message", 1
+    items = []
+    # Users go in the order of their first reply; only a call that fails falls back to attributed text
+    for uid, message_list in replies.items():
+        for start in range(0, len(message_list), size):
+            batch = message_list[start:start + size]
+            items.append((stage, "forward", {
+                "chat_id": disc_id, "from_chat_id": uid, "method": method, "anonymous": anonymous,
+                "message_ids": [msg.message_id for msg in batch],  # already ascending: stored as received
+                "name": batch[0].name, "texts": [msg.text for msg in batch],
+            }))
+            stage += 1
+    return items
+
+
+def plan_digest(disc_id: int, replies: dict[int, list[ReplyRecord]], stage: int) -> list[tuple[int, str, dict]]:
+    """
+    Outbox items for the "digest" mode: every text reply in as few messages as fit (about total chars / 4096),
+    then each user's voice/audio replies in one forward_messages call per 100.
+    """
+    texts = [(message_list[0].name, [msg.text for msg in message_list if msg.kind == KIND_TEXT and msg.text])
+             for message_list in replies.values()]  # users without text replies get no entry
+    items = [(stage + n, "send", {"chat_id": disc_id, "text": text}) for n, text in enumerate(pack_digest(texts))]
+    stage += len(items)
+    for uid, message_list in replies.items():
+        media = [msg for msg in message_list if msg.kind != KIND_TEXT or not msg.text]
+        for start in range(0, len(media), FORWARD_BATCH_SIZE):
+            batch = media[start:start + FORWARD_BATCH_SIZE]
+            items.append((stage, "forward", {
+                "chat_id": disc_id, "from_chat_id": uid, "method": "forward_messages", "anonymous": False,
+                "message_ids": [msg.message_id for msg in batch], "name": batch[0].name,
+                "texts": [None] * len(batch),  # nothing to repost as text if forwarding fails
+            }))
+            stage += 1
+    return items
+
+
+async def job_reveal(bot, state: RoundState, due: float):
     """Forward replies into discussion, DM invite link to today's participants."""
-    bot = context.bot
-    replies = load_json(REPLIES_FILE)
+    await OUTBOX.run(state.tenant_id, f"{state.tenant_id}:reveal:{int(due)}", lambda: plan_reveal(state),
+                     bot, state)
+
+
+def plan_reveal(state: RoundState) -> list[tuple[int, str, dict]]:
+    """Everything the reveal does, as outbox items. Runs once per reveal (not again when it is resumed)."""
+    replies = state.get_replies()
 
-    disc_id = get_discussion_chat_id()
+    disc_id = state.discussion_chat_id
     if not disc_id:
-        # Safety fallback: use MAIN_GROUP if discussion group not configured
-        disc_id = MAIN_GROUP_ID
-        logging.warning("Discussion group not set. Using MAIN_GROUP_ID as discussion room.")
+        # Safety fallback: use the main group if no discussion group is configured
+        disc_id = state.tenant_id
+        logging.warning("Discussion group not set for %s. Using the main group as discussion room.", state.tenant_id)
 
-    last_prompt = get_last_prompt_time()
+    last_prompt = state.last_prompt_time
     if not last_prompt:
-        logging.error("No last_prompt_time found for reveal.")
-        return
+        logging.error("No last_prompt_time found for reveal in %s.", state.tenant_id)
+        return []
 
-    times = calculate_event_times(last_prompt)
+    times = calculate_event_times(state, last_prompt)
 
     # Open the room
-    await bot.send_message(
-        chat_id=disc_id,
-        text=(f"🔓 <b>Discussion open!</b> Here are today's replies — react & comment.\n"
-              f"Chat stays open until <b>{format_datetime(times['cleanup'])}</b>."),
-        parse_mode=ParseMode.HTML
-    )
+    items = [(0, "send", {
+        "chat_id": disc_id, "priority": PRIORITY_HIGH,
+        "text": (f"🔓 <b>Discussion open!</b> Here are today's replies — react & comment.\n"
+                 f"Chat stays open until <b>{format_datetime(times['cleanup'])}</b>."),
+    })]
 
-    # Forward every reply (text, voice/audio) - now handles multiple messages per user
-    for uid, message_list in replies.items():
-        for msg in message_list:
-            try:
-                await bot.forward_message(
-                    chat_id=disc_id,
-                    from_chat_id=int(uid),
-                    message_id=msg["message_id"]
-                )
-            except Exception as e:
-                # Fallback: attributed text if forwarding fails
-                user = msg.get("from", {}).get("first_name", "Someone")
-                text = msg.get("text")
-                if text:
-                    await bot.send_message(
-                        chat_id=disc_id,
-                        text=f"💬 <b>{user} said:</b> {text}",
-                        parse_mode=ParseMode.HTML
-                    )
-                logging.info(f"Forward failed for {uid}, msg {msg['message_id']}: {e}")
+    # Forward every reply (text, voice/audio) - multiple messages per user, in the order they came in
+    items += plan_forwards(disc_id, replies, stage=1)
+    stage = items[-1][0] + 1
 
     # Create a one-time invite link that expires at cleanup (unlimited members)
-    expire_ts = int(times["cleanup"].timestamp())
-    invite_obj: Optional[ChatInviteLink] = None
+    items.append((stage, "invite_link", {"chat_id": disc_id, "expire_date": int(times["cleanup"].timestamp())}))
+
+    # DM the link to this round's participants only (the reveal usually runs the day after the prompt)
+    p = state.get_participants()
+    same_round = (p["last_round"] == current_round_key(state))
+    ids = p["current"] if same_round else []
+    if not ids:
+        logging.info("No participants recorded for this round to DM in %s.", state.tenant_id)
+    invite_text = (f"🗣 Your discussion link for today is ready!\n"
+                   "Join here: {invite_link}\n\n"
+                   f"(Link expires at <b>{format_datetime(times['cleanup'])}</b>.)")
+    # Fanned out all at once; the dispatcher paces them to the flood limits
+    items += [(stage + 1, "dm_invite", {"chat_id": uid, "text": invite_text}) for uid in ids]
+
+    # Persist the link for cleanup, then move the replies to the archive (participants remain until cleanup)
+    items.append((stage + 2, "save_invite_link", {}))
+    items.append((stage + 2, "clear_replies", {"round": current_round_key(state)}))
+    return items
+
+
+async def job_cleanup(bot, state: RoundState, due: float):
+    """Close the discussion and remove the members who joined for this round."""
+    await OUTBOX.run(state.tenant_id, f"{state.tenant_id}:cleanup:{int(due)}", lambda: plan_cleanup(state, due),
+                     bot, state)
+    RENDERS.invalidate(state)
+    await asyncio.to_thread(STORE.outbox_prune, clock.time() - OUTBOX_RETENTION_DAYS * 86400)
+
+
+def plan_cleanup(state: RoundState, due: float) -> list[tuple[int, str, dict]]:
+    """Everything the cleanup does, as outbox items."""
+    disc_id = state.discussion_chat_id or state.tenant_id
+    p = state.get_participants()
+
+    # Revoke last invite link, and the closing message
+    items = []
+    if p.get("last_invite_link"):
+        items.append((0, "revoke", {"chat_id": disc_id, "invite_link": p["last_invite_link"]}))
+    items.append((0, "send", {"chat_id": disc_id, "text": "🧹 Discussion closed — see you at the next prompt!"}))
+
+    # Remove who we saw join for this round (requires admin with 'Ban Users'). Not the current participants:
+    # the next round's prompt has gone out by now, and its repliers haven't been let in yet
+    round_key = event_round_key(state, "cleanup", due)
+    ids = sorted(state.round_members(round_key))
+    items += [(1, "kick", {"chat_id": disc_id, "user_id": uid}) for uid in ids]
+    logging.info("Cleanup in %s kicks %d member(s) who joined for round %s", state.tenant_id, len(ids), round_key)
+
+    # Forget this round's participants, and count the round in the /stats counters
+    items.append((2, "reset_participants", {"round": round_key}))
+    items.append((2, "close_round", {"round": round_key}))
+    return items
+
 
+# =========================
+# 📮 OUTBOX STEPS
+# =========================
+# Reveal and cleanup are written to the outbox as items before they run (see outbox.py),
+# so a restart resumes only what is unfinished. Steps are called as `step(bot, state, payload, run)`.
+
+
+@OUTBOX.step("send")
+async def step_send(bot, state: RoundState, payload: dict, run: BatchRun):
+    await DISPATCHER.call(bot.send_message, chat_id=payload["chat_id"], text=payload["text"],
+                          parse_mode=ParseMode.HTML, priority=payload.get("priority", PRIORITY_NORMAL))
+
+
+@OUTBOX.step("forward")
+async def step_forward(bot, state: RoundState, payload: dict, run: BatchRun):
+    disc_id, uid, ids = payload["chat_id"], payload["from_chat_id"], payload["message_ids"]
     try:
-        invite_obj = await bot.create_chat_invite_link(
-            chat_id=disc_id,
-            expire_date=expire_ts
+        if payload["method"] == "forward_message":
+            await DISPATCHER.call(bot.forward_message, chat_id=disc_id, from_chat_id=uid, message_id=ids[0])
+        else:
+            await DISPATCHER.call(getattr(bot, payload["method"]), chat_id=disc_id, from_chat_id=uid,
+                                  message_ids=ids)
+    except Exception as e:
+        # Fallback: attributed text if forwarding fails
+        for text in payload["texts"]:
+            await send_attributed(bot, disc_id, payload["name"], text, payload["anonymous"])
+        logging.info("Forward failed for %s (%d msgs): %s", uid, len(ids), e)  # rate-limited per template (logs.py)
+
+
+@OUTBOX.step("invite_link")
+async def step_invite_link(bot, state: RoundState, payload: dict, run: BatchRun) -> str:
+    try:
+        invite_obj: ChatInviteLink = await DISPATCHER.call(
+            bot.create_chat_invite_link,
+            chat_id=payload["chat_id"],
+            expire_date=payload["expire_date"]
             # member_limit omitted = unlimited until expiry
         )
     except Exception as e:
-        logging.error(f"Invite link creation failed. Is the bot admin with 'Invite Users'? Error: {e}")
+        logging.error("Invite link creation failed. Is the bot admin with 'Invite Users'? Error: %s", e)
+        raise
+    return invite_obj.invite_link
 
-    # DM the link to today's participants only
-    p = get_participants()
-    same_round = (p["last_round"] == today_key())
-    ids = p["current"] if same_round else []
 
-    if not ids:
-        logging.info("No participants recorded for this round to DM.")
-    elif not invite_obj:
-        logging.error("Invite link missing; cannot DM participants.")
-    else:
-        for uid in ids:
-            try:
-                await bot.send_message(
-                    chat_id=uid,
-                    text=(f"🗣 Your discussion link for today is ready!\n"
-                          f"Join here: {invite_obj.invite_link}\n\n"
-                          f"(Link expires at <b>{format_datetime(times['cleanup'])}</b>.)"),
-                    parse_mode=ParseMode.HTML
-                )
-            except Exception as e:
-                # User may not accept DMs or never pressed Start (shouldn't happen if they replied)
-                logging.info(f"DM invite failed for {uid}: {e}")
-
-        # Persist for cleanup
-        set_participants(ids, invite_obj.invite_link, today_key())
-
-    # Clear replies after reveal (participants remain until cleanup)
-    save_json(REPLIES_FILE, {})
-
-
-async def job_cleanup(context: CallbackContext):
-    """Close the discussion and remove participants who joined for this round."""
-    bot = context.bot
-    disc_id = get_discussion_chat_id() or MAIN_GROUP_ID
-    p = get_participants()
-    ids = p["current"]
-
-    # Revoke last invite link
-    if p.get("last_invite_link"):
-        try:
-            await bot.revoke_chat_invite_link(chat_id=disc_id, invite_link=p["last_invite_link"])
-        except Exception as e:
-            logging.info(f"Revoke failed (maybe already expired): {e}")
+@OUTBOX.step("dm_invite")
+async def step_dm_invite(bot, state: RoundState, payload: dict, run: BatchRun):
+    link = run.result("invite_link")
+    if not link:
+        raise RuntimeError("Invite link missing; cannot DM participants.")
+    # User may not accept DMs or never pressed Start (shouldn't happen if they replied)
+    await DISPATCHER.call(bot.send_message, chat_id=payload["chat_id"],
+                          text=payload["text"].replace("{invite_link}", link),
+                          parse_mode=ParseMode.HTML, priority=PRIORITY_BULK)
+
+
+@OUTBOX.step("save_invite_link")
+async def step_save_invite_link(bot, state: RoundState, payload: dict, run: BatchRun):
+    # Only the link is set: replies that arrived while we were sending DMs
+    # have already added their senders, and overwriting the set would drop them
+    link = run.result("invite_link")
+    if link:
+        state.set_invite_link(link)
+
+
+@OUTBOX.step("clear_replies")
+async def step_clear_replies(bot, state: RoundState, payload: dict, run: BatchRun):
+    state.archive_replies(payload["round"])
+
 
-    # Closing message
+@OUTBOX.step("revoke")
+async def step_revoke(bot, state: RoundState, payload: dict, run: BatchRun):
     try:
-        await bot.send_message(chat_id=disc_id, text="🧹 Discussion closed — see you at the next prompt!")
-    except Exception:
-        pass
+        await DISPATCHER.call(bot.revoke_chat_invite_link, chat_id=payload["chat_id"],
+                              invite_link=payload["invite_link"])
+    except Exception as e:
+        logging.info("Revoke failed (maybe already expired): %s", e)
+
+
+@OUTBOX.step("kick")
+async def step_kick(bot, state: RoundState, payload: dict, run: BatchRun):
+    uid = payload["user_id"]
+    await DISPATCHER.call(bot.ban_chat_member, chat_id=payload["chat_id"], user_id=uid, priority=PRIORITY_BULK)
+    # quick unban => kick without ban (both are safe to repeat if we resume halfway)
+    await DISPATCHER.call(bot.unban_chat_member, chat_id=payload["chat_id"], user_id=uid, priority=PRIORITY_BULK)
+    state.remove_member(uid)
+
+
+@OUTBOX.step("reset_participants")
+async def step_reset_participants(bot, state: RoundState, payload: dict, run: BatchRun):
+    state.drop_participants(payload["round"])
 
-    # Remove participants (requires admin with 'Ban Users')
-    for uid in ids:
-        try:
-            await bot.ban_chat_member(chat_id=disc_id, user_id=uid)
-            await bot.unban_chat_member(chat_id=disc_id, user_id=uid)  # quick unban => kick without ban
-        except Exception as e:
-            logging.info(f"Kick failed for {uid}: {e}")
 
-    # Reset participant list
-    set_participants([], None, today_key())
+@OUTBOX.step("close_round")
+async def step_close_round(bot, state: RoundState, payload: dict, run: BatchRun):
+    state.close_round(payload["round"])
+
+
+JOBS = {"prompt": job_send_prompt, "reminder": job_reminder, "reveal": job_reveal, "cleanup": job_cleanup}
 
 
 # =========================
@@ -502,118 +982,383 @@ async def job_cleanup(context: CallbackContext):
 
 async def cmd_nexttimes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show the schedule for current/next round."""
-    last_prompt = get_last_prompt_time()
+    if update.effective_chat.type == "private":
+        state = TENANTS.route(update.effective_user.id)
+    else:
+        state = TENANTS.get(update.effective_chat.id) or TENANTS.for_discussion(update.effective_chat.id)
+    await reply(update, RENDERS.get(state, "nexttimes", context.bot), parse_mode=ParseMode.HTML)
 
-    if last_prompt:
-        times = calculate_event_times(last_prompt)
-        text = (
-            "🕒 <b>Current Round Schedule (Amsterdam)</b>\n"
-            f"• Prompt was: {format_datetime(last_prompt)}\n"
-            f"• Reminder: {format_datetime(times['reminder'])}\n"
-            f"• Reveal: {format_datetime(times['reveal'])}\n"
-            f"• Cleanup: {format_datetime(times['cleanup'])}"
-        )
+
+# =========================
+# 📊 COMMAND: /stats
+# =========================
+
+STATS_TOP = 5  # members, streaks and topics listed
+
+
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Participation counters of the group (and, in a DM, the user's own)."""
+    user_id = update.effective_user.id
+    if update.effective_chat.type == "private":
+        state = TENANTS.route(user_id)
     else:
-        next_prompt = next_dt_at(PROMPT_TIME)
-        times = calculate_event_times(next_prompt)
-        text = (
-            "🕒 <b>Next Round Schedule (Amsterdam)</b>\n"
-            f"• Prompt: {format_datetime(next_prompt)}\n"
-            f"• Reminder: {format_datetime(times['reminder'])}\n"
-            f"• Reveal: {format_datetime(times['reveal'])}\n"
-            f"• Cleanup: {format_datetime(times['cleanup'])}"
-        )
+        state = TENANTS.get(update.effective_chat.id)
+    if state is None:
+        await reply(update, "No group to show stats for — use /join to pick your group first.")
+        return
 
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    # Running counters kept at each cleanup: a few index lookups, however long the history
+    stats = await asyncio.to_thread(STORE.get_stats, state.tenant_id, user_id, STATS_TOP)
+    if not stats["rounds"]:
+        await reply(update, "📊 No finished rounds yet — stats start after the first discussion closes.")
+        return
+
+    def name(uid: int, first_name: Optional[str]) -> str:
+        return html.escape(first_name or str(uid))
+
+    lines = [
+        f"📊 <b>Stats{' — ' + html.escape(state.title) if state.title else ''}</b>",
+        f"• Rounds: <b>{stats['rounds']}</b>, replies: <b>{stats['replies']}</b>, "
+        f"{stats['participations'] / stats['rounds']:.1f} people per round",
+    ]
+    if stats["members"]:
+        lines.append("\n🏆 <b>Most active</b>")
+        lines += [f"• {name(uid, n)}: {rounds} round(s), {replies} replies"
+                  for uid, n, rounds, replies in stats["members"]]
+    if stats["streaks"]:
+        lines.append("\n🔥 <b>Streaks</b>")
+        lines += [f"• {name(uid, n)}: {streak} rounds in a row" for uid, n, streak in stats["streaks"]]
+    if stats["topics"]:
+        lines.append("\n🧭 <b>Topics</b>")
+        lines += [f"• {html.escape(topic)}: {replies} replies over {rounds} round(s)"
+                  for topic, rounds, replies, _ in stats["topics"]]
+    me = stats["user"]
+    if update.effective_chat.type == "private":
+        if me:
+            lines.append(f"\n🙋 <b>You:</b> {me['rounds']} round(s), {me['replies']} replies, "
+                         f"streak {me['streak']} (best {me['best_streak']})")
+        else:
+            lines.append("\n🙋 You haven't replied in a finished round yet.")
+    await reply(update, "\n".join(lines), parse_mode=ParseMode.HTML)
 
 
 # =========================
-# 🔄 STARTUP RECOVERY
+# 🔬 COMMAND: /profile (bot operators)
 # =========================
 
-async def recover_jobs_on_startup(application: Application):
+async def send_profile_report(bot, chat_id: int, report: ProfileReport):
+    """Top functions as a message, plus the full table and the collapsed stacks as files."""
+    worker = f" (worker {WORKER_ID})" if WORKER_ID is not None else ""
+    head = "\n".join(report.top.splitlines()[:16])
+    await DISPATCHER.call(bot.send_message, chat_id=chat_id, parse_mode=ParseMode.HTML, priority=PRIORITY_HIGH,
+                          text=f"🔬 <b>Profile{worker}</b>\n<pre>{html.escape(head)}</pre>")
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    for name, body in ((f"profile-{stamp}-top.txt", report.top),
+                       (f"profile-{stamp}-{report.mode}.folded", report.collapsed)):
+        await DISPATCHER.call(bot.send_document, chat_id=chat_id, document=body.encode() or b"\n", filename=name,
+                              priority=PRIORITY_HIGH)
+
+
+async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Called once on startup. If there's a pending round (prompt posted but reveal not done yet),
-    re-schedule the missing jobs so they don't get lost after a restart.
+    In a DM, for ADMIN_IDS: /profile start [sample|cprofile] [seconds], /profile stop, /profile (status).
+    With WORKERS > 1 this profiles whichever worker receives the command.
     """
-    last_prompt = get_last_prompt_time()
-    if not last_prompt:
-        logging.info("No pending round found on startup.")
+    if update.effective_chat.type != "private" or update.effective_user.id not in ADMIN_IDS:
+        await reply(update, "Only the bot's operators can do that, in a private chat.")
         return
+    args = [a.lower() for a in context.args]
+    action = args.pop(0) if args else "status"
+    chat_id = update.effective_chat.id
 
-    now = datetime.now(TZ)
-    times = calculate_event_times(last_prompt)
-
-    # Check which events are still in the future and need to be rescheduled
-    if times["reminder"] > now:
-        application.job_queue.run_once(job_reminder, times["reminder"])
-        logging.info(f"✅ Rescheduled reminder for {times['reminder']}")
+    if action == "start":
+        mode = args.pop(0) if args and args[0] in PROFILE_MODES else "sample"
+        try:
+            seconds = float(args[0]) if args else None
+            if seconds is not None and not seconds > 0:
+                raise ValueError("the duration must be a positive number of seconds")
+            seconds = PROFILER.start(mode, max_seconds=seconds,
+                                     on_expire=lambda report: send_profile_report(context.bot, chat_id, report))
+        except (ValueError, RuntimeError) as e:
+            await reply(update, f"Can't start profiling: {e}")
+            return
+        await reply(update, f"🔬 Profiling ({mode}) started. Send /profile stop for the report; it stops "
+                            f"by itself after {seconds:g}s.")
+    elif action == "stop":
+        if PROFILER.running:
+            await PROFILER.stop()
+        if PROFILER.report is None:
+            await reply(update, "Nothing has been profiled yet. Start with /profile start.")
+            return
+        await send_profile_report(context.bot, chat_id, PROFILER.report)
+    elif PROFILER.running:
+        await reply(update, f"🔬 {PROFILER.running} profiling has been running for {PROFILER.elapsed():.0f}s.")
+    else:
+        await reply(update, "Not profiling. Usage: /profile start [sample|cprofile] [seconds], /profile stop")
 
-    if times["reveal"] > now:
-        application.job_queue.run_once(job_reveal, times["reveal"])
-        logging.info(f"✅ Rescheduled reveal for {times['reveal']}")
 
-    if times["cleanup"] > now:
-        application.job_queue.run_once(job_cleanup, times["cleanup"])
-        logging.info(f"✅ Rescheduled cleanup for {times['cleanup']}")
+# =========================
+# 🔄 STARTUP RECOVERY
+# =========================
 
-    # If all events are in the past, the round is over (shouldn't happen but good to log)
-    if times["cleanup"] <= now:
-        logging.info("⏭️ Last round already completed. Waiting for next prompt.")
+async def recover_jobs_on_startup(application: Application):
+    """
+    Called once on startup. Round jobs only run in the process holding the leader lease:
+    whenever this process gets it, the schedule is rebuilt from the (freshly synced) state.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def become_leader():
+        await asyncio.to_thread(TENANTS.sync)
+        SCHEDULER.clear()
+        now = clock.now(TZ)
+        overdue = []
+        for state in TENANTS:
+            # Next prompt, plus the events of a pending round (prompt posted but cleanup not done yet)
+            overdue += [(due, state, event) for due, event in queue_group(state, now)]
+
+        # Catch up what was missed while no process ran the jobs, bounded and most recent first.
+        # Their due time stays the original one, so they fire right away
+        overdue.sort(key=lambda entry: entry[0], reverse=True)
+        for due, state, event in overdue[:CATCH_UP_MAX]:
+            SCHEDULER.schedule(state.tenant_id, event, due, replace=(event == "prompt"))
+        for due, state, event in overdue[CATCH_UP_MAX:]:
+            logging.warning("Dropping missed %s for %s (was due %s)", event, state.tenant_id, due)
+            if event == "prompt":
+                schedule_next_prompt(state)
+
+        # Finish reveals/cleanups a crash interrupted (only their unfinished items run)
+        for tenant_id, batch in await OUTBOX.open_batches():
+            state = TENANTS.get(tenant_id)
+            if state is not None:
+                OUTBOX.resume(tenant_id, batch, application.bot, state)
+
+        SCHEDULER.start(lambda tenant_id, event, due: run_scheduled_event(application.bot, tenant_id, event, due))
+        logging.info("✅ Running round jobs for %d group(s); %d event(s) queued.", len(TENANTS), len(SCHEDULER))
+
+    async def step_down():
+        await SCHEDULER.stop()
+        await OUTBOX.stop()
+        SCHEDULER.clear()
+
+    def on_reload(state: RoundState):
+        # Another worker may have registered the group or changed its schedule (runs on the writer thread)
+        def reschedule():
+            RENDERS.invalidate(state)
+            if LEASE.is_leader:
+                schedule_next_prompt(state)
+        loop.call_soon_threadsafe(reschedule)
+
+    TENANTS.on_reload = on_reload
+    LEASE.start(become_leader, step_down)
 
 
 # =========================
 # 🌐 WEBHOOK BOOTSTRAP
 # =========================
 
+def log_fields(update: Update) -> dict:
+    """Chat and round (of the group the update is about) for the update's log lines."""
+    chat = update.effective_chat
+    if chat is None:
+        return {}
+    if chat.type == "private":
+        state = TENANTS.route(update.effective_user.id) if update.effective_user else None
+    else:
+        state = TENANTS.get(chat.id) or TENANTS.for_discussion(chat.id)
+    return {"chat": chat.id, "round": state.last_prompt_round if state is not None else None}
+
+
+def timed(callback):
+    """Record the handler's duration (and whether it raised) in the metrics; tag its log lines."""
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        start = time_module.perf_counter()
+        try:
+            with log_context(handler=callback.__name__, **log_fields(update)):
+                return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=callback.__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time_module.perf_counter() - start, handler=callback.__name__)
+            if STARTUP.waiting_first_update:
+                STARTUP.first_update_handled()
+    return wrapper
+
+
 def build_app() -> Application:
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    # Updates are processed concurrently; handlers that write per-user state take USER_LOCKS
+    # Deliveries pass through the ingest queue: duplicates dropped, updates in flight bounded
+    # Pool, keep-alive, HTTP/2 and timeouts of Bot API calls: see transport.py
+    urls = {"base_url": f"{BOT_API_URL}/bot", "base_file_url": f"{BOT_API_URL}/file/bot"} if BOT_API_URL else {}
+    # A webhook bot never calls getUpdates, so it shares the one client instead of building a second one
+    request = ProfiledRequest(TRANSPORT)
+    # The bot skips setWebhook when Telegram already has the same registration (see startup.py)
+    bot = WebhookBot(BOT_TOKEN, request=request, get_updates_request=request, **urls)
+    # No PTB JobQueue: round jobs run on our own scheduler, so APScheduler is never started
+    updater = WebhookUpdater(bot, IngestQueue(INGEST_CAPACITY, INGEST_POLICY))
+    app = ApplicationBuilder().updater(updater).concurrent_updates(CONCURRENT_UPDATES).job_queue(None).build()
+
+    # Remember who is active in which main group (separate handler group, so it never blocks the rest)
+    app.add_handler(MessageHandler(filters.ChatType.GROUPS, timed(note_group_activity)), group=-1)
 
     # Commands
-    app.add_handler(CommandHandler("start", cmd_start))
-    app.add_handler(CommandHandler("nexttimes", cmd_nexttimes))
-    app.add_handler(CommandHandler("setdiscussion", cmd_setdiscussion))
+    app.add_handler(CommandHandler("start", timed(cmd_start)))
+    app.add_handler(CommandHandler("nexttimes", timed(cmd_nexttimes)))
+    app.add_handler(CommandHandler("stats", timed(cmd_stats)))
+    app.add_handler(CommandHandler("setdiscussion", timed(cmd_setdiscussion)))
+    app.add_handler(CommandHandler("register", timed(cmd_register)))
+    app.add_handler(CommandHandler("schedule", timed(cmd_schedule)))
+    app.add_handler(CommandHandler("join", timed(cmd_join)))
+    app.add_handler(CommandHandler("profile", timed(cmd_profile)))
+    app.add_handler(CallbackQueryHandler(timed(on_join_choice), pattern=r"^join:-?\d+$"))
 
     # Welcome messages
-    app.add_handler(MessageHandler(filters.Chat(MAIN_GROUP_ID) & filters.StatusUpdate.NEW_CHAT_MEMBERS,
-                                   welcome_new_in_main))
-    # Optional pleasant welcome in discussion room
-    app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_in_discussion))
+    app.add_handler(MessageHandler(MAIN_GROUPS & filters.StatusUpdate.NEW_CHAT_MEMBERS, timed(welcome_new_in_main)))
+    # Optional pleasant welcome in discussion rooms (also tracks who joined)
+    app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, timed(welcome_in_discussion)))
+    app.add_handler(MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, timed(track_left_discussion)))
+    app.add_handler(ChatMemberHandler(timed(track_membership), ChatMemberHandler.CHAT_MEMBER))
 
     # Collect replies in private (text, voice notes, audio files)
     app.add_handler(
         MessageHandler(
-            filters.ChatType.PRIVATE & (filters.TEXT | filters.VOICE | filters.AUDIO),
-            collect_reply
+            filters.ChatType.PRIVATE & (filters.TEXT | filters.VOICE | filters.AUDIO) & ~filters.COMMAND,
+            timed(collect_reply)
         )
     )
 
-    # Schedule daily prompt (this kicks off the chain for each round)
-    jq = app.job_queue
-    jq.run_daily(job_send_prompt, time=PROMPT_TIME, name="daily_prompt")
-
+    # Each group's daily prompt is queued by recover_jobs_on_startup (it kicks off the chain for each round)
     return app
 
 
+async def on_startup(application: Application):
+    """
+    Serve /metrics (and the last /profile report). The leader election, and with it the round jobs,
+    starts once the webhook server is up: none of it is needed to handle the first update.
+    """
+    STARTUP.mark("initialized")
+    if METRICS_PORT:
+        port = METRICS_PORT + int(WORKER_ID or 0)
+        handlers = ()
+        if PROFILE_TOKEN or METRICS_HOST in ("127.0.0.1", "localhost", "::1"):
+            handlers = profile_handlers(PROFILER, PROFILE_TOKEN)
+        else:
+            logging.warning("Not serving profile reports on %s without PROFILE_TOKEN", METRICS_HOST)
+        application.bot_data["metrics_server"] = start_metrics_server(port, METRICS_HOST, handlers=handlers)
+        application.bot_data["lag_watcher"] = asyncio.create_task(watch_loop_lag(), name="loop-lag")
+    queue = application.update_queue
+    UPDATE_QUEUE_DEPTH.func = lambda: queue.in_flight
+    UPDATE_QUEUE_PEAK.func = lambda: queue.peak
+    UPDATE_QUEUE_CAPACITY.func = lambda: queue.capacity
+    DISPATCH_QUEUE_DEPTH.func = DISPATCHER.queue_depth
+
+    def start_round_jobs():
+        application.bot_data["recovery"] = asyncio.create_task(recover_jobs_on_startup(application))
+    application.updater.on_ready = start_round_jobs
+
+
+async def flush_state_on_shutdown(application: Application):
+    """
+    Hand over the lease, send pending welcomes, stop the outbound dispatcher, then the background writer,
+    forcing a final flush.
+    """
+    if "metrics_server" in application.bot_data:
+        application.bot_data.pop("metrics_server").stop()
+        application.bot_data.pop("lag_watcher").cancel()
+    await LEASE.stop()
+    await WELCOMES.close()
+    await DISPATCHER.close()
+    TENANTS.close()
+
+
+# =========================
+# 👥 WORKER PROCESSES
+# =========================
+# WORKERS=N starts N copies of this script that all accept webhooks on PORT (the kernel spreads
+# connections over them) and share STATE_DB. To see failover on one machine, run with WORKERS=3,
+# kill -9 the worker whose log says "acquired lease", and watch another one take over within
+# about LEASE_TTL seconds (the supervisor restarts the killed worker meanwhile).
+
+def reuseport_socket(port: int) -> socket.socket:
+    """A listening socket that other processes can bind to the same port as well."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("0.0.0.0", port))
+    sock.listen(128)
+    sock.setblocking(False)
+    return sock
+
+
+def run_supervisor():
+    """Start WORKERS copies of this script and restart any that exit, until we get SIGTERM/SIGINT."""
+    stopping = threading.Event()
+
+    def spawn(worker_id: int) -> subprocess.Popen:
+        env = dict(os.environ, WORKER_ID=str(worker_id))
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    workers = {i: spawn(i) for i in range(WORKERS)}
+    logging.info("Started %d workers on port %d", WORKERS, PORT)
+
+    while not stopping.wait(1.0):
+        for worker_id, proc in workers.items():
+            if proc.poll() is not None:
+                logging.warning("Worker %s exited with %s; restarting it", worker_id, proc.returncode)
+                workers[worker_id] = spawn(worker_id)
+
+    for proc in workers.values():
+        proc.terminate()
+    for proc in workers.values():
+        proc.wait()
+
+
 def main():
+    if WORKER_ID is None and MAIN_GROUP_ID is not None:
+        # Pull in state from the old JSON files the first time we run against a fresh database
+        import_legacy_json(STORE, MAIN_GROUP_ID, USED_PROMPTS_FILE, DISCUSSION_FILE, REPLIES_FILE,
+                           PARTICIPANTS_FILE, SCHEDULE_FILE)
+    if WORKERS > 1 and WORKER_ID is None:
+        run_supervisor()
+        return
+
+    STARTUP.mark("imports")
+
+    # Load every group's round state once, as one snapshot; from here on handlers never touch disk
+    TENANTS.load()
+    if MAIN_GROUP_ID is not None:
+        TENANTS.add(MAIN_GROUP_ID)
+    TENANTS.start()
+    STARTUP.mark("state")
+
     app = build_app()
+    STARTUP.mark("app")
 
-    # Recover any pending jobs from before a restart
-    app.post_init = recover_jobs_on_startup
+    # Serve metrics and take part in the leader election; the leader recovers pending jobs from before a restart
+    app.post_init = on_startup
+    app.post_shutdown = flush_state_on_shutdown
 
     # Use token in the URL path (simple/secure enough for hobby projects).
     url_path = BOT_TOKEN
     webhook_url = f"{PUBLIC_URL}/{url_path}"
 
-    # Run webhook server (Tornado) and set webhook at Telegram
+    # Run webhook server (Tornado) and set webhook at Telegram (unless it is already set like this)
     # Render will see the bound $PORT and be happy ✅
+    if WORKERS > 1:
+        listen = {"unix": reuseport_socket(PORT)}  # PTB serves any pre-bound socket passed as `unix`
+    else:
+        listen = {"listen": "0.0.0.0", "port": PORT}
     app.run_webhook(
-        listen="0.0.0.0",
-        port=PORT,
         url_path=url_path,
         webhook_url=webhook_url,
+        allowed_updates=Update.ALL_TYPES,  # chat_member updates are opt-in
+        **listen,
     )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,57 @@
+# clock.py
+"""
+The clock round timing runs on.
+
+Everything that decides when a round event happens (schedules, round
+keys, the scheduler's timer, outbox retention) reads the time through
+`clock.time()` / `clock.now(tz)` instead of the system clock, so a
+simulation can swap in a `VirtualClock` with `set_clock` and replay
+months of rounds in seconds (see simulate.py). Rate limits, leases and
+flush intervals stay on real time: they pace real work, not rounds.
+"""
+import time as _time
+from datetime import datetime, tzinfo
+from typing import Optional
+
+
+class SystemClock:
+    def time(self) -> float:
+        return _time.time()
+
+
+class VirtualClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self, start: float):
+        self._now = float(start)
+
+    def time(self) -> float:
+        return self._now
+
+    def set(self, ts: float):
+        if ts < self._now:
+            raise ValueError(f"virtual time can't go back ({ts} < {self._now})")
+        self._now = float(ts)
+
+    def advance(self, seconds: float):
+        self.set(self._now + seconds)
+
+
+_clock = SystemClock()
+
+
+def set_clock(clock) -> object:
+    """Make `clock` the time source; returns the previous one (to put back)."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def time() -> float:
+    """Unix time."""
+    return _clock.time()
+
+
+def now(tz: Optional[tzinfo] = None) -> datetime:
+    """Current time in `tz` (aware; naive local time if tz is None)."""
+    return datetime.fromtimestamp(_clock.time(), tz)
@@ -0,0 +1,78 @@
+# digest.py
+"""
+Digest reveal: text replies packed into a few HTML messages.
+
+Instead of one forward per reply, `pack_digest` renders every user's
+text replies under their name and fills each message up to Telegram's
+4096-character limit (counted after entity parsing, in UTF-16 units, so
+`&lt;` is one character and an emoji two). Text is escaped and every
+message is self-contained: a user whose replies run over into the next
+message gets their name repeated there, and a single reply that is too
+long on its own is cut at a line break or space (its first piece fills
+whatever room the previous message has left). No tag or entity is
+ever split across messages.
+
+    messages = pack_digest([("Anna", ["first", "second"]), ("Bo", ["hi"])])
+"""
+import html
+
+from telegram.constants import MessageLimit
+
+LIMIT = MessageLimit.MAX_TEXT_LENGTH  # 4096
+MIN_PIECE = 200  # a long reply is only split to fill the end of a message if at least this much fits
+
+
+def text_length(text: str) -> int:
+    """Length as Telegram counts it (UTF-16 code units)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _header(name: str) -> tuple[str, int]:
+    """(HTML, visible length) of a user's name line."""
+    return f"💬 <b>{html.escape(name)}</b>", text_length(f"💬 {name}")
+
+
+def _cut(text: str, size: int) -> int:
+    """Index to cut `text` at so the head has at most `size` UTF-16 units, preferably after a line break or space."""
+    cut = size
+    while (over := text_length(text[:cut]) - size) > 0:
+        cut -= (over + 1) // 2  # a character is one or two units
+    brk = max(text.rfind("\n", 0, cut), text.rfind(" ", 0, cut))
+    return brk + 1 if brk > cut // 2 else cut
+
+
+def pack_digest(replies: list[tuple[str, list[str]]], limit: int = LIMIT) -> list[str]:
+    """HTML messages holding every (name, texts) pair in order, each at most `limit` characters once parsed."""
+    messages: list[str] = []
+    parts: list[str] = []
+    size = 0
+    for name, texts in replies:
+        header, header_len = _header(name)
+        headed = False  # this user's name is already in the current message
+        for text in texts:
+            whole = text_length(text) <= limit - header_len - 1  # fits in a message of its own
+            while text:
+                overhead = 1 if headed else (2 if parts else 0) + header_len + 1
+                room = limit - size - overhead
+                if text_length(text) <= room:
+                    piece, text = text, ""
+                elif parts and (whole or room < MIN_PIECE):
+                    # Start a new message: a reply that fits in one is never split, and tiny pieces aren't worth it
+                    messages.append("".join(parts))
+                    parts, size, headed = [], 0, False
+                    continue
+                else:
+                    cut = _cut(text, room)
+                    piece, text = text[:cut], text[cut:]
+                if headed:
+                    parts.append("\n")
+                elif parts:
+                    parts.append("\n\n" + header + "\n")
+                else:
+                    parts.append(header + "\n")
+                parts.append(html.escape(piece, quote=False))
+                size += overhead + text_length(piece)
+                headed = True
+    if parts:
+        messages.append("".join(parts))
+    return messages
@@ -0,0 +1,234 @@
+# dispatcher.py
+"""
+Rate-limit-aware outbound dispatcher.
+
+Every Bot API call the bot makes goes through `Dispatcher.call`. Calls are
+queued by priority and run by a fixed pool of workers, which keeps them
+under Telegram's flood limits (about 30 messages/s overall, about 20/min
+per group, about 1/s per private chat) and retries `RetryAfter` and
+transient network errors. Fan-outs can just `asyncio.gather` their calls
+and they run as fast as the limits allow.
+"""
+import time
+import asyncio
+import logging
+import itertools
+import contextvars
+from typing import Optional, Callable, Awaitable
+
+from telegram.error import RetryAfter, NetworkError, TimedOut, BadRequest
+
+from metrics import API_SECONDS, API_ERRORS
+
+# Priority lanes (lower runs first)
+PRIORITY_HIGH = 0  # direct answers to a user, round announcements
+PRIORITY_NORMAL = 1  # everything else
+PRIORITY_BULK = 2  # fan-outs: invite DMs, kicks
+
+GLOBAL_RATE = 30.0  # messages per second, whole bot
+GROUP_RATE = 20 / 60  # messages per second into one group
+GROUP_BURST = 20
+PRIVATE_RATE = 1.0  # messages per second into one private chat
+PRIVATE_BURST = 3
+CONCURRENCY = 16  # requests in flight at once
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5  # seconds, doubled per retry
+BACKOFF_MAX = 30.0
+
+# Methods that post into a chat and so count against that chat's limit
+MESSAGE_METHODS = {
+    "send_message", "forward_message", "forward_messages", "copy_message", "copy_messages",
+    "send_voice", "send_audio", "send_photo", "send_document", "reply_text",
+}
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("func", "args", "kwargs", "key", "method", "future", "attempts", "context")
+
+    def __init__(self, func, args, kwargs, key, future):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.method = getattr(func, "__name__", "call")
+        self.future = future
+        self.attempts = 0
+        self.context = contextvars.copy_context()  # the caller's log fields (round, chat, handler)
+
+
+class Dispatcher:
+    """Priority queue + worker pool in front of the Bot API."""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, concurrency: int = CONCURRENCY,
+                 max_retries: int = MAX_RETRIES, chat_limits: bool = True):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: dict = {}  # chat id (or @username) -> TokenBucket
+        self.chat_limits = chat_limits  # off only for benchmarks against a server without flood limits
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: list[asyncio.Task] = []
+        self._seq = itertools.count()  # keeps FIFO order inside a lane
+        self._paused_until = 0.0  # set when Telegram tells us to back off
+
+    # =========================
+    # 📤 PUBLIC API
+    # =========================
+
+    async def call(self, func: Callable[..., Awaitable], *args, priority: int = PRIORITY_NORMAL,
+                   key: Optional[int] = None, **kwargs):
+        """
+        Queue `func(*args, **kwargs)` and wait for its result.
+        `key` is the chat the call is limited against; it defaults to the `chat_id` argument.
+        """
+        self._ensure_started()
+        if key is None:
+            key = kwargs.get("chat_id")
+        job = _Job(func, args, kwargs, key, asyncio.get_running_loop().create_future())
+        self._queue.put_nowait((priority, next(self._seq), job))
+        return await job.future
+
+    async def close(self):
+        """Stop the workers. Calls still queued are cancelled."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, _, job = self._queue.get_nowait()
+                job.future.cancel()
+        self._queue = None
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # =========================
+    # ⚙️ INTERNALS
+    # =========================
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            # Fresh contexts: workers serve every caller, not the one whose call started them
+            self._workers = [asyncio.create_task(self._worker(), name=f"dispatcher-{i}", context=contextvars.Context())
+                             for i in range(self.concurrency)]
+
+    def _chat_bucket(self, job: _Job) -> Optional[TokenBucket]:
+        if not self.chat_limits or job.key is None or job.method not in MESSAGE_METHODS:
+            return None
+        key = job.key
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            if len(self.chat_buckets) > 10_000:
+                # Forget chats whose bucket has refilled; they behave exactly like a fresh one
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.idle()}
+            private = isinstance(key, int) and key > 0
+            bucket = (TokenBucket(PRIVATE_RATE, PRIVATE_BURST) if private
+                      else TokenBucket(GROUP_RATE, GROUP_BURST))
+            self.chat_buckets[key] = bucket
+        return bucket
+
+    def _requeue_later(self, delay: float, item: tuple):
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, item)
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            _, _, job = item
+            if job.future.done():  # caller went away
+                continue
+
+            # A busy chat must not hold up a worker, so park the job until its bucket refills
+            chat_bucket = self._chat_bucket(job)
+            wait = chat_bucket.delay() if chat_bucket else 0.0
+            if wait > 0:
+                self._requeue_later(wait, item)
+                continue
+            if chat_bucket:
+                chat_bucket.consume()  # take it now, before yielding to other workers
+
+            # The global limit applies to everyone, so waiting for it in place is fine
+            while True:
+                pause = self._paused_until - time.monotonic()
+                wait = max(pause, self.global_bucket.delay())
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.global_bucket.consume()
+
+            start = time.perf_counter()
+            try:
+                result = await job.func(*job.args, **job.kwargs)
+            except RetryAfter as e:
+                self._observe(job, start, e)
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") \
+                    else float(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                self._retry(item, retry_after, e)
+            except TimedOut as e:
+                self._observe(job, start, e)
+                # A timed-out request may still have gone through; retrying could post it twice
+                if not job.future.done():
+                    job.future.set_exception(e)
+            except BadRequest as e:
+                self._observe(job, start, e)
+                # Permanent (user not found, message gone, ...), though PTB files it under NetworkError
+                if not job.future.done():
+                    job.future.set_exception(e)
+            except NetworkError as e:
+                self._observe(job, start, e)
+                self._retry(item, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** job.attempts), e)
+            except Exception as e:
+                self._observe(job, start, e)
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self._observe(job, start)
+                if not job.future.done():
+                    job.future.set_result(result)
+
+    @staticmethod
+    def _observe(job: _Job, start: float, error: Optional[Exception] = None):
+        API_SECONDS.observe(time.perf_counter() - start, method=job.method)
+        if error is not None:
+            API_ERRORS.inc(method=job.method, error=type(error).__name__)
+
+    def _retry(self, item: tuple, delay: float, error: Exception):
+        _, _, job = item
+        job.attempts += 1
+        if job.attempts > self.max_retries:
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        job.context.run(logging.info, "%s to %s failed (%s); retry %d in %.1fs",
+                        job.method, job.key, error, job.attempts, delay)
+        self._requeue_later(delay, item)
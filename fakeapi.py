@@ -0,0 +1,268 @@
+# fakeapi.py
+"""
+Local stand-in for the Telegram Bot API, for benchmarks.
+
+Serves the methods the bot uses (sendMessage, forwardMessage(s),
+copyMessage(s), createChatInviteLink, banChatMember, ...) at
+/bot<token>/<method>, like api.telegram.org, and answers with plausible
+objects after a random, roughly log-normal latency. With `limits` on it
+enforces Telegram's flood limits and answers 429 with `retry_after` when
+they are exceeded; `flood` adds random 429s on top. GET /stats returns
+call counts per method. With `record` on it also keeps every call, for
+simulate.py to check what a round actually did.
+
+Point the bot at it with BOT_API_URL=http://127.0.0.1:<port>, or run
+bench.py, which starts one itself:
+
+    python fakeapi.py --port 8081 --latency 0.05 --limits
+"""
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+from collections import Counter
+from typing import Optional
+
+from dispatcher import TokenBucket, GLOBAL_RATE, GROUP_RATE, GROUP_BURST, PRIVATE_RATE, PRIVATE_BURST
+
+LATENCY = 0.05  # median seconds per call (api.telegram.org from Europe is roughly 30-150ms)
+LATENCY_SIGMA = 0.5  # log-normal spread: p99 is about 3x the median
+RETRY_AFTER = 1  # seconds, for random 429s
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Ripple", "username": "ripple_fake_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# Methods that post into a chat (and so count against the per-chat flood limits)
+MESSAGE_METHODS = {"sendMessage", "forwardMessage", "forwardMessages", "copyMessage", "copyMessages",
+                   "sendVoice", "sendAudio", "sendPhoto", "sendDocument"}
+
+
+class FakeBotAPI:
+    """State and behaviour of the fake server: message ids, invite links, flood limits, call counts."""
+
+    def __init__(self, latency: float = LATENCY, sigma: float = LATENCY_SIGMA, limits: bool = False,
+                 flood: float = 0.0, retry_after: int = RETRY_AFTER, seed: Optional[int] = None,
+                 record: bool = False):
+        self.latency = latency
+        self.sigma = sigma
+        self.limits = limits
+        self.flood = flood
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.record = record
+        self.log: list[tuple[str, dict]] = []  # (method, params) of every call, when recording
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.message_ids: dict[int, int] = {}
+        self.links = 0
+        self.webhook: dict = {}  # url, allowed_updates, max_connections of the last setWebhook
+        self.methods = {
+            "getMe": lambda p: BOT_USER,
+            "getChat": self.get_chat,
+            "getChatMember": self.get_chat_member,
+            "getWebhookInfo": self.get_webhook_info,
+            "setWebhook": self.set_webhook,
+            "deleteWebhook": self.set_webhook,
+            "sendMessage": self.send_message,
+            "sendVoice": self.send_message,
+            "sendAudio": self.send_message,
+            "sendDocument": self.send_message,
+            "editMessageText": self.send_message,
+            "forwardMessage": self.send_message,
+            "copyMessage": lambda p: {"message_id": self.next_message_id(p["chat_id"])},
+            "forwardMessages": self.forward_messages,
+            "copyMessages": self.forward_messages,
+            "createChatInviteLink": self.create_invite_link,
+            "revokeChatInviteLink": lambda p: self.invite_link(p["invite_link"], p.get("expire_date"), True),
+            "banChatMember": lambda p: True,
+            "unbanChatMember": lambda p: True,
+            "pinChatMessage": lambda p: True,
+            "unpinChatMessage": lambda p: True,
+            "answerCallbackQuery": lambda p: True,
+        }
+
+    # =========================
+    # 📤 REQUEST HANDLING
+    # =========================
+
+    async def handle(self, method: str, params: dict) -> tuple[int, dict]:
+        """(HTTP status, JSON body) for one call, after the simulated latency."""
+        self.calls[method] += 1
+        if self.record:
+            self.log.append((method, params))
+        await asyncio.sleep(self.random.lognormvariate(math.log(self.latency), self.sigma) if self.latency else 0)
+
+        func = self.methods.get(method)
+        if func is None:
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+        retry_after = self.flood_wait(method, params)
+        if retry_after:
+            self.throttled[method] += 1
+            return 429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                         "parameters": {"retry_after": retry_after}}
+        try:
+            return 200, {"ok": True, "result": func(params)}
+        except KeyError as e:
+            return 400, {"ok": False, "error_code": 400, "description": f"Bad Request: {e.args[0]} is required"}
+        except ValueError as e:
+            return 400, {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}
+
+    def flood_wait(self, method: str, params: dict) -> int:
+        """Seconds the caller must wait (0 if the call goes through)."""
+        if self.flood and self.random.random() < self.flood:
+            return self.retry_after
+        if not self.limits:
+            return 0
+        buckets = [self.global_bucket]
+        if method in MESSAGE_METHODS and "chat_id" in params:
+            chat_id = int(params["chat_id"])
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self.chat_buckets[chat_id] = (TokenBucket(PRIVATE_RATE, PRIVATE_BURST) if chat_id > 0
+                                                       else TokenBucket(GROUP_RATE, GROUP_BURST))
+            buckets.append(bucket)
+        wait = max(bucket.delay() for bucket in buckets)
+        if wait > 0:
+            return max(1, math.ceil(wait))
+        for bucket in buckets:
+            bucket.consume()
+        return 0
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "throttled": dict(self.throttled)}
+
+    # =========================
+    # 🤖 METHODS
+    # =========================
+
+    def next_message_id(self, chat_id) -> int:
+        chat_id = int(chat_id)
+        self.message_ids[chat_id] = self.message_ids.get(chat_id, 0) + 1
+        return self.message_ids[chat_id]
+
+    @staticmethod
+    def chat(chat_id) -> dict:
+        chat_id = int(chat_id)
+        if chat_id > 0:
+            return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+        return {"id": chat_id, "type": "supergroup", "title": f"Group {chat_id}"}
+
+    def send_message(self, p: dict) -> dict:
+        message = {"message_id": self.next_message_id(p["chat_id"]), "date": int(time.time()),
+                   "chat": self.chat(p["chat_id"]), "from": BOT_USER}
+        if "text" in p:
+            message["text"] = p["text"]
+        return message
+
+    def forward_messages(self, p: dict) -> list[dict]:
+        return [{"message_id": self.next_message_id(p["chat_id"])} for _ in p["message_ids"]]
+
+    def get_chat(self, p: dict) -> dict:
+        return {**self.chat(p["chat_id"]), "accent_color_id": 0, "max_reaction_count": 11}
+
+    def get_chat_member(self, p: dict) -> dict:
+        if int(p["user_id"]) <= 0:
+            raise ValueError("user not found")
+        user = {"id": int(p["user_id"]), "is_bot": False, "first_name": f"User {p['user_id']}"}
+        return {"status": "member", "user": user}
+
+    def get_webhook_info(self, p: dict) -> dict:
+        return {"url": "", **self.webhook, "has_custom_certificate": False, "pending_update_count": 0}
+
+    def set_webhook(self, p: dict) -> bool:
+        self.webhook = {key: p[key] for key in ("url", "allowed_updates", "max_connections") if p.get(key)}
+        return True
+
+    def create_invite_link(self, p: dict) -> dict:
+        self.links += 1
+        return self.invite_link(f"https://t.me/+fake{self.links:08d}", p.get("expire_date"))
+
+    @staticmethod
+    def invite_link(link: str, expire_date=None, revoked: bool = False) -> dict:
+        result = {"invite_link": link, "creator": BOT_USER, "creates_join_request": False, "is_primary": False,
+                  "is_revoked": revoked}
+        if expire_date is not None:
+            result["expire_date"] = int(expire_date)
+        return result
+
+
+# =========================
+# 🌐 HTTP SERVER
+# =========================
+
+def _parse_value(value: str):
+    # The Bot API takes form fields whose non-string values are JSON encoded
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def start_fake_api(api: FakeBotAPI, port: int, address: str = "127.0.0.1"):
+    """Serve `api` on `port`. Must be called on the running event loop; returns the server."""
+    import tornado.web
+    from tornado.httpserver import HTTPServer
+
+    class MethodHandler(tornado.web.RequestHandler):
+        async def post(self, token: str, method: str):
+            if self.request.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(self.request.body or b"{}")
+            else:
+                params = {k: _parse_value(v[-1].decode()) for k, v in self.request.body_arguments.items()}
+            params.update({k: _parse_value(v[-1].decode()) for k, v in self.request.query_arguments.items()})
+            status, body = await api.handle(method, params)
+            self.set_status(status)
+            self.set_header("Content-Type", "application/json")
+            self.write(json.dumps(body))
+
+        get = post
+
+    class StatsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.write(api.stats())
+
+    app = tornado.web.Application([
+        (r"/bot([^/]+)/(\w+)", MethodHandler),
+        (r"/stats", StatsHandler),
+    ], log_function=lambda handler: None)
+    server = HTTPServer(app)
+    server.listen(port, address=address)
+    return server
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=LATENCY, help="median seconds per call (0: none)")
+    parser.add_argument("--sigma", type=float, default=LATENCY_SIGMA, help="log-normal spread of the latency")
+    parser.add_argument("--limits", action="store_true", help="enforce Telegram's flood limits (429s)")
+    parser.add_argument("--flood", type=float, default=0.0, help="fraction of calls answered with a random 429")
+    parser.add_argument("--retry-after", type=int, default=RETRY_AFTER)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    api = FakeBotAPI(latency=args.latency, sigma=args.sigma, limits=args.limits, flood=args.flood,
+                     retry_after=args.retry_after)
+
+    async def serve():
+        start_fake_api(api, args.port, args.address)
+        logging.info("Fake Bot API at http://%s:%s", args.address, args.port)
+        print("ready", flush=True)  # bench.py waits for this line
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# ingest.py
+"""
+Ingest layer between the webhook server and the handlers.
+
+`IngestQueue` replaces the Application's update queue (via
+ApplicationBuilder.update_queue). The webhook server awaits `put()` before
+it answers Telegram, so this is where deliveries can be turned away:
+
+* Duplicates are dropped (and answered 200, so Telegram stops retrying):
+  an update_id seen recently, or a new message whose (chat, message_id)
+  was seen recently. In private chats the chat is the user, so a reply
+  that Telegram redelivers is only stored once.
+* At most `capacity` updates are in flight (received but not finished by
+  the handlers). With concurrent updates the Application pulls updates
+  off the queue right away, so the bound is on in-flight updates, not on
+  the queue length. When it is reached, `policy` decides:
+    "wait"    hold the delivery until there is room (up to `max_wait`
+              seconds, then reject). Telegram sends no more than its
+              max_connections at once, so this slows it down.
+    "reject"  fail the delivery (HTTP 500); Telegram redelivers it later.
+    "drop"    answer 200 and forget the update. Loses data; for tests.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+
+from telegram import Update
+
+from metrics import INGEST_DUPLICATES, INGEST_SHED, INGEST_WAIT_SECONDS
+
+CAPACITY = 1000  # updates in flight
+POLICIES = ("wait", "reject", "drop")
+MAX_WAIT = 20.0  # seconds a delivery may wait for room ("wait" policy); Telegram gives up at about 60s
+DEDUP_WINDOW = 50_000  # recent update ids / message keys remembered
+SHED_LOG_EVERY = 30.0  # seconds between "queue full" warnings
+
+
+class IngestFull(Exception):
+    """Raised from put() to make the webhook answer 500, so Telegram delivers the update again later."""
+
+
+class RecentKeys:
+    """The last `size` distinct keys added (a sliding window for dedup)."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._keys: dict = {}  # key -> sequence number of the add that is still in the window
+        self._order: deque = deque()  # (key, sequence number), oldest first
+        self._seq = 0
+
+    def add(self, key) -> bool:
+        """Remember `key`; False if it was already in the window."""
+        if key in self._keys:
+            return False
+        self._seq += 1
+        self._keys[key] = self._seq
+        self._order.append((key, self._seq))
+        while len(self._order) > self.size:
+            old, seq = self._order.popleft()
+            if self._keys.get(old) == seq:  # not discarded (and re-added) since
+                del self._keys[old]
+        return True
+
+    def discard(self, key):
+        """Forget `key` (its slot in the window is reclaimed when it ages out)."""
+        self._keys.pop(key, None)
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class IngestQueue(asyncio.Queue):
+    """Application update queue with dedup and a bound on updates in flight."""
+
+    def __init__(self, capacity: int = CAPACITY, policy: str = "wait", max_wait: float = MAX_WAIT,
+                 window: int = DEDUP_WINDOW):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POLICIES)}")
+        super().__init__()  # unbounded underneath; admission is limited by in_flight instead
+        self.capacity = capacity
+        self.policy = policy
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.peak = 0  # highest in_flight so far
+        self.update_ids = RecentKeys(window)
+        self.message_keys = RecentKeys(window)
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_shed_log = 0.0
+
+    # =========================
+    # 📥 ADMISSION
+    # =========================
+
+    async def put(self, item):
+        if not isinstance(item, Update):
+            return await super().put(item)  # the Application's stop signal
+        # Check and record with no await in between, so a copy arriving while this one
+        # waits for room is already a duplicate
+        if self._is_duplicate(item):
+            return
+        self._remember(item)
+        if self.in_flight >= self.capacity:
+            try:
+                admitted = await self._make_room(item)
+            except BaseException:  # refused (IngestFull) or the delivery went away while waiting
+                self._forget(item)
+                raise
+            if not admitted:
+                self._forget(item)
+                return
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        self.put_nowait(item)
+
+    def task_done(self):
+        """Called by the Application when an update has been handled: frees a slot."""
+        super().task_done()
+        if self.in_flight > 0:
+            self.in_flight -= 1
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "peak": self.peak, "capacity": self.capacity,
+                "policy": self.policy, "waiting": len(self._waiters)}
+
+    # =========================
+    # ⚙️ INTERNALS
+    # =========================
+
+    def _is_duplicate(self, update: Update) -> bool:
+        if update.update_id in self.update_ids:
+            INGEST_DUPLICATES.inc(key="update_id")
+            return True
+        message = update.message
+        if message is not None and (message.chat_id, message.message_id) in self.message_keys:
+            INGEST_DUPLICATES.inc(key="message")
+            return True
+        return False
+
+    def _remember(self, update: Update):
+        self.update_ids.add(update.update_id)
+        if update.message is not None:
+            self.message_keys.add((update.message.chat_id, update.message.message_id))
+
+    def _forget(self, update: Update):
+        """Undo `_remember` for an update that was not let in, so its redelivery is not taken for a duplicate."""
+        self.update_ids.discard(update.update_id)
+        if update.message is not None:
+            self.message_keys.discard((update.message.chat_id, update.message.message_id))
+
+    async def _make_room(self, update: Update) -> bool:
+        """Apply the policy while full. True once the update may go in; False if it is dropped."""
+        self._log_full()
+        if self.policy == "drop":
+            INGEST_SHED.inc(action="dropped")
+            return False
+        if self.policy == "wait":
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._wait_for_room(), self.max_wait)
+                return True
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                INGEST_WAIT_SECONDS.observe(time.perf_counter() - start)
+        INGEST_SHED.inc(action="rejected")
+        raise IngestFull(f"{self.in_flight} updates in flight; update {update.update_id} refused")
+
+    async def _wait_for_room(self):
+        loop = asyncio.get_running_loop()
+        while self.in_flight >= self.capacity:
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            await waiter  # a cancelled waiter is skipped by task_done
+
+    def _log_full(self):
+        now = time.monotonic()
+        if now - self._last_shed_log >= SHED_LOG_EVERY:
+            self._last_shed_log = now
+            logging.warning("Update queue full (%d/%d in flight, policy %s, %d waiting)",
+                            self.in_flight, self.capacity, self.policy, len(self._waiters))
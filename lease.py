@@ -0,0 +1,84 @@
+# lease.py
+"""
+Leader lease for running scheduled round jobs in exactly one process.
+
+Worker processes that share a store all run a `LeaderLease`. The one whose
+row in the store's `leases` table is current is the leader; it renews the
+row every `ttl / 3` seconds. If it dies or stalls, the row expires and the
+next worker to try takes it over, so failover takes at most `ttl` plus one
+renewal interval.
+"""
+import os
+import time
+import socket
+import asyncio
+import logging
+from typing import Optional, Callable, Awaitable
+
+from storage import StateStore
+
+LEASE_NAME = "round-jobs"
+LEASE_TTL = 15.0  # seconds
+
+
+class LeaderLease:
+    """Keeps trying to hold one named lease; calls `on_acquire`/`on_lose` when that changes."""
+
+    def __init__(self, store: StateStore, name: str = LEASE_NAME, ttl: float = LEASE_TTL,
+                 holder: Optional[str] = None):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self._valid_until = 0.0  # monotonic; we only trust the lease until a little before it expires
+        self._task: Optional[asyncio.Task] = None
+        self._on_acquire: Optional[Callable[[], Awaitable]] = None
+        self._on_lose: Optional[Callable[[], Awaitable]] = None
+        self._leader = False
+
+    @property
+    def is_leader(self) -> bool:
+        """True while we hold the lease (checked against its expiry, not just the last renewal result)."""
+        return self._leader and time.monotonic() < self._valid_until
+
+    def start(self, on_acquire: Callable[[], Awaitable], on_lose: Callable[[], Awaitable]):
+        self._on_acquire = on_acquire
+        self._on_lose = on_lose
+        self._task = asyncio.create_task(self._run(), name=f"lease:{self.name}")
+
+    async def stop(self):
+        """Stop renewing and hand the lease over right away."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._leader:
+            await self._set_leader(False)
+            try:
+                await asyncio.to_thread(self.store.release_lease, self.name, self.holder)
+            except Exception as e:
+                logging.warning("Releasing lease %s failed: %s", self.name, e)
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                held = await asyncio.to_thread(self.store.acquire_lease, self.name, self.holder, self.ttl)
+            except Exception as e:
+                logging.warning("Lease %s renewal failed: %s", self.name, e)
+                held = False
+            if held:
+                # Stop acting a renewal interval before the row expires, in case our clock runs slow
+                self._valid_until = started + self.ttl * 2 / 3
+            if held != self._leader:
+                await self._set_leader(held)
+            await asyncio.sleep(self.ttl / 3)
+
+    async def _set_leader(self, leader: bool):
+        self._leader = leader
+        logging.info("%s %s lease %s", self.holder, "acquired" if leader else "lost", self.name)
+        callback = self._on_acquire if leader else self._on_lose
+        try:
+            await callback()
+        except Exception:
+            logging.exception("Lease %s %s callback failed", self.name, "acquire" if leader else "lose")
@@ -0,0 +1,202 @@
+# logs.py
+"""
+Non-blocking, structured logging.
+
+`setup_logging()` replaces logging.basicConfig. Every record goes through
+a QueueHandler into an in-process queue, and a listener thread formats
+and writes it. On the calling thread (usually the event loop) a log call
+costs a filter check and a queue put: the message is only formatted on
+the listener thread, so log with arguments (`logging.info("... %s", x)`)
+rather than f-strings.
+
+Records are JSON lines (`fmt="text"` for the old one-line format):
+
+    {"ts": "2025-05-01T18:00:02.113+00:00", "level": "INFO", "logger": "root", "msg": "...",
+     "round": "2025-04-30", "chat": -1001234, "handler": "job_reveal", "worker": "0"}
+
+`round`, `chat` and `handler` come from `log_context()`, which the bot
+sets around update handlers and scheduled round events; tasks started
+inside it inherit the fields.
+
+Repeats at INFO and below are rate-limited: a message template (logger,
+level and the unformatted message) is logged at most `burst` times per
+`interval` seconds. The rest are counted, and the next one let through says how
+many were dropped ("suppressed"), so a reveal with 1000 failed forwards
+logs a handful of "Forward failed" lines instead of 1000. Counts still
+pending are logged when logging stops. Warnings and errors are never
+suppressed.
+"""
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+BURST = 5  # records per message template...
+INTERVAL = 60.0  # ...per this many seconds
+MAX_TEMPLATES = 2000  # templates tracked; the oldest are forgotten beyond this
+LIMIT_LEVEL = logging.INFO  # records above this level are never suppressed
+
+CONTEXT_FIELDS = ("round", "chat", "handler")
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+_CONTEXT: contextvars.ContextVar[dict] = contextvars.ContextVar("log_context", default={})
+_LISTENER: Optional[QueueListener] = None
+_LIMITER: Optional["RepeatLimiter"] = None
+_STATIC: dict = {}
+
+
+@contextmanager
+def log_context(**fields):
+    """Add fields (round, chat, handler) to every record logged inside the block, tasks started in it included."""
+    token = _CONTEXT.set({**_CONTEXT.get(), **fields})
+    try:
+        yield
+    finally:
+        _CONTEXT.reset(token)
+
+
+class RepeatLimiter(logging.Filter):
+    """Lets through at most `burst` records per message template every `interval` seconds, up to `max_level`."""
+
+    def __init__(self, burst: int = BURST, interval: float = INTERVAL, max_level: int = LIMIT_LEVEL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_level = max_level
+        self._windows: dict[tuple, list] = {}  # template -> [window start, let through, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else type(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is None and len(self._windows) >= MAX_TEMPLATES:
+                    self._windows.pop(next(iter(self._windows)))
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+    def pending(self) -> list[tuple[str, int, str, int]]:
+        """(logger, level, template, count) of records suppressed since their last one got through."""
+        with self._lock:
+            return [(name, level, msg if isinstance(msg, str) else str(msg), window[2])
+                    for (name, level, msg), window in self._windows.items() if window[2]]
+
+
+class _ContextQueueHandler(QueueHandler):
+    """Stamps the context fields on the calling thread and queues the record unformatted."""
+
+    def __init__(self, q, static: dict):
+        super().__init__(q)
+        self.static = static
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stdlib version formats here (on the event loop); the listener's formatter does it instead
+        for name, value in self.static.items():
+            setattr(record, name, value)
+        for name, value in _CONTEXT.get().items():
+            setattr(record, name, value)
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def __init__(self, static: tuple = ()):
+        super().__init__()
+        self.fields = CONTEXT_FIELDS + tuple(static)
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name in self.fields:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        if getattr(record, "suppressed", 0):
+            data["suppressed"] = record.suppressed
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line format, noting suppressed repeats."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, "suppressed", 0):
+            text += f" (+{record.suppressed} similar suppressed)"
+        return text
+
+
+def setup_logging(level: int = logging.INFO, fmt: str = "json", burst: int = BURST, interval: float = INTERVAL,
+                  limit_level: int = LIMIT_LEVEL, **static) -> QueueListener:
+    """
+    Route the root logger through a queue to a writer thread (stderr). `static` fields (e.g. worker="0")
+    go into every record; repeats up to `limit_level` are rate-limited. Replaces any earlier setup;
+    stopped (and drained) at exit.
+    """
+    global _LISTENER, _LIMITER, _STATIC
+    if fmt not in ("json", "text"):
+        raise ValueError("log format must be json or text")
+    stop_logging()
+    static = _STATIC = {name: value for name, value in static.items() if value is not None}
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter(tuple(static)) if fmt == "json" else TextFormatter())
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _LIMITER = RepeatLimiter(burst, interval, limit_level)
+    handler = _ContextQueueHandler(records, static)
+    handler.addFilter(_LIMITER)
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _LISTENER = QueueListener(records, output)
+    _LISTENER.start()
+    return _LISTENER
+
+
+def stop_logging():
+    """Drain the queue and stop the writer thread, then log what is still suppressed."""
+    global _LISTENER
+    if _LISTENER is None:
+        return
+    listener, _LISTENER = _LISTENER, None
+    listener.stop()
+    for name, level, template, count in _LIMITER.pending():
+        record = logging.LogRecord(name, level, __file__, 0, "%d more like this suppressed: %s",
+                                   (count, template), None)
+        record.__dict__.update(_STATIC)
+        listener.handle(record)
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,243 @@
+# metrics.py
+"""
+Prometheus metrics, without the client library.
+
+Counters, gauges and histograms with labels, rendered in the Prometheus
+text format by `render()`. `start_metrics_server` serves them at /metrics
+on a small Tornado server next to the webhook server, on the same event
+loop. All metrics live in REGISTRY; the ones the bot records are defined
+at the bottom of this file.
+"""
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Optional, Callable
+
+# Seconds; covers a fast handler (1ms) up to a long fan-out (10min)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   300.0, 600.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, le: Optional[str] = None) -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()  # store writes are observed from the writer thread
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), func: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+        self.func = func  # unlabelled gauges can be read at scrape time instead of being set
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self) -> list[str]:
+        if self.func is not None:
+            try:
+                return [f"{self.name} {_format_value(self.func())}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[-1] if series else 0
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, _format_value(bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, '+Inf')} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help_text: str, labels: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help_text, labels))
+
+
+def gauge(name: str, help_text: str, labels: tuple = (), func: Optional[Callable[[], float]] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help_text, labels, func))
+
+
+def histogram(name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help_text, labels, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# =========================
+# 📊 BOT METRICS
+# =========================
+
+HANDLER_SECONDS = histogram("ripple_handler_seconds", "Time spent in each update handler", ("handler",))
+HANDLER_ERRORS = counter("ripple_handler_errors_total", "Update handlers that raised", ("handler",))
+API_SECONDS = histogram("ripple_telegram_api_seconds", "Bot API call latency (one attempt)", ("method",))
+API_ERRORS = counter("ripple_telegram_api_errors_total", "Failed Bot API calls", ("method", "error"))
+STORE_SECONDS = histogram("ripple_store_seconds", "State store read/write durations", ("op",))
+STORE_BYTES = counter("ripple_store_bytes_total", "Bytes read from / written to the state store", ("op",))
+EVENT_SECONDS = histogram("ripple_round_event_seconds", "Duration of scheduled round events (reveal and "
+                                                        "cleanup are the fan-outs)", ("event",))
+UPDATE_QUEUE_DEPTH = gauge("ripple_update_queue_depth", "Updates received but not yet handled")
+UPDATE_QUEUE_PEAK = gauge("ripple_update_queue_peak", "Highest number of updates in flight since start")
+UPDATE_QUEUE_CAPACITY = gauge("ripple_update_queue_capacity", "Updates allowed in flight before backpressure")
+INGEST_DUPLICATES = counter("ripple_ingest_duplicates_total", "Webhook deliveries dropped as duplicates", ("key",))
+INGEST_SHED = counter("ripple_ingest_shed_total", "Webhook deliveries refused while full", ("action",))
+INGEST_WAIT_SECONDS = histogram("ripple_ingest_wait_seconds", "Time deliveries waited for room in the queue")
+DISPATCH_QUEUE_DEPTH = gauge("ripple_dispatch_queue_depth", "Bot API calls waiting in the dispatcher")
+STARTUP_SECONDS = gauge("ripple_startup_seconds", "Seconds from process start until each startup phase was done",
+                        ("phase",))
+LOOP_LAG = gauge("ripple_event_loop_lag_seconds", "How late a periodic event-loop tick ran (last sample)")
+RENDER_CACHE = counter("ripple_render_cache_total", "Lookups of pre-rendered reply texts", ("result",))
+
+
+# =========================
+# 🌐 HTTP ENDPOINT
+# =========================
+
+LAG_INTERVAL = 0.5  # seconds between event-loop lag samples
+
+
+async def watch_loop_lag(interval: float = LAG_INTERVAL):
+    """Sleep in a loop and record how much later than asked we woke up."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.set(max(0.0, time.perf_counter() - start - interval))
+
+
+def start_metrics_server(port: int, address: str = "127.0.0.1", handlers: tuple = ()):
+    """
+    Serve GET /metrics on `port`, plus any extra tornado `handlers` (pattern, RequestHandler).
+    Must be called on the running event loop; returns the server.
+    """
+    import tornado.web
+    from tornado.httpserver import HTTPServer
+
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.write(render())
+
+    app = tornado.web.Application([(r"/metrics", MetricsHandler), *handlers], log_function=lambda handler: None)
+    server = HTTPServer(app)
+    server.listen(port, address=address)
+    logging.info("Metrics at http://%s:%s/metrics", address, port)
+    return server
@@ -0,0 +1,178 @@
+# outbox.py
+"""
+Durable outbox for fan-outs (reveal, cleanup).
+
+A fan-out is first written to the store as a batch of items, one per API
+call or state change, each with its own status. Only then does it run.
+If the process dies halfway, `Outbox.resume` runs just the items that are
+still pending, so nothing is forwarded twice and nothing is skipped.
+
+Items belong to stages. Stages run in order, and the items of one stage
+run concurrently. A step can read the result of an earlier item through
+`BatchRun.result`, e.g. the invite link that later DMs need. Item status
+is written back in small batches, so a crash can repeat at most the last
+`flush_every` seconds of work. Steps that only change in-memory state
+rely on `persist`, which writes that state before any status is marked
+done.
+"""
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional, Callable, Awaitable, Any
+
+from storage import StateStore
+
+PENDING = 0
+DONE = 1
+FAILED = 2  # gave up on this item; the rest of the batch still runs
+
+FLUSH_EVERY = 0.5  # seconds between status write-backs while a batch runs
+FLUSH_SIZE = 200  # ... or this many finished items, whichever comes first
+
+
+@dataclass(slots=True)
+class OutboxItem:
+    id: int
+    stage: int
+    kind: str
+    payload: dict
+    status: int = PENDING
+    result: Any = None
+
+
+class BatchRun:
+    """One batch being executed: its items and what the finished ones returned."""
+
+    def __init__(self, tenant_id: int, batch: str, items: list[OutboxItem]):
+        self.tenant_id = tenant_id
+        self.batch = batch
+        self.items = items
+
+    def result(self, kind: str) -> Any:
+        """Result of the first finished item of `kind` (None if there is none)."""
+        for item in self.items:
+            if item.kind == kind and item.status == DONE:
+                return item.result
+        return None
+
+
+class Outbox:
+    """Plans, runs and resumes batches of outbox items. Steps are registered per item kind."""
+
+    def __init__(self, store: StateStore, flush_every: float = FLUSH_EVERY, flush_size: int = FLUSH_SIZE,
+                 persist: Optional[Callable[[], None]] = None):
+        self.store = store
+        self.persist = persist  # writes the state steps changed; called before statuses are written
+        self.flush_every = flush_every
+        self.flush_size = flush_size
+        self.steps: dict[str, Callable[..., Awaitable]] = {}
+        self._finished: list[tuple[int, int, Optional[str]]] = []  # (id, status, result json) not written yet
+        self._last_flush = time.monotonic()
+        self._tasks: set[asyncio.Task] = set()
+
+    def step(self, kind: str):
+        """Decorator: `@OUTBOX.step("kick")` registers the coroutine that executes items of that kind."""
+        def register(func):
+            self.steps[kind] = func
+            return func
+        return register
+
+    # =========================
+    # 📤 PUBLIC API
+    # =========================
+
+    async def run(self, tenant_id: int, batch: str, plan: Callable[[], list[tuple[int, str, dict]]], *args):
+        """
+        Run batch `batch`. The first time, `plan()` returns its items as (stage, kind, payload)
+        and they are stored before anything is sent; if the batch already exists (a resumed or
+        repeated event), only its pending items run. `args` are passed to every step before the payload.
+        """
+        items = await asyncio.to_thread(self._load_or_create, tenant_id, batch, plan)
+        await self._execute(BatchRun(tenant_id, batch, items), args)
+
+    def resume(self, tenant_id: int, batch: str, *args):
+        """Finish an interrupted batch in the background (called at startup)."""
+        task = asyncio.create_task(self.run(tenant_id, batch, lambda: [], *args), name=f"outbox:{batch}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def open_batches(self) -> list[tuple[int, str]]:
+        """(tenant id, batch) of every batch with pending items."""
+        return await asyncio.to_thread(self.store.outbox_open_batches)
+
+    async def stop(self):
+        """Cancel resumed batches (their unfinished items stay pending for the next run)."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # =========================
+    # ⚙️ INTERNALS
+    # =========================
+
+    def _load_or_create(self, tenant_id: int, batch: str, plan) -> list[OutboxItem]:
+        rows = self.store.outbox_items(batch)
+        if not rows:
+            planned = plan()
+            if not planned:
+                return []
+            self.store.outbox_add(tenant_id, batch, [(stage, kind, json.dumps(payload))
+                                                     for stage, kind, payload in planned])
+            rows = self.store.outbox_items(batch)
+        return [OutboxItem(id=i, stage=stage, kind=kind, payload=json.loads(payload), status=status,
+                           result=json.loads(result) if result is not None else None)
+                for i, stage, kind, payload, status, result in rows]
+
+    async def _execute(self, run: BatchRun, args: tuple):
+        pending = [item for item in run.items if item.status == PENDING]
+        if not pending:
+            return
+        if len(pending) < len(run.items):
+            logging.info("Resuming %s: %d of %d item(s) left", run.batch, len(pending), len(run.items))
+        try:
+            for stage in sorted({item.stage for item in pending}):
+                await asyncio.gather(*(self._run_item(item, run, args)
+                                       for item in pending if item.stage == stage))
+                await self._flush()  # a stage is only final once its statuses are on disk
+        finally:
+            if self._finished:
+                # Cancelled or failed halfway: keep what did finish (blocking, but short)
+                self._write(self._take())
+
+    async def _run_item(self, item: OutboxItem, run: BatchRun, args: tuple):
+        step = self.steps.get(item.kind)
+        try:
+            if step is None:
+                raise LookupError(f"no outbox step for {item.kind!r}")
+            item.result = await step(*args, item.payload, run)
+            item.status = DONE
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            item.status = FAILED
+            item.result = str(e)
+            logging.info("%s failed in %s: %s", item.kind, run.batch, e)
+        self._finished.append((item.id, item.status, json.dumps(item.result)))
+        if len(self._finished) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_every:
+            await self._flush()
+
+    def _take(self) -> list[tuple[int, int, Optional[str]]]:
+        finished, self._finished = self._finished, []
+        self._last_flush = time.monotonic()
+        return finished
+
+    async def _flush(self):
+        if self._finished:
+            await asyncio.to_thread(self._write, self._take())
+
+    def _write(self, finished: list[tuple[int, int, Optional[str]]]):
+        try:
+            if self.persist is not None:
+                self.persist()  # a step must not be on disk as done while its state change is not
+            self.store.outbox_mark(finished)
+        except Exception as e:
+            # Worst case these items run again after a restart
+            logging.error("Outbox status write failed (%d item(s)): %s", len(finished), e)
@@ -0,0 +1,278 @@
+# profiler.py
+"""
+On-demand profiling of the live process (the admin /profile command).
+
+Two modes:
+
+* "sample" (default): a background thread looks at every thread's stack
+  every `interval` seconds via sys._current_frames(). The event loop
+  never notices beyond the GIL hand-off, so it is fine to leave on for
+  minutes under load. Handler and job frames show up by name (handlers
+  sit right above `timed.<locals>.wrapper`).
+* "cprofile": cProfile on the event-loop thread. Exact call counts, but
+  roughly doubles the cost of Python code while on; keep it short.
+
+Both produce a `ProfileReport`: collapsed stacks (one `frame;frame;frame
+count` line per stack, the input format of flamegraph.pl and speedscope)
+and a top-N table of the hottest functions. Every session stops itself
+after `max_seconds`.
+"""
+import os
+import sys
+import hmac
+import time
+import asyncio
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional, Callable, Awaitable
+
+INTERVAL = 0.01  # seconds between samples (100 Hz)
+MAX_SECONDS = 600.0  # sessions stop by themselves after this long
+MAX_DEPTH = 64  # frames kept per stack (the outermost ones are dropped)
+MAX_STACKS = 20_000  # distinct stacks kept; later new ones are counted as "[other]"
+TOP_N = 25
+
+MODES = ("sample", "cprofile")
+
+# Innermost frames of a thread that is only waiting (left out of the sampling top-N, shown as "idle")
+IDLE_FRAMES = {
+    "selectors.py:EpollSelector.select", "selectors.py:_PollLikeSelector.select",
+    "threading.py:Condition.wait", "threading.py:Thread._wait_for_tstate_lock", "thread.py:_worker",
+}
+
+
+@dataclass
+class ProfileReport:
+    mode: str
+    seconds: float
+    samples: int  # stacks sampled (sample mode) or microseconds profiled (cprofile mode)
+    collapsed: str
+    top: str
+
+
+def _label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+def _top_table(self_counts: Counter, total_counts: Counter, total: float, n: int, unit: str) -> str:
+    lines = [f"{'self%':>6} {'total%':>7}  {unit:>10}  function"]
+    for func, count in self_counts.most_common(n):
+        lines.append(f"{100 * count / total:6.1f} {100 * total_counts[func] / total:7.1f}  {count:>10,.0f}  {func}")
+    return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """Samples every thread's stack from a background thread."""
+
+    def __init__(self, interval: float = INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                if key not in self.stacks and len(self.stacks) >= MAX_STACKS:
+                    key = f"{stack[-1]};[other]"
+                self.stacks[key] += 1
+            self.samples += 1
+            frame = None  # don't keep the last sampled frame alive until the next sample
+
+    def report(self, seconds: float, n: int) -> ProfileReport:
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        idle = 0
+        for key, count in self.stacks.items():
+            frames = key.split(";")[1:]  # without the thread name
+            if not frames or frames[-1] in IDLE_FRAMES:
+                idle += count
+                continue
+            self_counts[frames[-1]] += count
+            for func in set(frames):
+                total_counts[func] += count
+        total = sum(self.stacks.values()) or 1
+        header = (f"Sampled {self.samples:,} times over {seconds:.1f}s (every {self.interval * 1000:.0f}ms), "
+                  f"{total:,} thread stacks, {100 * idle / total:.0f}% of them idle\n")
+        return ProfileReport(
+            mode="sample", seconds=seconds, samples=self.samples,
+            collapsed="".join(f"{key} {count}\n" for key, count in self.stacks.most_common()),
+            top=header + _top_table(self_counts, total_counts, total, n, "samples"),
+        )
+
+
+class CProfileCapture:
+    """cProfile on the thread that starts it (the event loop)."""
+
+    def __init__(self):
+        import cProfile  # only needed once someone asks for this mode
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self, seconds: float, n: int) -> ProfileReport:
+        import pstats
+        stats = pstats.Stats(self.profile).stats  # func -> (cc, nc, tt, ct, callers)
+        label = {func: f"{os.path.basename(func[0])}:{func[2]}" for func in stats}
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for func, (_, _, tt, ct, _) in stats.items():
+            self_counts[label[func]] += tt * 1e6
+            total_counts[label[func]] += ct * 1e6
+        total = sum(self_counts.values()) or 1
+        header = f"cProfile over {seconds:.1f}s, {total / 1e6:.2f}s of Python time on the event loop\n"
+        return ProfileReport(
+            mode="cprofile", seconds=seconds, samples=int(total),
+            collapsed=self._collapsed(stats, label, total),
+            top=header + _top_table(self_counts, total_counts, total, n, "µs"),
+        )
+
+    @staticmethod
+    def _collapsed(stats: dict, label: dict, total: float) -> str:
+        """
+        Approximate stacks in microseconds. cProfile only keeps caller -> callee edges, so each
+        function's time is split over its callers in proportion to the time spent through each edge.
+        """
+        children: dict = {}
+        for func, (_, _, _, _, callers) in stats.items():
+            for caller, edge in callers.items():
+                children.setdefault(caller, []).append((func, edge[3]))
+        lines: Counter = Counter()
+        floor = total * 0.0005  # skip paths below 0.05% of the total, or the walk explodes
+
+        def walk(func, path: list, scale: float):
+            _, _, tt, ct, _ = stats[func]
+            path = path + [label[func]]
+            if tt * scale * 1e6 >= 1:
+                lines[";".join(path)] += tt * scale * 1e6
+            if len(path) >= MAX_DEPTH:
+                return
+            for child, edge_ct in children.get(func, ()):
+                child_ct = stats[child][3]
+                child_scale = edge_ct * scale / child_ct if child_ct else 0.0
+                if label[child] not in path and child_ct * child_scale * 1e6 >= floor:
+                    walk(child, path, child_scale)
+
+        for func, (_, _, _, ct, callers) in stats.items():
+            if not callers and ct * 1e6 >= floor:
+                walk(func, [], 1.0)
+        return "".join(f"{key} {int(us)}\n" for key, us in lines.most_common() if int(us))
+
+
+class Profiler:
+    """At most one profiling session at a time; keeps the report of the last one."""
+
+    def __init__(self, max_seconds: float = MAX_SECONDS, top_n: int = TOP_N):
+        self.max_seconds = max_seconds
+        self.top_n = top_n
+        self.report: Optional[ProfileReport] = None
+        self._session = None
+        self._mode: Optional[str] = None
+        self._started = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._on_expire: Optional[Callable[[ProfileReport], Awaitable]] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def running(self) -> Optional[str]:
+        """Mode of the running session, or None."""
+        return self._mode if self._session is not None else None
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started if self._session is not None else 0.0
+
+    def start(self, mode: str = "sample", interval: float = INTERVAL, max_seconds: Optional[float] = None,
+              on_expire: Optional[Callable[[ProfileReport], Awaitable]] = None) -> float:
+        """
+        Start a session (on the event loop: cProfile profiles the thread that starts it) for at most
+        `max_seconds`, capped at the profiler's own limit; returns that duration. If it runs out of time
+        before `stop()`, `on_expire(report)` is awaited with its report.
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if max_seconds is not None and not max_seconds > 0:
+            raise ValueError("the duration must be a positive number of seconds")
+        seconds = min(max_seconds, self.max_seconds) if max_seconds is not None else self.max_seconds
+        if self._session is not None:
+            raise RuntimeError(f"a {self._mode} session is already running")
+        self._session = SamplingProfiler(interval) if mode == "sample" else CProfileCapture()
+        self._mode = mode
+        self._started = time.monotonic()
+        self._on_expire = on_expire
+        self._session.start()
+        self._timer = asyncio.get_running_loop().call_later(seconds, self._expire)
+        return seconds
+
+    async def stop(self) -> ProfileReport:
+        """Stop the running session and build its report (off the event loop)."""
+        if self._session is None:
+            raise RuntimeError("no profiling session is running")
+        session, seconds = self._session, self.elapsed()
+        self._session = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        session.stop()
+        self.report = await asyncio.to_thread(session.report, seconds, self.top_n)
+        return self.report
+
+    def _expire(self):
+        self._timer = None
+        task = asyncio.get_running_loop().create_task(self._stop_expired(), name="profiler-expire")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _stop_expired(self):
+        on_expire = self._on_expire
+        report = await self.stop()
+        if on_expire is not None:
+            await on_expire(report)
+
+
+def http_handlers(profiler: Profiler, token: Optional[str] = None) -> list:
+    """
+    Tornado routes serving the last report: /profile/collapsed and /profile/top.
+    With a `token`, a request must carry it as "Authorization: Bearer <token>".
+    """
+    import tornado.web
+
+    class ReportHandler(tornado.web.RequestHandler):
+        def get(self, part: str):
+            if token and not hmac.compare_digest(self.request.headers.get("Authorization", ""), f"Bearer {token}"):
+                self.set_status(401)
+                self.write("missing or wrong bearer token\n")
+                return
+            if profiler.report is None:
+                self.set_status(404)
+                self.write("no profile yet; use /profile start in a DM with the bot\n")
+                return
+            self.set_header("Content-Type", "text/plain; charset=utf-8")
+            self.write(getattr(profiler.report, part))
+
+    return [(r"/profile/(collapsed|top)", ReportHandler)]
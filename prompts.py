@@ -0,0 +1,175 @@
+# prompts.py
+"""
+Prompt catalog and no-repeat deck.
+
+`PromptCatalog` loads prompts from a JSON or CSV file the first time it is
+used, indexes them by topic, and reloads the file when it changes on disk.
+`PromptDeck` is the persisted draw state: a shuffled permutation of prompt
+ids plus a cursor, per deck. A draw is O(1), and nothing repeats until the
+deck is used up.
+
+JSON format:
+    {"topics": {"Fun Memories": 2, ...},          # optional topic weights (default 1)
+     "prompts": [{"topic": "...", "text": "..."}, ...]}
+or just the list of prompts. CSV format: a `topic,text` header row, then one
+prompt per row.
+"""
+import os
+import csv
+import json
+import random
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+ALL_TOPICS = "*"  # deck key used when topics are not rotated
+
+# How the next prompt's topic is chosen:
+#   "all"      - one deck over every prompt (topics come up as they fall)
+#   "rotate"   - topics take turns in catalog order
+#   "weighted" - topic drawn at random using the catalog's topic weights
+ROTATION_MODES = ("all", "rotate", "weighted")
+
+
+@dataclass(frozen=True, slots=True)
+class Prompt:
+    id: str
+    topic: str
+    text: str
+
+
+def prompt_id(topic: str, text: str) -> str:
+    """Stable id, so decks survive edits and reordering of the catalog file."""
+    return hashlib.sha1(f"{topic}\n{text}".encode("utf-8")).hexdigest()[:12]
+
+
+class PromptCatalog:
+    """Prompts loaded lazily from a file, indexed by topic, hot-reloaded when the file changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.by_id: dict[str, Prompt] = {}
+        self.topics: dict[str, list[str]] = {}  # topic -> prompt ids, in file order
+        self.weights: dict[str, float] = {}
+        self.version: Optional[str] = None  # changes whenever the set of prompts changes
+        self._mtime: Optional[float] = None
+
+    def refresh(self) -> bool:
+        """(Re)load the file if it changed since the last load. Returns True if it did."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self._mtime is None:
+                raise
+            return False  # keep serving the last good copy
+        if mtime == self._mtime:
+            return False
+        try:
+            prompts, weights = self._read()
+        except (ValueError, KeyError, TypeError, AttributeError, csv.Error) as e:
+            if self._mtime is None:
+                raise
+            logging.error("Prompt catalog %s is invalid, keeping the previous one: %s", self.path, e)
+            return False
+
+        self.by_id = {p.id: p for p in prompts}
+        self.topics = {}
+        for p in prompts:
+            self.topics.setdefault(p.topic, []).append(p.id)
+        self.weights = {t: float(weights.get(t, 1)) for t in self.topics}
+        self.version = hashlib.sha1("\n".join(sorted(self.by_id)).encode()).hexdigest()[:12]
+        self._mtime = mtime
+        logging.info("Loaded %d prompts in %d topics from %s", len(self.by_id), len(self.topics), self.path)
+        return True
+
+    def _read(self) -> tuple[list[Prompt], dict]:
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            if self.path.endswith(".csv"):
+                rows, weights = list(csv.DictReader(f)), {}
+            else:
+                data = json.load(f)
+                if isinstance(data, list):
+                    rows, weights = data, {}
+                else:
+                    rows, weights = data["prompts"], data.get("topics", {})
+        prompts = []
+        for row in rows:
+            topic, text = row["topic"].strip(), row["text"].strip()
+            if topic and text:
+                prompts.append(Prompt(prompt_id(topic, text), topic, text))
+        if not prompts:
+            raise ValueError(f"Prompt catalog {self.path} has no prompts")
+        return prompts, weights
+
+    def ids(self, topic: str = ALL_TOPICS) -> list[str]:
+        if topic == ALL_TOPICS:
+            return list(self.by_id)
+        return list(self.topics.get(topic, []))
+
+
+class PromptDeck:
+    """
+    Persisted draw state: {"decks": {key: {"order": [ids], "cursor": n, "version": v}}, "topic_cursor": n}.
+    `key` is a topic, or ALL_TOPICS for the single mixed deck.
+    """
+
+    def __init__(self, state: Optional[dict] = None, rng: Optional[random.Random] = None):
+        state = state or {}
+        self.decks: dict[str, dict] = state.get("decks", {})
+        self.topic_cursor: int = state.get("topic_cursor", 0)
+        self.rng = rng or random.Random()
+
+    def to_dict(self) -> dict:
+        return {"decks": self.decks, "topic_cursor": self.topic_cursor}
+
+    def draw(self, catalog: PromptCatalog, mode: str = "all") -> Prompt:
+        catalog.refresh()
+        key = self._pick_deck(catalog, mode)
+        deck = self._deck(catalog, key)
+        if deck["cursor"] >= len(deck["order"]):
+            # Everything in this deck has been used: start a fresh shuffle
+            self.rng.shuffle(deck["order"])
+            deck["cursor"] = 0
+        pid = deck["order"][deck["cursor"]]
+        deck["cursor"] += 1
+        return catalog.by_id[pid]
+
+    def mark_used(self, catalog: PromptCatalog, used_ids: list[str]):
+        """Move already-used prompts to the drawn part of the mixed deck (used when migrating old state)."""
+        deck = self._deck(catalog, ALL_TOPICS)
+        used = [pid for pid in used_ids if pid in catalog.by_id]
+        used_set = set(used)
+        deck["order"] = used + [pid for pid in deck["order"] if pid not in used_set]
+        deck["cursor"] = len(used)
+
+    def _pick_deck(self, catalog: PromptCatalog, mode: str) -> str:
+        topics = list(catalog.topics)
+        if mode == "rotate":
+            topic = topics[self.topic_cursor % len(topics)]
+            self.topic_cursor += 1
+            return topic
+        if mode == "weighted":
+            return self.rng.choices(topics, weights=[catalog.weights[t] for t in topics])[0]
+        return ALL_TOPICS
+
+    def _deck(self, catalog: PromptCatalog, key: str) -> dict:
+        deck = self.decks.get(key)
+        if deck is None:
+            order = catalog.ids(key)
+            self.rng.shuffle(order)
+            deck = self.decks[key] = {"order": order, "cursor": 0, "version": catalog.version}
+        elif deck.get("version") != catalog.version:
+            self._reconcile(catalog, key, deck)
+        return deck
+
+    def _reconcile(self, catalog: PromptCatalog, key: str, deck: dict):
+        """The catalog changed: keep what was drawn, drop removed prompts, shuffle new ones into the rest."""
+        current = set(catalog.ids(key))
+        drawn = [pid for pid in deck["order"][:deck["cursor"]] if pid in current]
+        drawn_set = set(drawn)
+        remaining = [pid for pid in current if pid not in drawn_set]
+        self.rng.shuffle(remaining)
+        deck["order"] = drawn + remaining
+        deck["cursor"] = len(drawn)
+        deck["version"] = catalog.version
@@ -0,0 +1,162 @@
+# records.py
+"""
+Compact reply records.
+
+The reveal only needs a reply's message id, its sender's first name and,
+for the text fallback, its text. `ReplyRecord` keeps just that instead of
+the full `Message.to_dict()` payload. On disk a record is a short JSON
+array `[message_id, ts, kind]` (plus `text` for text replies); the
+sender's name lives once per user in the `users` table. A finished
+round goes to the archive as one compressed blob (`pack_round`).
+
+Run `python records.py` for a size/throughput comparison with the old
+full-payload format.
+"""
+import sys
+import json
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+KIND_TEXT = 0
+KIND_VOICE = 1
+KIND_AUDIO = 2
+KIND_NAMES = {KIND_TEXT: "text", KIND_VOICE: "voice", KIND_AUDIO: "audio"}
+
+_SEPARATORS = (",", ":")
+
+
+@dataclass(slots=True)
+class ReplyRecord:
+    user_id: int
+    message_id: int
+    ts: int  # unix seconds, as sent by Telegram
+    kind: int  # KIND_TEXT / KIND_VOICE / KIND_AUDIO
+    name: str  # sender's first name, interned: one string per user however many replies
+    text: Optional[str] = None  # only kept for text replies (used by the attributed fallback)
+
+    @classmethod
+    def from_message(cls, message) -> "ReplyRecord":
+        """Build a record straight from a telegram.Message (no to_dict round trip)."""
+        kind = KIND_VOICE if message.voice else KIND_AUDIO if message.audio else KIND_TEXT
+        return cls(
+            user_id=message.from_user.id,
+            message_id=message.message_id,
+            ts=int(message.date.timestamp()),
+            kind=kind,
+            name=sys.intern(message.from_user.first_name or "Someone"),
+            text=message.text if kind == KIND_TEXT else None,
+        )
+
+    @classmethod
+    def from_message_dict(cls, data: dict, user_id: Optional[int] = None) -> "ReplyRecord":
+        """Convert an old stored `Message.to_dict()` payload."""
+        sender = data.get("from") or {}
+        kind = KIND_VOICE if data.get("voice") else KIND_AUDIO if data.get("audio") else KIND_TEXT
+        return cls(
+            user_id=int(user_id if user_id is not None else sender.get("id", 0)),
+            message_id=int(data["message_id"]),
+            ts=int(data.get("date") or 0),
+            kind=kind,
+            name=sys.intern(sender.get("first_name") or "Someone"),
+            text=data.get("text") if kind == KIND_TEXT else None,
+        )
+
+    def encode(self) -> str:
+        """Stable on-disk form (user id and name are stored next to it, not in it)."""
+        fields = [self.message_id, self.ts, self.kind]
+        if self.text is not None:
+            fields.append(self.text)
+        return json.dumps(fields, ensure_ascii=False, separators=_SEPARATORS)
+
+    @classmethod
+    def decode(cls, user_id: int, name: Optional[str], payload: str) -> "ReplyRecord":
+        fields = json.loads(payload)
+        return cls(
+            user_id=int(user_id),
+            message_id=fields[0],
+            ts=fields[1],
+            kind=fields[2],
+            name=sys.intern(name or "Someone"),
+            text=fields[3] if len(fields) > 3 else None,
+        )
+
+
+def pack_round(replies: dict[int, list[ReplyRecord]]) -> bytes:
+    """A finished round's replies as one zlib-compressed JSON array of [user_id, name, [record, ...]]."""
+    users = (f"[{uid},{json.dumps(records[0].name, ensure_ascii=False)},[{','.join(r.encode() for r in records)}]]"
+             for uid, records in replies.items() if records)
+    return zlib.compress(f"[{','.join(users)}]".encode("utf-8"), 9)
+
+
+def unpack_round(data: bytes) -> dict[int, list[ReplyRecord]]:
+    """Inverse of `pack_round`: {user_id: [records]}, users in the order they were packed."""
+    replies: dict[int, list[ReplyRecord]] = {}
+    for user_id, name, rows in json.loads(zlib.decompress(data)):
+        name = sys.intern(name)
+        replies[user_id] = [ReplyRecord(user_id, f[0], f[1], f[2], name, f[3] if len(f) > 3 else None) for f in rows]
+    return replies
+
+
+# =========================
+# 📏 FORMAT COMPARISON
+# =========================
+
+def _sample_message_dict(i: int, voice: bool) -> dict:
+    """A realistic private-chat Message.to_dict(), as the old collect_reply stored it."""
+    from datetime import datetime, timezone as dt_timezone
+    from telegram import Message, User, Chat, Voice, MessageEntity
+
+    user = User(id=100000 + i, first_name="Alexandra", is_bot=False, last_name="Johnson",
+                username=f"alex_{i}", language_code="en")
+    chat = Chat(id=100000 + i, type=Chat.PRIVATE, first_name="Alexandra", last_name="Johnson",
+                username=f"alex_{i}")
+    date = datetime(2025, 5, 1, 18, 0, tzinfo=dt_timezone.utc)
+    if voice:
+        msg = Message(message_id=i, date=date, chat=chat, from_user=user,
+                      voice=Voice(file_id="AwACAgQAAxkBAAIB" + "x" * 40, file_unique_id="AgADxx" + str(i),
+                                  duration=14, mime_type="audio/ogg", file_size=41234))
+    else:
+        text = "Honestly? Long walks without my phone, and cooking something slow on a Sunday."
+        msg = Message(message_id=i, date=date, chat=chat, from_user=user, text=text,
+                      entities=(MessageEntity(MessageEntity.ITALIC, 0, 9),))
+    return msg.to_dict()
+
+
+def compare_formats(n: int = 20000) -> dict:
+    """Bytes per reply and encode/decode throughput: full to_dict JSON vs ReplyRecord."""
+    import time
+
+    samples = [_sample_message_dict(i, voice=(i % 4 == 0)) for i in range(n)]
+    records = [ReplyRecord.from_message_dict(d) for d in samples]
+
+    t0 = time.perf_counter()
+    full = [json.dumps(d) for d in samples]
+    t1 = time.perf_counter()
+    for payload in full:
+        json.loads(payload)
+    t2 = time.perf_counter()
+    compact = [r.encode() for r in records]
+    t3 = time.perf_counter()
+    for r, payload in zip(records, compact):
+        ReplyRecord.decode(r.user_id, r.name, payload)
+    t4 = time.perf_counter()
+
+    return {
+        "replies": n,
+        "full_bytes_per_reply": sum(map(len, full)) / n,
+        "compact_bytes_per_reply": sum(map(len, compact)) / n,
+        "full_encode_per_s": n / (t1 - t0),
+        "full_decode_per_s": n / (t2 - t1),
+        "compact_encode_per_s": n / (t3 - t2),
+        "compact_decode_per_s": n / (t4 - t3),
+    }
+
+
+if __name__ == "__main__":
+    result = compare_formats()
+    print(f"{result['replies']} replies (1 in 4 voice)")
+    print(f"  full to_dict JSON : {result['full_bytes_per_reply']:7.1f} B/reply  "
+          f"encode {result['full_encode_per_s']:>10,.0f}/s  decode {result['full_decode_per_s']:>10,.0f}/s")
+    print(f"  compact record    : {result['compact_bytes_per_reply']:7.1f} B/reply  "
+          f"encode {result['compact_encode_per_s']:>10,.0f}/s  decode {result['compact_decode_per_s']:>10,.0f}/s")
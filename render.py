@@ -0,0 +1,68 @@
+# render.py
+"""
+Pre-rendered reply texts.
+
+/start, /nexttimes and the welcome messages only depend on the bot's
+username and on the group's current round (prompt time and schedule),
+so `RenderCache` renders all of a group's texts once and serves them
+until the round changes. The username comes from the getMe that PTB
+makes while initializing the bot, so no handler calls getMe again.
+
+The bot calls `invalidate(state)` whenever a round's times change (new
+prompt, cleanup, /schedule, a reload from another worker). A rendering
+can also say when it goes stale by itself (a "next prompt at ..." text
+once that time has passed).
+
+The welcome texts are templates with a `{name}` placeholder, filled in by
+welcome.py with everyone who joined in one burst.
+"""
+from typing import Optional, Callable
+
+import clock
+from state import RoundState
+from metrics import RENDER_CACHE
+
+# render(state, bot_link) -> ({text name: text}, unix time it goes stale or None)
+Renderer = Callable[[Optional[RoundState], str], tuple[dict[str, str], Optional[float]]]
+
+
+class RenderCache:
+    """A group's rendered texts (keyed by tenant id; None for users without a group), rebuilt after changes."""
+
+    def __init__(self, render: Renderer):
+        self.render = render
+        self.bot_link: Optional[str] = None
+        self._entries: dict[Optional[int], tuple[dict[str, str], Optional[float]]] = {}
+        self._generation = 0  # bumped by invalidate(), so a rendering that raced one isn't kept
+
+    def set_identity(self, me):
+        """Take the bot's username from its telegram.User (what PTB's Bot.initialize fetched)."""
+        self.bot_link = f"https://t.me/{me.username}"
+        self.invalidate()
+
+    def get(self, state: Optional[RoundState], name: str, bot=None) -> str:
+        """Text `name` for `state`'s group. `bot` supplies the identity on first use if it isn't set yet."""
+        if self.bot_link is None and bot is not None:
+            self.set_identity(bot.bot)
+        key = state.tenant_id if state is not None else None
+        entry = self._entries.get(key)
+        if entry is not None and (entry[1] is None or clock.time() < entry[1]):
+            RENDER_CACHE.inc(result="hit")
+            return entry[0][name]
+        RENDER_CACHE.inc(result="miss")
+        generation = self._generation
+        entry = self.render(state, self.bot_link or "")
+        if generation == self._generation:
+            self._entries[key] = entry
+        return entry[0][name]
+
+    def invalidate(self, state: Optional[RoundState] = None):
+        """Drop `state`'s texts (everything if None). Safe to call from any thread."""
+        self._generation += 1
+        if state is None:
+            self._entries = {}
+        else:
+            self._entries.pop(state.tenant_id, None)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,228 @@
+# scheduler.py
+"""
+Round scheduler: one timer for every group's round events.
+
+Each group has a `GroupSchedule` (prompt time, timezone, and the hours
+after the prompt at which the reminder, reveal and cleanup happen).
+`RoundScheduler` keeps every pending (due time, group, event) entry in a
+single min-heap and arms one event-loop timer for the earliest of them, so
+thousands of groups cost thousands of heap entries, not thousands of
+APScheduler jobs. Groups that share a prompt time are spread over a jitter
+window (a fixed offset per group, so it survives restarts) so they don't
+all hit the Bot API in the same second.
+"""
+import heapq
+import asyncio
+import hashlib
+import logging
+import itertools
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, time as dtime
+from typing import Optional, Callable, Awaitable
+
+import pytz
+
+import clock
+
+EVENTS = ("prompt", "reminder", "reveal", "cleanup")
+ROUND_EVENTS = ("reminder", "reveal", "cleanup")
+
+MAX_SLEEP = 60.0  # re-check the wall clock at least this often (suspend, clock changes)
+LATE_WARNING = 30.0  # log events that fire this many seconds late
+
+
+@dataclass(frozen=True, slots=True)
+class GroupSchedule:
+    prompt_time: dtime  # local wall-clock time, no tzinfo
+    tz: str  # IANA name, e.g. "Europe/Amsterdam"
+    reminder_hours: float
+    reveal_hours: float
+    cleanup_hours: float
+
+    @classmethod
+    def from_dict(cls, data: dict, default: "GroupSchedule") -> "GroupSchedule":
+        """Stored overrides on top of `default` (missing keys keep the default)."""
+        prompt_time = data.get("prompt_time")
+        return cls(
+            prompt_time=dtime.fromisoformat(prompt_time) if prompt_time else default.prompt_time,
+            tz=data.get("tz") or default.tz,
+            reminder_hours=float(data.get("reminder_hours", default.reminder_hours)),
+            reveal_hours=float(data.get("reveal_hours", default.reveal_hours)),
+            cleanup_hours=float(data.get("cleanup_hours", default.cleanup_hours)),
+        )
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["prompt_time"] = self.prompt_time.strftime("%H:%M")
+        return data
+
+    def validate(self):
+        """Raise ValueError if the schedule can't work."""
+        try:
+            self.zone()
+        except pytz.UnknownTimeZoneError:
+            raise ValueError(f"unknown timezone {self.tz!r}")
+        if not 0 < self.reminder_hours <= self.reveal_hours < self.cleanup_hours:
+            raise ValueError("hours must satisfy 0 < reminder <= reveal < cleanup")
+
+    def zone(self):
+        return pytz.timezone(self.tz)
+
+    def now(self) -> datetime:
+        return clock.now(self.zone())
+
+    def next_prompt(self, after: datetime, jitter: float = 0.0) -> datetime:
+        """First prompt strictly after `after` (DST-aware), shifted by `jitter` seconds."""
+        zone = self.zone()
+        day = after.astimezone(zone).date()
+        for _ in range(3):
+            local = zone.localize(datetime.combine(day, self.prompt_time))
+            target = zone.normalize(local + timedelta(seconds=jitter))
+            if target > after:
+                return target
+            day += timedelta(days=1)
+        raise AssertionError("unreachable")
+
+    def event_times(self, prompt_dt: datetime) -> dict[str, datetime]:
+        """When this round's reminder, reveal and cleanup happen, in the group's timezone."""
+        zone = self.zone()
+        return {
+            "reminder": zone.normalize(prompt_dt + timedelta(hours=self.reminder_hours)),
+            "reveal": zone.normalize(prompt_dt + timedelta(hours=self.reveal_hours)),
+            "cleanup": zone.normalize(prompt_dt + timedelta(hours=self.cleanup_hours)),
+        }
+
+
+def group_jitter(tenant_id: int, window: float) -> float:
+    """A stable offset in [0, window) seconds for this group."""
+    if window <= 0:
+        return 0.0
+    h = int.from_bytes(hashlib.sha1(str(tenant_id).encode()).digest()[:8], "big")
+    return (h % int(window * 1000)) / 1000
+
+
+class RoundScheduler:
+    """Min-heap of (due, group, event) entries behind a single event-loop timer."""
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, int, str, int]] = []  # (due ts, seq, tenant id, event, generation)
+        self._seq = itertools.count()  # FIFO among entries due at the same moment
+        self._generation: dict[tuple[int, str], int] = {}  # bumped to drop an entry without searching the heap
+        self._pending: dict[tuple[int, str], float] = {}  # due time of entries queued with replace=True
+        self._callback: Optional[Callable[[int, str, float], Awaitable]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: set[asyncio.Task] = set()
+
+    # =========================
+    # 📤 PUBLIC API
+    # =========================
+
+    def schedule(self, tenant_id: int, event: str, due: datetime, replace: bool = False):
+        """
+        Run `event` for `tenant_id` at `due`. With replace=True, an entry already pending
+        for the same group and event is dropped (used for the next prompt, which moves
+        when a group changes its schedule). Round events never replace each other:
+        one round's cleanup can still be pending when the next round's reveal is queued.
+        """
+        key = (tenant_id, event)
+        if replace:
+            self._generation[key] = self._generation.get(key, 0) + 1
+            self._pending[key] = due.timestamp()
+        entry = (due.timestamp(), next(self._seq), tenant_id, event, self._generation.get(key, 0))
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._arm()
+
+    def cancel(self, tenant_id: int, event: str):
+        """Drop pending `event` entries for `tenant_id` (lazily, when they reach the top)."""
+        key = (tenant_id, event)
+        self._generation[key] = self._generation.get(key, 0) + 1
+        self._pending.pop(key, None)
+
+    def pending(self, tenant_id: int, event: str) -> Optional[float]:
+        """Due time (unix) of the entry queued for `event` with replace=True, if it hasn't fired yet."""
+        return self._pending.get((tenant_id, event))
+
+    def clear(self):
+        """Drop every pending entry (the queue is rebuilt from the state when a process takes over)."""
+        self._heap = []
+        self._generation = {}
+        self._pending = {}
+        self._arm()
+
+    def start(self, callback: Callable[[int, str, float], Awaitable]):
+        """Begin firing: `await callback(tenant_id, event, due)` for each due entry, each in its own task."""
+        self._callback = callback
+        self._loop = asyncio.get_running_loop()
+        self._arm()
+
+    async def stop(self):
+        """Stop the timer and cancel events that are still running."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._callback = None
+        self._loop = None
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def next_due(self) -> Optional[float]:
+        """Due time (unix) of the earliest live entry, or None if nothing is queued."""
+        while self._heap:
+            _, _, tenant_id, event, generation = self._heap[0]
+            if generation == self._generation.get((tenant_id, event), 0):
+                return self._heap[0][0]
+            heapq.heappop(self._heap)  # replaced or cancelled
+        return None
+
+    def pop_due(self, now: float) -> list[tuple[int, str, float]]:
+        """
+        Remove and return (tenant id, event, due) for every live entry due at `now`.
+        The timer does this itself once started; simulate.py calls it directly to drive virtual time.
+        """
+        due_entries = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, tenant_id, event, generation = heapq.heappop(self._heap)
+            if generation != self._generation.get((tenant_id, event), 0):
+                continue  # replaced or cancelled
+            if self._pending.get((tenant_id, event)) == due:
+                del self._pending[(tenant_id, event)]
+            if now - due > LATE_WARNING:
+                logging.warning("%s for %s fired %.0fs late", event, tenant_id, now - due)
+            due_entries.append((tenant_id, event, due))
+        return due_entries
+
+    def __len__(self):
+        return len(self._heap)
+
+    # =========================
+    # ⚙️ INTERNALS
+    # =========================
+
+    def _arm(self):
+        if self._callback is None:
+            return  # not started yet; start() arms the timer
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._heap:
+            delay = min(MAX_SLEEP, max(0.0, self._heap[0][0] - clock.time()))
+            self._timer = self._loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        for tenant_id, event, due in self.pop_due(clock.time()):
+            task = self._loop.create_task(self._run(tenant_id, event, due), name=f"{event}:{tenant_id}")
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        self._arm()
+
+    async def _run(self, tenant_id: int, event: str, due: float):
+        try:
+            await self._callback(tenant_id, event, due)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("%s for %s failed", event, tenant_id)
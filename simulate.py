@@ -0,0 +1,351 @@
+# simulate.py
+"""
+Replay months of rounds in virtual time.
+
+Runs the real bot (build_app, run_scheduled_event, the outbox steps)
+against an in-process fake Bot API (fakeapi.py, recording every call)
+on a `clock.VirtualClock`. Instead of starting the scheduler's timer, the
+driver below repeatedly jumps the clock to the next due event: either a
+scheduler entry (prompt, reminder, reveal, cleanup) or a simulated user
+action (a private reply, joining the discussion group after an invite).
+A year of rounds takes seconds.
+
+After every reveal and cleanup it checks what actually reached the API
+against a ledger of what the simulated users did:
+
+* overlap         a round's discussion opened (its reveal) while the
+                  previous round's was still open. A prompt going out
+                  before the previous cleanup is the default schedule
+                  (cleanup 45h after the prompt) and is not counted.
+* no_invite       someone who replied got no invite link at the reveal
+                  (e.g. every reply came before midnight and the reveal
+                  looked for the next day's participants)
+* missing_reply   a reply from before the reveal was not forwarded
+* not_removed     someone who joined for a round is still in the discussion
+                  group after that round's cleanup
+* wrong_round     a cleanup removed someone who joined for another round
+* prompts         a day without exactly one prompt
+
+Per simulated day it prints API calls and state store I/O; it exits 1 if
+any invariant was broken.
+
+    python simulate.py                                  # a year, 8 users
+    python simulate.py --days 60 --users 30 --hours 20,22,23 --quiet
+"""
+import sys
+import heapq
+import random
+import asyncio
+import argparse
+import tempfile
+import shutil
+from datetime import date, datetime, timedelta
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import clock
+from bench import load_bot, _free_port
+from fakeapi import FakeBotAPI, start_fake_api
+
+DAYS = 365
+USERS = 8
+REPLY_RATE = 0.6  # chance that a user replies to a given prompt
+JOIN_RATE = 0.8  # chance that an invited user joins the discussion group
+EVENING_RATE = 0.25  # chance that a round's replies all come in the evening of the prompt, before midnight
+TENANT_ID = -1002000000000
+DISCUSSION_ID = -1002000000001
+
+
+@dataclass
+class Round:
+    key: str
+    prompt_ts: float
+    reveal_ts: float
+    cleanup_ts: float
+    replies: dict[int, list[int]] = field(default_factory=dict)  # user -> message ids sent before the reveal
+    joined: set[int] = field(default_factory=set)
+    revealed: bool = False
+    closed: bool = False
+
+
+class Simulation:
+    """The driver: virtual clock, simulated users, and the invariant checks."""
+
+    def __init__(self, bot, app, api: FakeBotAPI, virtual: clock.VirtualClock, args):
+        self.bot = bot
+        self.app = app
+        self.api = api
+        self.clock = virtual
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.users = list(range(1, args.users + 1))
+        self.state = None
+        self.rounds: list[Round] = []
+        self.in_discussion: dict[int, Round] = {}  # user -> the round they joined for
+        self.actions: list[tuple[float, int, str, tuple]] = []  # heap: (due, seq, kind, args)
+        self.seq = 0
+        self.update_id = 0
+        self.message_ids: Counter = Counter()
+        self.violations: dict[str, list[str]] = defaultdict(list)
+        self.day_violations: Counter = Counter()
+        self.day_prompts = 0
+
+    # =========================
+    # 🎬 DRIVER
+    # =========================
+
+    async def run(self, start: float, days: int):
+        bot = self.bot
+        self.state = bot.TENANTS.add(TENANT_ID, "Simulated group")
+        bot.TENANTS.set_discussion(self.state, DISCUSSION_ID)
+        if self.args.hours:
+            reminder, reveal, cleanup = self.args.hours
+            self.state.set_schedule({**bot.group_schedule(self.state).to_dict(), "reminder_hours": reminder,
+                                     "reveal_hours": reveal, "cleanup_hours": cleanup})
+        for uid in self.users:
+            bot.TENANTS.see_user(uid, TENANT_ID)
+        bot.queue_group(self.state, bot.group_schedule(self.state).now())
+        await asyncio.to_thread(bot.TENANTS.flush)
+
+        # Local midnight after the last day (not start + days * 24h, which is off by an hour across DST)
+        end = self.bot.TZ.localize(datetime.combine(self.local_date(start) + timedelta(days=days),
+                                                    datetime.min.time())).timestamp()
+        day = self.local_date(start)
+        snapshot = self.io_snapshot()
+        while True:
+            due = min(filter(None, (bot.SCHEDULER.next_due(), self.actions[0][0] if self.actions else None)),
+                      default=None)
+            if due is None or due >= end:
+                break
+            while self.local_date(due) != day:
+                snapshot = self.end_day(day, snapshot)
+                day += timedelta(days=1)
+            self.clock.set(max(due, self.clock.time()))
+            if self.actions and self.actions[0][0] <= self.clock.time():
+                _, _, kind, action_args = heapq.heappop(self.actions)
+                await getattr(self, kind)(*action_args)
+            else:
+                for tenant_id, event, event_due in bot.SCHEDULER.pop_due(self.clock.time()):
+                    await self.run_event(tenant_id, event, event_due)
+            await asyncio.to_thread(bot.TENANTS.flush)  # what the background writer would do
+        self.end_day(day, snapshot)
+
+    def at(self, due: float, kind: str, *action_args):
+        self.seq += 1
+        heapq.heappush(self.actions, (due, self.seq, kind, action_args))
+
+    def local_date(self, ts: float) -> date:
+        return datetime.fromtimestamp(ts, self.bot.TZ).date()
+
+    # =========================
+    # ⏰ ROUND EVENTS + CHECKS
+    # =========================
+
+    async def run_event(self, tenant_id: int, event: str, due: float):
+        bot, state = self.bot, self.state
+        before = state.get_participants()
+        round_key = bot.current_round_key(state)
+        self.api.log.clear()
+        if event == "prompt":
+            self.day_prompts += 1
+        elif event == "reveal":
+            for r in self.rounds:
+                if r.revealed and not r.closed:
+                    self.violate("overlap", f"round {r.key} still open (cleanup at {self.fmt(r.cleanup_ts)}) "
+                                            f"when round {round_key} was revealed")
+
+        await bot.run_scheduled_event(self.app.bot, tenant_id, event, due)
+
+        if event == "prompt":
+            times = bot.calculate_event_times(state, state.last_prompt_time)
+            r = Round(state.last_prompt_round, state.last_prompt_time.timestamp(),
+                      times["reveal"].timestamp(), times["cleanup"].timestamp())
+            self.rounds.append(r)
+            # Who answers, and when: any time between the prompt and the reveal, or in some rounds
+            # only on the evening of the prompt (so the reveal runs on a later date than every reply)
+            midnight = datetime.combine(self.local_date(r.prompt_ts) + timedelta(days=1), datetime.min.time())
+            last = r.reveal_ts - 60
+            if self.random.random() < EVENING_RATE:
+                last = min(last, bot.TZ.localize(midnight).timestamp() - 60)
+            for uid in self.users:
+                if self.random.random() < self.args.reply_rate:
+                    for _ in range(self.random.choice((1, 1, 2))):
+                        self.at(self.random.uniform(r.prompt_ts, last), "reply", uid, r)
+        elif event == "reveal":
+            r = self.round_for("reveal", due)
+            if r is None:
+                return
+            r.revealed = True
+            invited = {int(p["chat_id"]) for method, p in self.api.log
+                       if method == "sendMessage" and int(p["chat_id"]) > 0 and "discussion link" in p["text"]}
+            forwarded = set()
+            for method, p in self.api.log:
+                if method in ("forwardMessages", "copyMessages"):
+                    forwarded.update((int(p["from_chat_id"]), m) for m in p["message_ids"])
+                elif method == "forwardMessage":
+                    forwarded.add((int(p["from_chat_id"]), int(p["message_id"])))
+            missed = set(r.replies) - invited
+            if missed:
+                self.violate("no_invite", f"round {r.key}: {len(missed)} of {len(r.replies)} repliers got no invite "
+                                          f"(the bot had {len(before['current'])} participant(s) for round "
+                                          f"{before['last_round']}; revealing round {round_key})")
+            lost = [(uid, m) for uid, ids in r.replies.items() for m in ids if (uid, m) not in forwarded]
+            if lost:
+                self.violate("missing_reply", f"round {r.key}: {len(lost)} reply(s) not forwarded")
+            for uid in invited:
+                if self.random.random() < JOIN_RATE:
+                    self.at(self.clock.time() + self.random.uniform(60, 3 * 3600), "join", uid, r)
+        elif event == "cleanup":
+            r = self.round_for("cleanup", due)
+            if r is None:
+                return
+            r.closed = True
+            kicked = {int(p["user_id"]) for method, p in self.api.log if method == "banChatMember"}
+            for uid in kicked:
+                other = self.in_discussion.pop(uid, None)
+                if other is not None and other is not r:
+                    self.violate("wrong_round", f"round {r.key} cleanup removed user {uid}, who joined for "
+                                                f"round {other.key}")
+            left = [uid for uid, joined_for in self.in_discussion.items() if joined_for is r]
+            if left:
+                self.violate("not_removed", f"round {r.key}: {len(left)} member(s) still in the discussion group "
+                                            f"after its cleanup")
+                for uid in left:
+                    del self.in_discussion[uid]
+
+    def round_for(self, event: str, due: float) -> Optional[Round]:
+        """The round whose `event` was due at `due`."""
+        attr = "reveal_ts" if event == "reveal" else "cleanup_ts"
+        for r in self.rounds:
+            if abs(getattr(r, attr) - due) < 1:
+                return r
+        self.violate("unexpected", f"{event} at {self.fmt(due)} matches no round")
+        return None
+
+    # =========================
+    # 👤 SIMULATED USERS
+    # =========================
+
+    async def reply(self, uid: int, r: Round):
+        from telegram import Update
+
+        self.update_id += 1
+        self.message_ids[uid] += 1
+        message_id = self.message_ids[uid]
+        user = {"id": uid, "is_bot": False, "first_name": f"User{uid}"}
+        data = {"update_id": self.update_id, "message": {
+            "message_id": message_id, "date": int(self.clock.time()), "text": f"Answer {message_id}",
+            "chat": {"id": uid, "type": "private", "first_name": user["first_name"]}, "from": user}}
+        await self.app.process_update(Update.de_json(data, self.app.bot))
+        if not r.revealed:
+            r.replies.setdefault(uid, []).append(message_id)
+
+    async def join(self, uid: int, r: Round):
+        from telegram import Update
+
+        if r.closed or uid in self.in_discussion:
+            return
+        self.update_id += 1
+        user = {"id": uid, "is_bot": False, "first_name": f"User{uid}"}
+        data = {"update_id": self.update_id, "chat_member": {
+            "chat": {"id": DISCUSSION_ID, "type": "supergroup", "title": "Discussion"}, "from": user,
+            "date": int(self.clock.time()), "old_chat_member": {"status": "left", "user": user},
+            "new_chat_member": {"status": "member", "user": user}}}
+        await self.app.process_update(Update.de_json(data, self.app.bot))
+        self.in_discussion[uid] = r
+        r.joined.add(uid)
+
+    # =========================
+    # 📋 REPORTING
+    # =========================
+
+    def violate(self, kind: str, message: str):
+        self.violations[kind].append(message)
+        self.day_violations[kind] += 1
+
+    def fmt(self, ts: float) -> str:
+        return datetime.fromtimestamp(ts, self.bot.TZ).strftime("%a %d %b %H:%M")
+
+    def io_snapshot(self) -> tuple:
+        from metrics import STORE_SECONDS, STORE_BYTES
+        return (sum(self.api.calls.values()), STORE_SECONDS.count(op="read"), STORE_BYTES.value(op="read"),
+                STORE_SECONDS.count(op="write"), STORE_BYTES.value(op="write"))
+
+    def end_day(self, day: date, snapshot: tuple) -> tuple:
+        if self.day_prompts != 1:
+            self.violate("prompts", f"{day}: {self.day_prompts} prompts")
+        now = self.io_snapshot()
+        calls, reads, read_bytes, writes, write_bytes = (b - a for a, b in zip(snapshot, now))
+        if not self.args.quiet:
+            flags = " ".join(f"{k}x{n}" if n > 1 else k for k, n in sorted(self.day_violations.items()))
+            print(f"{day} {day:%a}  api {calls:5}  store reads {reads:5} ({read_bytes / 1024:7.1f} kB)  "
+                  f"writes {writes:4} ({write_bytes / 1024:7.1f} kB)" + (f"  ! {flags}" if flags else ""))
+        self.day_violations.clear()
+        self.day_prompts = 0
+        return now
+
+
+async def simulate(bot, api: FakeBotAPI, port: int, args) -> Simulation:
+    from dispatcher import Dispatcher
+
+    server = start_fake_api(api, port)
+    start = bot.TZ.localize(datetime.combine(args.start, datetime.min.time())).timestamp()
+    virtual = clock.VirtualClock(start)
+    previous = clock.set_clock(virtual)
+    bot.DISPATCHER = Dispatcher(global_rate=1e6, chat_limits=False)  # don't pace virtual time in real time
+    app = bot.build_app()
+    await app.initialize()
+
+    async def noop():
+        pass
+
+    bot.LEASE.start(noop, noop)
+    while not bot.LEASE.is_leader:
+        await asyncio.sleep(0.01)
+    sim = Simulation(bot, app, api, virtual, args)
+    try:
+        await sim.run(start, args.days)
+    finally:
+        await bot.LEASE.stop()
+        await bot.DISPATCHER.close()
+        await app.shutdown()
+        bot.TENANTS.close()
+        server.stop()
+        clock.set_clock(previous)
+    return sim
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay rounds in virtual time and check invariants")
+    parser.add_argument("--days", type=int, default=DAYS)
+    parser.add_argument("--users", type=int, default=USERS)
+    parser.add_argument("--reply-rate", type=float, default=REPLY_RATE)
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2025, 1, 6), help="first day (YYYY-MM-DD)")
+    parser.add_argument("--hours", type=lambda s: tuple(float(h) for h in s.split(",")),
+                        help="reminder,reveal,cleanup hours after the prompt (default: the bot's)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+
+    api = FakeBotAPI(latency=0, record=True)
+    port = _free_port()
+    workdir = tempfile.mkdtemp(prefix="ripple-sim-")
+    try:
+        bot = load_bot(f"http://127.0.0.1:{port}", workdir)
+        sim = asyncio.run(simulate(bot, api, port, args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{args.days} days, {len(sim.rounds)} rounds, {sum(api.calls.values())} API calls "
+          f"({', '.join(f'{m} {n}' for m, n in api.calls.most_common(6))})")
+    if not sim.violations:
+        print("All invariants held.")
+        return 0
+    for kind, messages in sorted(sim.violations.items()):
+        print(f"{kind}: {len(messages)}, e.g. {messages[0]}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
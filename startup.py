@@ -0,0 +1,109 @@
+# startup.py
+"""
+Cold-start bookkeeping.
+
+Render restarts the service often, so the time from process start to the
+first handled update matters. `StartupTimer` records when each startup
+phase finished, in seconds since the process started (read from /proc
+on Linux, otherwise since this module was imported). The phases are
+exported as ripple_startup_seconds{phase}, and a summary is logged once
+the first update has been handled.
+
+`WebhookBot` is PTB's ExtBot with a cheaper `set_webhook`: it asks
+getWebhookInfo first, and skips setWebhook when Telegram already has the
+same URL, allowed updates and max connections. setWebhook is the slowest
+call of a boot, and Telegram throttles it when a service restarts in a
+loop. `WebhookUpdater` calls `on_ready` once the webhook server is up, so
+work that isn't needed for the first update can wait until then. Both
+only override public methods.
+"""
+import os
+import time
+import logging
+from typing import Optional, Callable
+
+from telegram.ext import ExtBot, Updater
+
+from metrics import STARTUP_SECONDS
+
+
+def _process_started() -> float:
+    """time.monotonic() at which this process started (Linux), or now if /proc can't tell."""
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])  # field 22: start time, in ticks after boot
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.monotonic() - (uptime - ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+
+
+class StartupTimer:
+    """When each startup phase finished, in seconds since the process started."""
+
+    def __init__(self):
+        self.started = _process_started()
+        self.phases: dict[str, float] = {}
+        self.waiting_first_update = True
+
+    def mark(self, phase: str) -> float:
+        seconds = self.phases[phase] = time.monotonic() - self.started
+        STARTUP_SECONDS.set(seconds, phase=phase)
+        return seconds
+
+    def first_update_handled(self):
+        if not self.waiting_first_update:
+            return
+        self.waiting_first_update = False
+        seconds = self.mark("first_update")
+        steps = ", ".join(f"{phase} {at:.2f}s" for phase, at in self.phases.items() if phase != "first_update")
+        logging.info("🚀 First update handled %.2fs after process start (%s)", seconds, steps)
+
+
+STARTUP = StartupTimer()
+
+
+class WebhookBot(ExtBot):
+    """ExtBot that leaves an identical webhook registration alone."""
+
+    __slots__ = ()
+
+    async def set_webhook(self, url: str, *args, **kwargs) -> bool:
+        # Telegram can't tell us the secret token, so with one (or a certificate, or pending
+        # updates to drop) we can't know the registration matches: register as usual
+        if not (args or kwargs.get("drop_pending_updates") or kwargs.get("certificate")
+                or kwargs.get("secret_token")):
+            try:
+                if await self._webhook_matches(url, kwargs.get("allowed_updates"), kwargs.get("ip_address"),
+                                               kwargs.get("max_connections") or 40):
+                    logging.info("Webhook already registered with these settings; skipping setWebhook")
+                    return True
+            except Exception as e:
+                logging.info("getWebhookInfo failed, registering the webhook anyway: %s", e)
+        return await super().set_webhook(url, *args, **kwargs)
+
+    async def _webhook_matches(self, url: str, allowed_updates, ip_address, max_connections: int) -> bool:
+        info = await self.get_webhook_info()
+        return (info.url == url
+                and sorted(info.allowed_updates or ()) == sorted(allowed_updates or ())
+                and (info.max_connections or 40) == max_connections
+                and (ip_address is None or info.ip_address == ip_address)
+                and not info.has_custom_certificate)
+
+
+class WebhookUpdater(Updater):
+    """Updater that reports when the webhook server is up."""
+
+    __slots__ = ("on_ready",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_ready: Optional[Callable[[], None]] = None
+
+    async def start_webhook(self, *args, **kwargs):
+        queue = await super().start_webhook(*args, **kwargs)
+        STARTUP.mark("webhook")
+        if self.on_ready is not None:
+            self.on_ready()
+        return queue
@@ -0,0 +1,593 @@
+# state.py
+"""
+In-memory round state with write-behind persistence.
+
+Each main group ("tenant") has a `RoundState`, loaded from the store once
+at startup; it is the only copy handlers read from. Mutations only touch
+memory and mark what changed. `Tenants` holds all of them, routes private
+messages to the right group, and runs the one background thread that
+flushes changes to the store in batches, so nothing on the event loop
+waits for disk.
+
+When several worker processes share one store (`shared=True`), every
+flush also bumps a per-group change counter, and the writer thread reloads
+groups whose counter another process moved.
+"""
+import copy
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional, Iterable, Callable
+
+from storage import StateStore
+from records import ReplyRecord
+
+FLUSH_INTERVAL = 0.5  # seconds between background flushes
+
+
+class RoundState:
+    """Authoritative copy of one group's state. Reads never hit disk; `Tenants` flushes the writes."""
+
+    def __init__(self, store: StateStore, tenant_id: int, title: Optional[str] = None):
+        self.store = store
+        self.tenant_id = tenant_id  # chat id of the main group
+        self.title = title
+
+        self.discussion_chat_id: Optional[int] = None
+        self.last_prompt_time: Optional[datetime] = None
+        self.last_prompt_round: Optional[str] = None
+        self.participants: set[int] = set()
+        self.participants_round: Optional[str] = None
+        self.invite_link: Optional[str] = None
+        self.prompt_deck: dict = {}  # PromptDeck.to_dict()
+        self.schedule: dict = {}  # GroupSchedule overrides (prompt time, timezone, offsets)
+        self.event_marks: dict[str, float] = {}  # event -> due time of the last run started (for catch-up)
+        self.round_topic: Optional[str] = None  # topic of the prompt posted last (kept with the round's archive)
+        self.version = 0  # the store's change counter as of our last load/flush
+        self.stale = False  # another process wrote in between; reload when nothing is pending
+        self.legacy_used_prompts: list[int] = []  # old {"used": [indices]} state, until the deck replaces it
+        self.replies: dict[int, list[ReplyRecord]] = {}
+        self.members: dict[str, set[int]] = {}  # round key -> users seen joining the discussion group
+
+        # Pending changes since the last flush
+        self._lock = threading.Lock()
+        self._dirty: set[str] = set()
+        self._clear_replies = False
+        self._new_replies: list[tuple[str, ReplyRecord]] = []
+        self._reset_participants = False
+        self._new_participants: list[tuple[int, str]] = []
+        self._dropped_participants: list[str] = []  # round keys whose participant rows go
+        self._member_ops: list[tuple[str, Optional[str], int]] = []  # ("add"|"remove", round_key, user_id)
+        self._archives: list[tuple[str, Optional[str], dict]] = []  # (round_key, topic, replies) to archive
+        self._closed_rounds: list[str] = []  # round keys to fold into the stats
+
+    # =========================
+    # 📥 LOAD / FLUSH
+    # =========================
+
+    def load(self, data: Optional[dict] = None):
+        """Take this group's state from a store snapshot (read now if not given). Done before it is served."""
+        if data is None:
+            data = self.store.load_snapshot(self.tenant_id)["tenants"][self.tenant_id]
+        meta = data["meta"]
+        self.version = int(meta.get("version") or 0)
+        cid = meta.get("discussion_chat_id")
+        self.discussion_chat_id = int(cid) if cid is not None else None
+
+        ts = data["last_prompt_time"]
+        self.last_prompt_time = datetime.fromisoformat(ts) if ts else None
+        self.last_prompt_round = meta.get("last_prompt_round")
+
+        p = data["participants"]
+        self.participants = set(p["current"])
+        self.participants_round = p["last_round"]
+        self.invite_link = p["last_invite_link"]
+
+        self.prompt_deck = json.loads(meta.get("prompt_deck") or "{}")
+        if not self.prompt_deck:
+            self.legacy_used_prompts = json.loads(meta.get("used_prompts") or "[]")
+        self.schedule = json.loads(meta.get("schedule") or "{}")
+        self.event_marks = json.loads(meta.get("event_marks") or "{}")
+        self.round_topic = meta.get("round_topic")
+        self.replies = data["replies"]
+        self.members = data["members"]
+
+    def reload(self) -> bool:
+        """Re-read from the store after another process changed it. Skipped while local changes are pending."""
+        with self._lock:
+            if self._pending():
+                return False
+            self.load()
+            self.stale = False
+            return True
+
+    def _pending(self) -> bool:
+        return bool(self._dirty or self._clear_replies or self._new_replies or self._reset_participants
+                    or self._new_participants or self._dropped_participants or self._member_ops or self._archives
+                    or self._closed_rounds)
+
+    def flush(self, shared: bool = False):
+        """Write everything that changed since the last flush in one transaction."""
+        with self._lock:
+            if not self._pending():
+                return
+            dirty, self._dirty = self._dirty, set()
+            clear_replies, self._clear_replies = self._clear_replies, False
+            new_replies, self._new_replies = self._new_replies, []
+            reset_participants, self._reset_participants = self._reset_participants, False
+            new_participants, self._new_participants = self._new_participants, []
+            dropped_participants, self._dropped_participants = self._dropped_participants, []
+            member_ops, self._member_ops = self._member_ops, []
+            archives, self._archives = self._archives, []
+            closed_rounds, self._closed_rounds = self._closed_rounds, []
+            # Values are captured under the lock so the flush is a consistent snapshot
+            snapshot = {
+                "discussion_chat_id": self.discussion_chat_id,
+                "last_prompt_time": self.last_prompt_time,
+                "last_prompt_round": self.last_prompt_round,
+                "participants": sorted(self.participants),
+                "participants_round": self.participants_round,
+                "invite_link": self.invite_link,
+                "prompt_deck": json.dumps(self.prompt_deck),
+                "schedule": json.dumps(self.schedule),
+                "event_marks": json.dumps(self.event_marks),
+                "round_topic": self.round_topic,
+            }
+
+        tid = self.tenant_id
+        try:
+            with self.store.transaction():
+                if "discussion_chat_id" in dirty and snapshot["discussion_chat_id"] is not None:
+                    self.store.set_tenant_meta(tid, "discussion_chat_id", str(snapshot["discussion_chat_id"]))
+                if "last_prompt_time" in dirty and snapshot["last_prompt_time"] is not None:
+                    self.store.set_last_prompt_time(tid, snapshot["last_prompt_round"],
+                                                    snapshot["last_prompt_time"].isoformat())
+                if "prompt_deck" in dirty:
+                    self.store.set_tenant_meta(tid, "prompt_deck", snapshot["prompt_deck"])
+                if "schedule" in dirty:
+                    self.store.set_tenant_meta(tid, "schedule", snapshot["schedule"])
+                if "event_marks" in dirty:
+                    self.store.set_tenant_meta(tid, "event_marks", snapshot["event_marks"])
+                if "round_topic" in dirty:
+                    self.store.set_tenant_meta(tid, "round_topic", snapshot["round_topic"])
+                for round_key, topic, replies in archives:
+                    self.store.archive_round(tid, round_key, topic, replies)
+                for round_key in closed_rounds:
+                    self.store.close_round(tid, round_key)
+                if clear_replies:
+                    self.store.clear_replies(tid)
+                for round_key, record in new_replies:
+                    self.store.append_reply(tid, round_key, record)
+                if reset_participants:
+                    # A reset rewrites the whole set once; later additions are already in the snapshot
+                    self.store.set_participants(tid, snapshot["participants"], snapshot["invite_link"],
+                                                snapshot["participants_round"])
+                else:
+                    for uid, round_key in new_participants:
+                        self.store.add_participant(tid, uid, round_key)
+                    if "invite_link" in dirty:
+                        self.store.set_invite_link(tid, snapshot["invite_link"])
+                for round_key in dropped_participants:
+                    self.store.delete_participants(tid, round_key)
+                for op, round_key, uid in member_ops:
+                    if op == "add":
+                        self.store.add_member(tid, round_key, uid)
+                    else:
+                        self.store.remove_member(tid, uid)
+                version = self.store.bump_version(tid) if shared else None
+        except Exception:
+            # Put the batch back in front of anything queued meanwhile so the next flush retries it
+            with self._lock:
+                self._dirty |= dirty
+                # A newer clear/reset makes the failed batch moot; otherwise it goes first
+                if not self._clear_replies:
+                    self._clear_replies = clear_replies
+                    self._new_replies = new_replies + self._new_replies
+                if not self._reset_participants:
+                    self._reset_participants = reset_participants
+                    self._new_participants = new_participants + self._new_participants
+                self._dropped_participants = dropped_participants + self._dropped_participants
+                self._member_ops = member_ops + self._member_ops
+                self._archives = archives + self._archives
+                self._closed_rounds = closed_rounds + self._closed_rounds
+            raise
+        if version is not None:
+            # Anything but our own +1 means another process wrote too
+            if version != self.version + 1:
+                self.stale = True
+            self.version = version
+
+    def _mark(self, field: str):
+        self._dirty.add(field)
+
+    # =========================
+    # ✏️ MUTATIONS (memory only)
+    # =========================
+
+    def set_discussion_chat_id(self, chat_id: int):
+        with self._lock:
+            self.discussion_chat_id = int(chat_id)
+            self._mark("discussion_chat_id")
+
+    def set_last_prompt_time(self, dt: datetime, round_key: str):
+        with self._lock:
+            self.last_prompt_time = dt
+            self.last_prompt_round = round_key
+            self._mark("last_prompt_time")
+
+    def set_prompt_deck(self, deck: dict):
+        with self._lock:
+            self.prompt_deck = deck
+            self.legacy_used_prompts = []
+            self._mark("prompt_deck")
+
+    def set_schedule(self, schedule: dict):
+        with self._lock:
+            self.schedule = dict(schedule)
+            self._mark("schedule")
+
+    def set_round_topic(self, topic: Optional[str]):
+        with self._lock:
+            self.round_topic = topic
+            self._mark("round_topic")
+
+    def mark_event(self, event: str, due: float):
+        """Remember that the run of `event` due at `due` (unix time) has started."""
+        with self._lock:
+            self.event_marks[event] = due
+            self._mark("event_marks")
+
+    def set_invite_link(self, invite_link: Optional[str]):
+        """Attach the invite link to the current participant set without replacing the set."""
+        with self._lock:
+            self.invite_link = invite_link
+            self._mark("invite_link")  # a full reset, if one is pending, writes it with the set
+
+    def set_participants(self, ids: Iterable[int], invite_link: Optional[str], round_key: str):
+        with self._lock:
+            self.participants = {int(x) for x in ids}
+            self.invite_link = invite_link
+            self.participants_round = round_key
+            self._reset_participants = True
+            self._new_participants = []
+
+    def drop_participants(self, round_key: str):
+        """Forget round `round_key`'s participants (a finished round); a later round's set is kept."""
+        with self._lock:
+            if self.participants_round == round_key:
+                self.participants = set()
+                self.invite_link = None
+                self._new_participants = [(uid, key) for uid, key in self._new_participants if key != round_key]
+            self._dropped_participants.append(round_key)
+
+    def add_reply(self, round_key: str, record: ReplyRecord) -> bool:
+        """Store one reply and count its sender as a participant of `round_key` (False: already stored)."""
+        with self._lock:
+            replies = self.replies.setdefault(record.user_id, [])
+            if any(r.message_id == record.message_id for r in replies):
+                return False  # redelivered by Telegram after the ingest dedup window, or by another worker
+            replies.append(record)
+            self._new_replies.append((round_key, record))
+            # Same roll-over rule as the store: the set moves to the new key with its members
+            self.participants.add(record.user_id)
+            self.participants_round = round_key
+            if not self._reset_participants:  # a pending full rewrite picks it up from the snapshot
+                self._new_participants.append((record.user_id, round_key))
+            return True
+
+    def clear_replies(self):
+        with self._lock:
+            self.replies = {}
+            self._clear_replies = True
+            self._new_replies = []
+
+    def archive_replies(self, round_key: str):
+        """Move the stored replies into the archive as round `round_key`, then clear them."""
+        with self._lock:
+            if self.replies:
+                self._archives.append((round_key, self.round_topic, self.replies))
+            self.replies = {}
+            self._clear_replies = True
+            self._new_replies = []
+
+    def close_round(self, round_key: str):
+        """Count the finished round `round_key` in the group's stats (once; repeats are ignored by the store)."""
+        with self._lock:
+            self._closed_rounds.append(round_key)
+
+    def add_member(self, round_key: str, user_id: int):
+        """Record that `user_id` joined the discussion group while `round_key` was running."""
+        with self._lock:
+            members = self.members.setdefault(round_key, set())
+            if int(user_id) not in members:
+                members.add(int(user_id))
+                self._member_ops.append(("add", round_key, int(user_id)))
+
+    def remove_member(self, user_id: int):
+        """Forget `user_id` as a discussion group member (left or was removed)."""
+        with self._lock:
+            found = False
+            for members in self.members.values():
+                if int(user_id) in members:
+                    members.discard(int(user_id))
+                    found = True
+            if found:
+                self.members = {k: v for k, v in self.members.items() if v}
+                self._member_ops.append(("remove", None, int(user_id)))
+
+    # =========================
+    # 🔎 READS
+    # =========================
+
+    def get_participants(self) -> dict:
+        with self._lock:
+            return {
+                "current": sorted(self.participants),
+                "last_invite_link": self.invite_link,
+                "last_round": self.participants_round,
+            }
+
+    def get_prompt_deck(self) -> dict:
+        """A copy of the deck state to draw from; the writer thread may be serializing the stored one."""
+        with self._lock:
+            return copy.deepcopy(self.prompt_deck)
+
+    def get_replies(self) -> dict[int, list[ReplyRecord]]:
+        with self._lock:
+            return {uid: list(msgs) for uid, msgs in self.replies.items()}
+
+    def round_members(self, round_key: str) -> set[int]:
+        """Users recorded as joining the discussion group for round `round_key` (and still in it)."""
+        with self._lock:
+            return set(self.members.get(round_key, ()))
+
+
+class Tenants:
+    """
+    All groups served by this process, keyed by main group chat id, plus the
+    user -> group routing for private messages. Owns the write-behind thread.
+    """
+
+    def __init__(self, store: StateStore, flush_interval: float = FLUSH_INTERVAL, shared: bool = False):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.shared = shared  # other processes write to the same store
+        self.version = 0  # store counter for the group list, as of our last load/flush
+        self.on_reload: Optional[Callable[[RoundState], None]] = None  # called (writer thread) after a reload
+        self.states: dict[int, RoundState] = {}
+        self.by_discussion: dict[int, int] = {}  # discussion chat id -> tenant id
+
+        # user id -> {tenant id: last seen}, and the group each user picked with /join
+        self.user_seen: dict[int, dict[int, float]] = {}
+        self.user_pinned: dict[int, int] = {}
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()  # one flush at a time, so batches land in order
+        self._users_since = 0.0
+        self._new_tenants: list[tuple[int, Optional[str]]] = []
+        self._user_ops: list[tuple[int, int, float, Optional[bool]]] = []
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._writer: Optional[threading.Thread] = None
+
+    # =========================
+    # 📥 LOAD / FLUSH
+    # =========================
+
+    def load(self):
+        """Read every group and the user routing table, as one snapshot. Called once at startup."""
+        self._users_since = time.time()
+        snapshot = self.store.load_snapshot()
+        self.version = snapshot["versions"].get(None, 0)
+        for tenant_id, data in snapshot["tenants"].items():
+            state = RoundState(self.store, tenant_id, data["title"])
+            state.load(data)
+            self.states[tenant_id] = state
+            if state.discussion_chat_id is not None:
+                self.by_discussion[state.discussion_chat_id] = tenant_id
+        self._merge_users(snapshot["user_tenants"])
+
+    def _merge_users(self, rows: list[tuple[int, int, float, bool]]):
+        with self._lock:
+            for user_id, tenant_id, last_seen, pinned in rows:
+                seen = self.user_seen.setdefault(user_id, {})
+                seen[tenant_id] = max(last_seen, seen.get(tenant_id, 0.0))
+                if pinned:
+                    self.user_pinned[user_id] = tenant_id
+
+    def start(self):
+        """Start the background writer thread."""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run_writer, name="state-writer", daemon=True)
+            self._writer.start()
+
+    def close(self):
+        """Stop the writer and force a final flush."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        self.flush()
+
+    def _run_writer(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.sync()
+            except Exception as e:
+                logging.error("State flush failed, will retry: %s", e)
+
+    def sync(self):
+        """Flush our changes, then (shared store) pick up what other processes wrote."""
+        with self._sync_lock:
+            self._flush()
+            if self.shared:
+                self._refresh()
+
+    def flush(self):
+        """Flush new groups, routing changes and every group's pending changes."""
+        with self._sync_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            new_tenants, self._new_tenants = self._new_tenants, []
+            user_ops, self._user_ops = self._user_ops, []
+        try:
+            if new_tenants or user_ops:
+                with self.store.transaction():
+                    for tenant_id, title in new_tenants:
+                        self.store.add_tenant(tenant_id, title)
+                    for user_id, tenant_id, last_seen, pinned in user_ops:
+                        self.store.see_user(user_id, tenant_id, last_seen, pinned)
+                    if new_tenants and self.shared:
+                        version = self.store.bump_version()
+                        if version != self.version + 1:
+                            self.version = -1  # someone else added groups too: reload the list
+                        else:
+                            self.version = version
+        except Exception:
+            with self._lock:
+                self._new_tenants = new_tenants + self._new_tenants
+                self._user_ops = user_ops + self._user_ops
+            raise
+        for state in list(self.states.values()):
+            state.flush(self.shared)
+
+    def _refresh(self):
+        """Reload groups (and the group list) whose change counter another process moved."""
+        versions = self.store.get_versions()
+        if versions.get(None, 0) != self.version:
+            self.version = versions.get(None, 0)
+            for tenant_id, title in self.store.get_tenants().items():
+                if tenant_id not in self.states:
+                    state = RoundState(self.store, tenant_id, title)
+                    state.load()
+                    with self._lock:
+                        self.states[tenant_id] = state
+                    self._reloaded(state)
+                else:
+                    self.states[tenant_id].title = title
+        for tenant_id, state in list(self.states.items()):
+            if (versions.get(tenant_id, 0) != state.version or state.stale) and state.reload():
+                self._reloaded(state)
+
+        # Routing rows seen since the last look (with some slack for writers whose clock is behind)
+        since, self._users_since = self._users_since, time.time()
+        self._merge_users(self.store.get_user_tenants(since=since - 10 * self.flush_interval - 5))
+
+    def _reloaded(self, state: RoundState):
+        with self._lock:
+            for chat_id, tenant_id in list(self.by_discussion.items()):
+                if tenant_id == state.tenant_id and chat_id != state.discussion_chat_id:
+                    del self.by_discussion[chat_id]
+            if state.discussion_chat_id is not None:
+                self.by_discussion[state.discussion_chat_id] = state.tenant_id
+        if self.on_reload is not None:
+            self.on_reload(state)
+
+    # =========================
+    # 🏠 GROUPS
+    # =========================
+
+    def get(self, tenant_id: Optional[int]) -> Optional[RoundState]:
+        return self.states.get(tenant_id) if tenant_id is not None else None
+
+    def add(self, tenant_id: int, title: Optional[str] = None) -> RoundState:
+        """Register a main group (no-op if it is already known, apart from refreshing the title)."""
+        with self._lock:
+            state = self.states.get(tenant_id)
+            if state is None:
+                state = self.states[tenant_id] = RoundState(self.store, tenant_id, title)
+                self._new_tenants.append((tenant_id, title))
+            elif title and title != state.title:
+                state.title = title
+                self._new_tenants.append((tenant_id, title))
+            return state
+
+    def for_discussion(self, chat_id: int) -> Optional[RoundState]:
+        """The group whose discussion room is `chat_id`, if any."""
+        return self.get(self.by_discussion.get(chat_id))
+
+    def set_discussion(self, state: RoundState, chat_id: int):
+        with self._lock:
+            if state.discussion_chat_id is not None:
+                self.by_discussion.pop(state.discussion_chat_id, None)
+            self.by_discussion[int(chat_id)] = state.tenant_id
+        state.set_discussion_chat_id(chat_id)
+
+    def __iter__(self):
+        return iter(list(self.states.values()))
+
+    def __len__(self):
+        return len(self.states)
+
+    # =========================
+    # 🧭 ROUTING PRIVATE MESSAGES
+    # =========================
+
+    def see_user(self, user_id: int, tenant_id: int, pinned: Optional[bool] = None):
+        """Note that `user_id` is in group `tenant_id` (pinned=True: they picked it with /join)."""
+        now = time.time()
+        with self._lock:
+            seen = self.user_seen.setdefault(user_id, {})
+            previous = seen.get(tenant_id)
+            seen[tenant_id] = now
+            if pinned:
+                self.user_pinned[user_id] = tenant_id
+            # Repeat sightings within a minute are not worth a write
+            if pinned is not None or previous is None or now - previous > 60:
+                self._user_ops.append((user_id, tenant_id, now, pinned))
+
+    def groups_of(self, user_id: int) -> list[RoundState]:
+        """Groups `user_id` has been seen in, most recent first."""
+        seen = self.user_seen.get(user_id, {})
+        return [self.states[t] for t in sorted(seen, key=seen.get, reverse=True) if t in self.states]
+
+    def route(self, user_id: int) -> Optional[RoundState]:
+        """
+        Which group a private message from `user_id` belongs to: the one picked with /join,
+        else the group they were most recently seen in, else the only group if there is just one.
+        """
+        pinned = self.get(self.user_pinned.get(user_id))
+        if pinned is not None:
+            return pinned
+        groups = self.groups_of(user_id)
+        if groups:
+            return groups[0]
+        if len(self.states) == 1:
+            return next(iter(self.states.values()))
+        return None
+
+
+class KeyedLocks:
+    """
+    One asyncio.Lock per key (e.g. (round, user)), so updates for the same key run
+    one at a time while everything else runs concurrently. Idle locks are dropped.
+    """
+
+    def __init__(self):
+        self._locks: dict = {}  # key -> [lock, holders + waiters]
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
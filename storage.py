@@ -0,0 +1,917 @@
+# storage.py
+"""
+Persistent state for the bot.
+
+`StateStore` is the interface the bot talks to; `SQLiteStore` is the default
+backend (single file, WAL journal, one transaction per write). All round
+state is partitioned by tenant: the chat id of the main group it belongs
+to. The old per-call JSON files can be pulled in once with
+`import_legacy_json`.
+
+Finished rounds are never deleted: the reveal appends each round's replies
+to `round_archive` as one compressed blob (indexed by round, and by user
+through `archive_users`), and the cleanup folds the round into running
+per-group, per-user and per-topic counters, so /stats reads a few rows
+however many rounds are archived.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, Iterable
+
+import clock
+from records import ReplyRecord, pack_round, unpack_round
+from metrics import STORE_SECONDS, STORE_BYTES
+
+
+class StateStore:
+    """Storage backend interface. Every write must be atomic."""
+
+    # --- global key/value settings (schema flags, ...) ---
+    def get_meta(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set_meta(self, key: str, value: Optional[str]):
+        raise NotImplementedError
+
+    # --- tenants (one per main group) ---
+    def get_tenants(self) -> dict[int, Optional[str]]:
+        """{tenant_id: title}"""
+        raise NotImplementedError
+
+    def add_tenant(self, tenant_id: int, title: Optional[str]):
+        raise NotImplementedError
+
+    def get_tenant_meta(self, tenant_id: int, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set_tenant_meta(self, tenant_id: int, key: str, value: Optional[str]):
+        raise NotImplementedError
+
+    # --- rounds ---
+    def get_last_prompt_time(self, tenant_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    def set_last_prompt_time(self, tenant_id: int, round_key: str, iso_ts: str):
+        raise NotImplementedError
+
+    # --- participants ---
+    def get_participants(self, tenant_id: int) -> dict:
+        raise NotImplementedError
+
+    def set_participants(self, tenant_id: int, ids: Iterable[int], invite_link: Optional[str], round_key: str):
+        raise NotImplementedError
+
+    def add_participant(self, tenant_id: int, user_id: int, round_key: str):
+        raise NotImplementedError
+
+    def set_invite_link(self, tenant_id: int, invite_link: Optional[str]):
+        raise NotImplementedError
+
+    def delete_participants(self, tenant_id: int, round_key: str):
+        raise NotImplementedError
+
+    # --- discussion group members ---
+    def get_members(self, tenant_id: int) -> dict[str, set[int]]:
+        raise NotImplementedError
+
+    def add_member(self, tenant_id: int, round_key: str, user_id: int):
+        raise NotImplementedError
+
+    def remove_member(self, tenant_id: int, user_id: int):
+        raise NotImplementedError
+
+    # --- replies ---
+    def append_reply(self, tenant_id: int, round_key: str, record: ReplyRecord):
+        raise NotImplementedError
+
+    def get_replies(self, tenant_id: int) -> dict[int, list[ReplyRecord]]:
+        raise NotImplementedError
+
+    def clear_replies(self, tenant_id: int):
+        raise NotImplementedError
+
+    # --- round archive and participation stats (see /stats) ---
+    def archive_round(self, tenant_id: int, round_key: str, topic: Optional[str],
+                      replies: dict[int, list[ReplyRecord]]):
+        """Append a finished round's replies to the archive. A round is archived once; repeats are ignored."""
+        raise NotImplementedError
+
+    def close_round(self, tenant_id: int, round_key: str) -> bool:
+        """
+        Fold an archived round into the group's counters (a round nobody replied in counts too, and breaks
+        streaks). Rounds are closed in order. False if it was closed already.
+        """
+        raise NotImplementedError
+
+    def get_archived_round(self, tenant_id: int, round_key: str) -> Optional[dict]:
+        """{"topic", "archived", "replies": {user_id: [records]}}, or None if the round isn't archived."""
+        raise NotImplementedError
+
+    def get_user_rounds(self, tenant_id: int, user_id: int, limit: int = 50) -> list[tuple[str, int]]:
+        """[(round_key, replies)] of the archived rounds `user_id` replied in, newest first."""
+        raise NotImplementedError
+
+    def get_stats(self, tenant_id: int, user_id: Optional[int] = None, top: int = 5) -> dict:
+        """
+        The group's counters: {"rounds", "replies", "participations", "last_round",
+        "members": [(user_id, name, rounds, replies)] most rounds first, "streaks": [(user_id, name, streak)]
+        running into the last round, "topics": [(topic, rounds, replies, participations)] most replies first,
+        "user": {"rounds", "replies", "streak", "best_streak"} or None}. Cost doesn't grow with the archive.
+        """
+        raise NotImplementedError
+
+    # --- which main groups a user belongs to (for routing DMs) ---
+    def get_user_tenants(self, since: float = 0.0) -> list[tuple[int, int, float, bool]]:
+        """[(user_id, tenant_id, last_seen, pinned)], only rows seen after `since` if given."""
+        raise NotImplementedError
+
+    def see_user(self, user_id: int, tenant_id: int, last_seen: float, pinned: Optional[bool] = None):
+        """Record that `user_id` was seen in `tenant_id`. `pinned` True/False changes the /join choice."""
+        raise NotImplementedError
+
+    # --- change counters, so processes sharing the store notice each other's writes ---
+    def bump_version(self, tenant_id: Optional[int] = None) -> int:
+        """Increment and return the counter of `tenant_id` (None: the list of groups)."""
+        raise NotImplementedError
+
+    def get_versions(self) -> dict[Optional[int], int]:
+        """Every counter, keyed like `bump_version`."""
+        raise NotImplementedError
+
+    # --- snapshot (startup and reloads read a group in one go) ---
+    def load_snapshot(self, tenant_id: Optional[int] = None) -> dict:
+        """
+        Every group's state (or only `tenant_id`'s) in one consistent read:
+        {"tenants": {tenant_id: {"title", "meta", "last_prompt_time", "participants", "replies", "members"}},
+         "versions": get_versions(), "user_tenants": get_user_tenants()}; the last two only for all groups.
+        """
+        tenants = self.get_tenants()
+        snapshot: dict = {"tenants": {}}
+        if tenant_id is None:
+            snapshot["versions"] = self.get_versions()
+            snapshot["user_tenants"] = self.get_user_tenants()
+        for tid in (tenants if tenant_id is None else [tenant_id]):
+            snapshot["tenants"][tid] = {
+                "title": tenants.get(tid),
+                "meta": {key: value for key in TENANT_META_KEYS
+                         if (value := self.get_tenant_meta(tid, key)) is not None},
+                "last_prompt_time": self.get_last_prompt_time(tid),
+                "participants": self.get_participants(tid),
+                "replies": self.get_replies(tid),
+                "members": self.get_members(tid),
+            }
+        return snapshot
+
+    # --- outbox (fan-outs written down before they run; see outbox.py) ---
+    def outbox_add(self, tenant_id: int, batch: str, items: list[tuple[int, str, str]]):
+        """Store a batch's items as (stage, kind, payload json), all pending."""
+        raise NotImplementedError
+
+    def outbox_items(self, batch: str) -> list[tuple[int, int, str, str, int, Optional[str]]]:
+        """[(id, stage, kind, payload, status, result)] in execution order."""
+        raise NotImplementedError
+
+    def outbox_mark(self, updates: list[tuple[int, int, Optional[str]]]):
+        """Set (id, status, result json) for finished items."""
+        raise NotImplementedError
+
+    def outbox_open_batches(self) -> list[tuple[int, str]]:
+        """(tenant_id, batch) of batches that still have pending items."""
+        raise NotImplementedError
+
+    def outbox_prune(self, before: float):
+        """Drop finished batches created before `before` (unix time)."""
+        raise NotImplementedError
+
+    # --- leases (one holder at a time, until it stops renewing) ---
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew lease `name` for `holder` for `ttl` seconds. False if someone else holds it."""
+        raise NotImplementedError
+
+    def release_lease(self, name: str, holder: str):
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        """Group several writes so they land together or not at all."""
+        yield self
+
+    def close(self):
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS tenants (
+    tenant_id INTEGER PRIMARY KEY,
+    title     TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tenant_meta (
+    tenant_id INTEGER NOT NULL,
+    key       TEXT    NOT NULL,
+    value     TEXT,
+    PRIMARY KEY (tenant_id, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rounds (
+    tenant_id   INTEGER NOT NULL,
+    round_key   TEXT    NOT NULL,
+    prompt_time TEXT,
+    invite_link TEXT,
+    PRIMARY KEY (tenant_id, round_key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS participants (
+    tenant_id INTEGER NOT NULL,
+    round_key TEXT    NOT NULL,
+    user_id   INTEGER NOT NULL,
+    PRIMARY KEY (tenant_id, round_key, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS members (
+    tenant_id INTEGER NOT NULL,
+    round_key TEXT    NOT NULL,
+    user_id   INTEGER NOT NULL,
+    PRIMARY KEY (tenant_id, round_key, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS members_by_user ON members (tenant_id, user_id);
+
+CREATE TABLE IF NOT EXISTS replies (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id  INTEGER NOT NULL,
+    round_key  TEXT    NOT NULL,
+    user_id    INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    payload    TEXT    NOT NULL  -- ReplyRecord.encode()
+);
+CREATE INDEX IF NOT EXISTS replies_by_user ON replies (tenant_id, round_key, user_id, id);
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    name    TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_tenants (
+    user_id   INTEGER NOT NULL,
+    tenant_id INTEGER NOT NULL,
+    last_seen REAL    NOT NULL,
+    pinned    INTEGER NOT NULL DEFAULT 0,  -- chosen with /join
+    PRIMARY KEY (user_id, tenant_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS user_tenants_by_seen ON user_tenants (last_seen);
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER NOT NULL,
+    batch     TEXT    NOT NULL,  -- one fan-out, e.g. "-100123:reveal:1760000000"
+    stage     INTEGER NOT NULL,  -- stages run in order, the items of a stage concurrently
+    kind      TEXT    NOT NULL,
+    payload   TEXT    NOT NULL,  -- JSON
+    status    INTEGER NOT NULL DEFAULT 0,  -- 0 pending, 1 done, 2 failed
+    result    TEXT,              -- JSON
+    created   REAL    NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS outbox_by_batch ON outbox (batch, stage, id);
+CREATE INDEX IF NOT EXISTS outbox_by_status ON outbox (status, batch);
+
+CREATE TABLE IF NOT EXISTS round_archive (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER NOT NULL,
+    round_key TEXT    NOT NULL,
+    topic     TEXT,
+    users     INTEGER NOT NULL,
+    replies   INTEGER NOT NULL,
+    data      BLOB    NOT NULL,  -- records.pack_round()
+    archived  REAL    NOT NULL,  -- unix time
+    closed    INTEGER NOT NULL DEFAULT 0,  -- 1 once counted in the stats_* tables
+    UNIQUE (tenant_id, round_key)
+);
+
+CREATE TABLE IF NOT EXISTS archive_users (
+    tenant_id INTEGER NOT NULL,
+    user_id   INTEGER NOT NULL,
+    round_key TEXT    NOT NULL,
+    replies   INTEGER NOT NULL,
+    PRIMARY KEY (tenant_id, user_id, round_key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS stats_groups (
+    tenant_id      INTEGER PRIMARY KEY,
+    rounds         INTEGER NOT NULL,
+    replies        INTEGER NOT NULL,
+    participations INTEGER NOT NULL,  -- users who replied, summed over rounds
+    last_round     TEXT    NOT NULL   -- the last round closed
+);
+
+CREATE TABLE IF NOT EXISTS stats_users (
+    tenant_id   INTEGER NOT NULL,
+    user_id     INTEGER NOT NULL,
+    rounds      INTEGER NOT NULL,
+    replies     INTEGER NOT NULL,
+    streak      INTEGER NOT NULL,  -- rounds in a row replied in, ending at last_round
+    best_streak INTEGER NOT NULL,
+    last_round  TEXT    NOT NULL,  -- the last round this user replied in
+    PRIMARY KEY (tenant_id, user_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS stats_users_by_rounds ON stats_users (tenant_id, rounds, replies);
+CREATE INDEX IF NOT EXISTS stats_users_by_streak ON stats_users (tenant_id, last_round, streak);
+
+CREATE TABLE IF NOT EXISTS stats_topics (
+    tenant_id      INTEGER NOT NULL,
+    topic          TEXT    NOT NULL,
+    rounds         INTEGER NOT NULL,
+    replies        INTEGER NOT NULL,
+    participations INTEGER NOT NULL,
+    PRIMARY KEY (tenant_id, topic)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS leases (
+    name       TEXT PRIMARY KEY,
+    holder     TEXT NOT NULL,
+    expires_at REAL NOT NULL  -- unix time
+) WITHOUT ROWID;
+"""
+
+# Per-group settings a RoundState loads (the tenant_meta keys)
+TENANT_META_KEYS = ("version", "discussion_chat_id", "last_prompt_round", "participants_round", "prompt_deck",
+                    "used_prompts", "schedule", "event_marks", "round_topic")
+
+
+class SQLiteStore(StateStore):
+    """SQLite backend. Appends are single-row inserts, so a reply costs O(1) regardless of round size."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # One connection shared across threads, serialized by our own lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._tx: Optional[_MeteredConnection] = None
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of statements atomically (BEGIN IMMEDIATE ... COMMIT). Nested blocks join the outer one."""
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self._tx
+                finally:
+                    self._depth -= 1
+                return
+            start = time.perf_counter()
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._depth = 1
+            self._tx = _MeteredConnection(self._conn)
+            try:
+                yield self._tx
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+                STORE_BYTES.inc(self._tx.bytes, op="write")
+            finally:
+                self._depth = 0
+                self._tx = None
+                STORE_SECONDS.observe(time.perf_counter() - start, op="write")
+
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        start = time.perf_counter()
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        STORE_SECONDS.observe(time.perf_counter() - start, op="read")
+        STORE_BYTES.inc(sum(_value_bytes(row) for row in rows), op="read")
+        return rows
+
+    # --- meta ---
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key: str, value: Optional[str]):
+        with self.transaction() as db:
+            _set_meta(db, key, value)
+
+    # --- tenants ---
+    def get_tenants(self) -> dict[int, Optional[str]]:
+        return dict(self._query("SELECT tenant_id, title FROM tenants ORDER BY tenant_id"))
+
+    def add_tenant(self, tenant_id: int, title: Optional[str]):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO tenants (tenant_id, title) VALUES (?, ?) "
+                "ON CONFLICT (tenant_id) DO UPDATE SET title = COALESCE(excluded.title, title)",
+                (int(tenant_id), title),
+            )
+
+    def get_tenant_meta(self, tenant_id: int, key: str) -> Optional[str]:
+        rows = self._query("SELECT value FROM tenant_meta WHERE tenant_id = ? AND key = ?", (tenant_id, key))
+        return rows[0][0] if rows else None
+
+    def set_tenant_meta(self, tenant_id: int, key: str, value: Optional[str]):
+        with self.transaction() as db:
+            _set_tenant_meta(db, tenant_id, key, value)
+
+    # --- rounds ---
+    def get_last_prompt_time(self, tenant_id: int) -> Optional[str]:
+        rows = self._query(
+            "SELECT r.prompt_time FROM tenant_meta m "
+            "JOIN rounds r ON r.tenant_id = m.tenant_id AND r.round_key = m.value "
+            "WHERE m.tenant_id = ? AND m.key = 'last_prompt_round'",
+            (tenant_id,),
+        )
+        return rows[0][0] if rows else None
+
+    def set_last_prompt_time(self, tenant_id: int, round_key: str, iso_ts: str):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO rounds (tenant_id, round_key, prompt_time) VALUES (?, ?, ?) "
+                "ON CONFLICT (tenant_id, round_key) DO UPDATE SET prompt_time = excluded.prompt_time",
+                (tenant_id, round_key, iso_ts),
+            )
+            _set_tenant_meta(db, tenant_id, "last_prompt_round", round_key)
+
+    # --- participants ---
+    def get_participants(self, tenant_id: int) -> dict:
+        with self._lock:
+            round_key = self.get_tenant_meta(tenant_id, "participants_round")
+            if round_key is None:
+                return {"current": [], "last_invite_link": None, "last_round": None}
+            ids = [r[0] for r in self._query(
+                "SELECT user_id FROM participants WHERE tenant_id = ? AND round_key = ? ORDER BY user_id",
+                (tenant_id, round_key))]
+            link = self._query("SELECT invite_link FROM rounds WHERE tenant_id = ? AND round_key = ?",
+                               (tenant_id, round_key))
+            return {
+                "current": ids,
+                "last_invite_link": link[0][0] if link else None,
+                "last_round": round_key,
+            }
+
+    def set_participants(self, tenant_id: int, ids: Iterable[int], invite_link: Optional[str], round_key: str):
+        with self.transaction() as db:
+            db.execute("DELETE FROM participants WHERE tenant_id = ? AND round_key = ?", (tenant_id, round_key))
+            db.executemany(
+                "INSERT OR IGNORE INTO participants (tenant_id, round_key, user_id) VALUES (?, ?, ?)",
+                [(tenant_id, round_key, int(uid)) for uid in ids],
+            )
+            db.execute(
+                "INSERT INTO rounds (tenant_id, round_key, invite_link) VALUES (?, ?, ?) "
+                "ON CONFLICT (tenant_id, round_key) DO UPDATE SET invite_link = excluded.invite_link",
+                (tenant_id, round_key, invite_link),
+            )
+            _set_tenant_meta(db, tenant_id, "participants_round", round_key)
+
+    def add_participant(self, tenant_id: int, user_id: int, round_key: str):
+        """Same result as get + set with one more id, without rewriting the whole list."""
+        with self.transaction() as db:
+            row = db.execute("SELECT value FROM tenant_meta WHERE tenant_id = ? AND key = 'participants_round'",
+                             (tenant_id,)).fetchone()
+            previous = row[0] if row else None
+            if previous != round_key:
+                # The set rolls over to the new key, carrying the current members and link along
+                db.execute(
+                    "INSERT OR IGNORE INTO participants (tenant_id, round_key, user_id) "
+                    "SELECT tenant_id, ?, user_id FROM participants WHERE tenant_id = ? AND round_key = ?",
+                    (round_key, tenant_id, previous),
+                )
+                db.execute(
+                    "INSERT INTO rounds (tenant_id, round_key, invite_link) "
+                    "VALUES (?, ?, (SELECT invite_link FROM rounds WHERE tenant_id = ? AND round_key = ?)) "
+                    "ON CONFLICT (tenant_id, round_key) DO UPDATE SET invite_link = excluded.invite_link",
+                    (tenant_id, round_key, tenant_id, previous),
+                )
+                _set_tenant_meta(db, tenant_id, "participants_round", round_key)
+            db.execute(
+                "INSERT OR IGNORE INTO participants (tenant_id, round_key, user_id) VALUES (?, ?, ?)",
+                (tenant_id, round_key, int(user_id)),
+            )
+
+    def set_invite_link(self, tenant_id: int, invite_link: Optional[str]):
+        """Attach the link to the current participant set; the set itself is left alone."""
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE rounds SET invite_link = ? WHERE tenant_id = ? AND round_key = "
+                "(SELECT value FROM tenant_meta WHERE tenant_id = ? AND key = 'participants_round')",
+                (invite_link, tenant_id, tenant_id),
+            )
+
+    def delete_participants(self, tenant_id: int, round_key: str):
+        """Drop one round's participant rows (other rounds', the running one included, are kept)."""
+        with self.transaction() as db:
+            db.execute("DELETE FROM participants WHERE tenant_id = ? AND round_key = ?", (tenant_id, round_key))
+
+    # --- discussion group members ---
+    def get_members(self, tenant_id: int) -> dict[str, set[int]]:
+        members: dict[str, set[int]] = {}
+        for round_key, user_id in self._query("SELECT round_key, user_id FROM members WHERE tenant_id = ?",
+                                              (tenant_id,)):
+            members.setdefault(round_key, set()).add(user_id)
+        return members
+
+    def add_member(self, tenant_id: int, round_key: str, user_id: int):
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO members (tenant_id, round_key, user_id) VALUES (?, ?, ?)",
+                       (tenant_id, round_key, int(user_id)))
+
+    def remove_member(self, tenant_id: int, user_id: int):
+        with self.transaction() as db:
+            db.execute("DELETE FROM members WHERE tenant_id = ? AND user_id = ?", (tenant_id, int(user_id)))
+
+    # --- replies ---
+    def append_reply(self, tenant_id: int, round_key: str, record: ReplyRecord):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO replies (tenant_id, round_key, user_id, message_id, payload) VALUES (?, ?, ?, ?, ?)",
+                (tenant_id, round_key, record.user_id, record.message_id, record.encode()),
+            )
+            # Names are stored once per user; the WHERE skips the write when nothing changed
+            db.execute(
+                "INSERT INTO users (user_id, name) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET name = excluded.name WHERE name IS NOT excluded.name",
+                (record.user_id, record.name),
+            )
+
+    def get_replies(self, tenant_id: int) -> dict[int, list[ReplyRecord]]:
+        """All stored replies as {user_id: [records]}, users in order of their first reply."""
+        replies: dict[int, list[ReplyRecord]] = {}
+        rows = self._query(
+            "SELECT r.user_id, u.name, r.payload FROM replies r LEFT JOIN users u ON u.user_id = r.user_id "
+            "WHERE r.tenant_id = ? ORDER BY r.id",
+            (tenant_id,),
+        )
+        for user_id, name, payload in rows:
+            replies.setdefault(user_id, []).append(ReplyRecord.decode(user_id, name, payload))
+        return replies
+
+    def clear_replies(self, tenant_id: int):
+        with self.transaction() as db:
+            db.execute("DELETE FROM replies WHERE tenant_id = ?", (tenant_id,))
+
+    # --- round archive and stats ---
+    def archive_round(self, tenant_id: int, round_key: str, topic: Optional[str],
+                      replies: dict[int, list[ReplyRecord]]):
+        counts = [(tenant_id, uid, round_key, len(records)) for uid, records in replies.items() if records]
+        with self.transaction() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO round_archive (tenant_id, round_key, topic, users, replies, data, archived) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (tenant_id, round_key, topic, len(counts), sum(c[3] for c in counts), pack_round(replies),
+                 clock.time()),
+            )
+            if cursor.rowcount:
+                db.executemany("INSERT INTO archive_users (tenant_id, user_id, round_key, replies) "
+                               "VALUES (?, ?, ?, ?)", counts)
+
+    def close_round(self, tenant_id: int, round_key: str) -> bool:
+        with self.transaction() as db:
+            # A round without replies was never archived: add it empty, so it still counts
+            db.execute("INSERT OR IGNORE INTO round_archive (tenant_id, round_key, users, replies, data, archived) "
+                       "VALUES (?, ?, 0, 0, ?, ?)", (tenant_id, round_key, pack_round({}), clock.time()))
+            topic, users, replies, closed = db.execute(
+                "SELECT topic, users, replies, closed FROM round_archive WHERE tenant_id = ? AND round_key = ?",
+                (tenant_id, round_key)).fetchone()
+            if closed:
+                return False
+            row = db.execute("SELECT last_round FROM stats_groups WHERE tenant_id = ?", (tenant_id,)).fetchone()
+            previous = row[0] if row else None  # streaks that reached this round go on
+            db.execute(
+                "INSERT INTO stats_users (tenant_id, user_id, rounds, replies, streak, best_streak, last_round) "
+                "SELECT tenant_id, user_id, 1, replies, 1, 1, round_key FROM archive_users "
+                "WHERE tenant_id = ? AND round_key = ? "
+                "ON CONFLICT (tenant_id, user_id) DO UPDATE SET rounds = rounds + 1, "
+                "replies = replies + excluded.replies, "
+                "streak = CASE WHEN last_round IS ? THEN streak + 1 ELSE 1 END, "
+                "best_streak = MAX(best_streak, CASE WHEN last_round IS ? THEN streak + 1 ELSE 1 END), "
+                "last_round = excluded.last_round",
+                (tenant_id, round_key, previous, previous),
+            )
+            db.execute(
+                "INSERT INTO stats_groups (tenant_id, rounds, replies, participations, last_round) "
+                "VALUES (?, 1, ?, ?, ?) ON CONFLICT (tenant_id) DO UPDATE SET rounds = rounds + 1, "
+                "replies = replies + excluded.replies, participations = participations + excluded.participations, "
+                "last_round = excluded.last_round",
+                (tenant_id, replies, users, round_key),
+            )
+            if topic is not None:
+                db.execute(
+                    "INSERT INTO stats_topics (tenant_id, topic, rounds, replies, participations) "
+                    "VALUES (?, ?, 1, ?, ?) ON CONFLICT (tenant_id, topic) DO UPDATE SET rounds = rounds + 1, "
+                    "replies = replies + excluded.replies, participations = participations + excluded.participations",
+                    (tenant_id, topic, replies, users),
+                )
+            db.execute("UPDATE round_archive SET closed = 1 WHERE tenant_id = ? AND round_key = ?",
+                       (tenant_id, round_key))
+        return True
+
+    def get_archived_round(self, tenant_id: int, round_key: str) -> Optional[dict]:
+        rows = self._query("SELECT topic, archived, data FROM round_archive WHERE tenant_id = ? AND round_key = ?",
+                           (tenant_id, round_key))
+        if not rows:
+            return None
+        topic, archived, data = rows[0]
+        return {"topic": topic, "archived": archived, "replies": unpack_round(data)}
+
+    def get_user_rounds(self, tenant_id: int, user_id: int, limit: int = 50) -> list[tuple[str, int]]:
+        return self._query("SELECT round_key, replies FROM archive_users WHERE tenant_id = ? AND user_id = ? "
+                           "ORDER BY round_key DESC LIMIT ?", (tenant_id, user_id, limit))
+
+    def get_stats(self, tenant_id: int, user_id: Optional[int] = None, top: int = 5) -> dict:
+        with self._lock:
+            group = self._query("SELECT rounds, replies, participations, last_round FROM stats_groups "
+                                "WHERE tenant_id = ?", (tenant_id,))
+            rounds, replies, participations, last_round = group[0] if group else (0, 0, 0, None)
+            members = self._query(
+                "SELECT s.user_id, u.name, s.rounds, s.replies FROM stats_users s "
+                "LEFT JOIN users u ON u.user_id = s.user_id WHERE s.tenant_id = ? "
+                "ORDER BY s.rounds DESC, s.replies DESC LIMIT ?", (tenant_id, top))
+            streaks = self._query(
+                "SELECT s.user_id, u.name, s.streak FROM stats_users s LEFT JOIN users u ON u.user_id = s.user_id "
+                "WHERE s.tenant_id = ? AND s.last_round = ? AND s.streak > 1 ORDER BY s.streak DESC LIMIT ?",
+                (tenant_id, last_round, top))
+            topics = self._query("SELECT topic, rounds, replies, participations FROM stats_topics "
+                                 "WHERE tenant_id = ? ORDER BY replies DESC LIMIT ?", (tenant_id, top))
+            user = None
+            if user_id is not None:
+                row = self._query("SELECT rounds, replies, streak, best_streak, last_round FROM stats_users "
+                                  "WHERE tenant_id = ? AND user_id = ?", (tenant_id, user_id))
+                if row:
+                    r, n, streak, best, last = row[0]
+                    # A streak only counts while it reaches the group's last round
+                    user = {"rounds": r, "replies": n, "streak": streak if last == last_round else 0,
+                            "best_streak": best}
+        return {"rounds": rounds, "replies": replies, "participations": participations, "last_round": last_round,
+                "members": members, "streaks": streaks, "topics": topics, "user": user}
+
+    # --- user routing ---
+    def get_user_tenants(self, since: float = 0.0) -> list[tuple[int, int, float, bool]]:
+        return [(u, t, s, bool(p)) for u, t, s, p in
+                self._query("SELECT user_id, tenant_id, last_seen, pinned FROM user_tenants WHERE last_seen > ?",
+                            (since,))]
+
+    def see_user(self, user_id: int, tenant_id: int, last_seen: float, pinned: Optional[bool] = None):
+        with self.transaction() as db:
+            if pinned:
+                # Only one pinned group per user
+                db.execute("UPDATE user_tenants SET pinned = 0 WHERE user_id = ? AND tenant_id != ?",
+                           (user_id, tenant_id))
+            db.execute(
+                "INSERT INTO user_tenants (user_id, tenant_id, last_seen, pinned) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id, tenant_id) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen), "
+                "pinned = CASE WHEN ? IS NULL THEN pinned ELSE excluded.pinned END",
+                (user_id, tenant_id, last_seen, int(bool(pinned)), pinned),
+            )
+
+    # --- change counters ---
+    def bump_version(self, tenant_id: Optional[int] = None) -> int:
+        with self.transaction() as db:
+            if tenant_id is None:
+                db.execute("INSERT INTO meta (key, value) VALUES ('version', '1') "
+                           "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+                row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            else:
+                db.execute("INSERT INTO tenant_meta (tenant_id, key, value) VALUES (?, 'version', '1') "
+                           "ON CONFLICT (tenant_id, key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                           (tenant_id,))
+                row = db.execute("SELECT value FROM tenant_meta WHERE tenant_id = ? AND key = 'version'",
+                                 (tenant_id,)).fetchone()
+        return int(row[0])
+
+    def get_versions(self) -> dict[Optional[int], int]:
+        versions: dict[Optional[int], int] = {
+            t: int(v) for t, v in self._query("SELECT tenant_id, value FROM tenant_meta WHERE key = 'version'")
+        }
+        versions[None] = int(self.get_meta("version") or 0)
+        return versions
+
+    # --- snapshot ---
+    def load_snapshot(self, tenant_id: Optional[int] = None) -> dict:
+        """One read transaction and one query per table, instead of about ten queries per group."""
+        params = () if tenant_id is None else (tenant_id,)
+        only = "" if tenant_id is None else " AND {}tenant_id = ?"  # filled in with the table alias
+        start = time.perf_counter()
+        with self._lock:
+            if self._depth:  # inside a write transaction, which is consistent already
+                return super().load_snapshot(tenant_id)
+            self._conn.execute("BEGIN")  # deferred: one read snapshot of the WAL, writers aren't blocked
+            try:
+                tenants = self._query(f"SELECT tenant_id, title FROM tenants WHERE 1{only.format('')}", params)
+                meta = self._query(f"SELECT tenant_id, key, value FROM tenant_meta WHERE 1{only.format('')}", params)
+                current = ("FROM tenant_meta m JOIN {0} ON {1}.tenant_id = m.tenant_id AND {1}.round_key = m.value "
+                           "WHERE m.key = '{2}'" + only.format("m."))
+                prompt_times = self._query("SELECT m.tenant_id, r.prompt_time "
+                                           + current.format("rounds r", "r", "last_prompt_round"), params)
+                links = self._query("SELECT m.tenant_id, r.invite_link "
+                                    + current.format("rounds r", "r", "participants_round"), params)
+                participants = self._query("SELECT m.tenant_id, p.user_id "
+                                           + current.format("participants p", "p", "participants_round")
+                                           + " ORDER BY p.user_id", params)
+                members = self._query(f"SELECT tenant_id, round_key, user_id FROM members WHERE 1{only.format('')}",
+                                      params)
+                replies = self._query("SELECT r.tenant_id, r.user_id, u.name, r.payload FROM replies r "
+                                      f"LEFT JOIN users u ON u.user_id = r.user_id WHERE 1{only.format('r.')} "
+                                      "ORDER BY r.id", params)
+                extra = {} if tenant_id is not None else {
+                    "versions": self.get_versions(), "user_tenants": self.get_user_tenants()}
+            finally:
+                self._conn.execute("COMMIT")
+        STORE_SECONDS.observe(time.perf_counter() - start, op="snapshot")
+
+        groups = {tid: _empty_group(title) for tid, title in tenants}
+        if tenant_id is not None:
+            groups.setdefault(tenant_id, _empty_group(None))
+
+        def known(result):  # rows of groups in the snapshot (tenant id first)
+            return (row for row in result if row[0] in groups)
+
+        for tid, key, value in known(meta):
+            if value is not None:
+                groups[tid]["meta"][key] = value
+        for group in groups.values():
+            group["participants"]["last_round"] = group["meta"].get("participants_round")
+        for tid, ts in known(prompt_times):
+            groups[tid]["last_prompt_time"] = ts
+        for tid, link in known(links):
+            groups[tid]["participants"]["last_invite_link"] = link
+        for tid, user_id in known(participants):
+            groups[tid]["participants"]["current"].append(user_id)
+        for tid, round_key, user_id in known(members):
+            groups[tid]["members"].setdefault(round_key, set()).add(user_id)
+        for tid, user_id, name, payload in known(replies):
+            groups[tid]["replies"].setdefault(user_id, []).append(ReplyRecord.decode(user_id, name, payload))
+        return {"tenants": groups, **extra}
+
+    # --- outbox ---
+    def outbox_add(self, tenant_id: int, batch: str, items: list[tuple[int, str, str]]):
+        now = clock.time()  # compared with outbox_prune's cutoff, which is on the round clock
+        with self.transaction() as db:
+            db.executemany(
+                "INSERT INTO outbox (tenant_id, batch, stage, kind, payload, created) VALUES (?, ?, ?, ?, ?, ?)",
+                [(tenant_id, batch, stage, kind, payload, now) for stage, kind, payload in items],
+            )
+
+    def outbox_items(self, batch: str) -> list[tuple[int, int, str, str, int, Optional[str]]]:
+        return self._query("SELECT id, stage, kind, payload, status, result FROM outbox "
+                           "WHERE batch = ? ORDER BY stage, id", (batch,))
+
+    def outbox_mark(self, updates: list[tuple[int, int, Optional[str]]]):
+        with self.transaction() as db:
+            db.executemany("UPDATE outbox SET status = ?, result = ? WHERE id = ?",
+                           [(status, result, item_id) for item_id, status, result in updates])
+
+    def outbox_open_batches(self) -> list[tuple[int, str]]:
+        return self._query("SELECT DISTINCT tenant_id, batch FROM outbox WHERE status = 0")
+
+    def outbox_prune(self, before: float):
+        with self.transaction() as db:
+            db.execute("DELETE FROM outbox WHERE created < ? AND batch NOT IN "
+                       "(SELECT batch FROM outbox WHERE status = 0)", (before,))
+
+    # --- leases ---
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE holder = excluded.holder OR expires_at < ?",
+                (name, holder, now + ttl, now),
+            )
+            row = db.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+        return row[0] == holder
+
+    def release_lease(self, name: str, holder: str):
+        with self.transaction() as db:
+            db.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _value_bytes(values) -> int:
+    """Rough payload size of a row or parameter tuple: text/blob lengths, 8 bytes per number."""
+    return sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in values if v is not None)
+
+
+class _MeteredConnection:
+    """What `transaction()` yields: the connection, counting the bytes written through it."""
+
+    __slots__ = ("_conn", "bytes")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self.bytes = 0
+
+    def execute(self, sql: str, params=()):
+        self.bytes += _value_bytes(params)
+        return self._conn.execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        self.bytes += sum(_value_bytes(params) for params in seq_of_params)
+        return self._conn.executemany(sql, seq_of_params)
+
+
+def _empty_group(title: Optional[str]) -> dict:
+    """A group in load_snapshot() before its rows are filled in (and as read when it has none)."""
+    return {"title": title, "meta": {}, "last_prompt_time": None, "replies": {}, "members": {},
+            "participants": {"current": [], "last_invite_link": None, "last_round": None}}
+
+
+def _set_meta(db: sqlite3.Connection, key: str, value: Optional[str]):
+    db.execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+
+def _set_tenant_meta(db: sqlite3.Connection, tenant_id: int, key: str, value: Optional[str]):
+    db.execute(
+        "INSERT INTO tenant_meta (tenant_id, key, value) VALUES (?, ?, ?) "
+        "ON CONFLICT (tenant_id, key) DO UPDATE SET value = excluded.value",
+        (tenant_id, key, value),
+    )
+
+
+def open_store(path: str) -> StateStore:
+    """Pick a backend from the path. Only SQLite ships today."""
+    return SQLiteStore(path)
+
+
+# =========================
+# 📦 LEGACY JSON IMPORT
+# =========================
+
+def _read_legacy(path: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        # The old writer could leave truncated files behind; say so instead of pretending it was empty
+        logging.warning("Skipping unreadable legacy file %s: %s", path, e)
+        return None
+
+
+def import_legacy_json(store: StateStore, tenant_id: int, used_prompts_file: str, discussion_file: str,
+                       replies_file: str, participants_file: str, schedule_file: str) -> bool:
+    """
+    One-shot import of the old single-group JSON state files into `tenant_id`.
+    Runs only once per store (guarded by the 'legacy_imported' meta key). Returns True if it imported.
+    """
+    if store.get_meta("legacy_imported"):
+        return False
+
+    used = _read_legacy(used_prompts_file)
+    discussion = _read_legacy(discussion_file)
+    replies = _read_legacy(replies_file)
+    participants = _read_legacy(participants_file)
+    schedule = _read_legacy(schedule_file)
+
+    # Everything lands in one transaction, so a crash mid-import leaves nothing half-imported
+    with store.transaction():
+        store.add_tenant(tenant_id, None)
+        if used and used.get("used"):
+            store.set_tenant_meta(tenant_id, "used_prompts", json.dumps(used["used"]))
+        if discussion and discussion.get("chat_id") is not None:
+            store.set_tenant_meta(tenant_id, "discussion_chat_id", str(int(discussion["chat_id"])))
+        if schedule and schedule.get("last_prompt_time"):
+            ts = schedule["last_prompt_time"]
+            store.set_last_prompt_time(tenant_id, ts[:10], ts)  # prompt timestamps are local: date prefix = round key
+        if participants and participants.get("last_round"):
+            store.set_participants(
+                tenant_id,
+                participants.get("current", []),
+                participants.get("last_invite_link"),
+                participants["last_round"],
+            )
+        if replies:
+            round_key = (participants or {}).get("last_round") or ""
+            for uid, message_list in replies.items():
+                for msg in message_list:
+                    store.append_reply(tenant_id, round_key, ReplyRecord.from_message_dict(msg, int(uid)))
+
+        store.set_meta("legacy_imported", "1")
+    logging.info("Imported legacy JSON state into %s", getattr(store, "path", "store"))
+    return True
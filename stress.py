@@ -0,0 +1,167 @@
+# stress.py
+"""
+Stress test: thousands of simultaneous DMs, and not one reply lost.
+
+Runs the real bot (build_app's Application with its ingest queue,
+collect_reply, the background state writer) against an in-process fake
+Bot API (fakeapi.py, recording every call). Updates are handed to the
+ingest queue the way the webhook server does it, without the HTTP hop, so
+the load lands on the bot rather than on a local socket backlog. Every
+user sends a few private replies, one after another as Telegram delivers
+a chat's updates; all users do so at the same time. Like Telegram, a
+delivery the bot refuses (IngestFull, HTTP 500 on the webhook) is sent
+again, and a fraction of the updates are delivered twice.
+
+Then it checks, per user:
+
+* stored        every reply is in the state database exactly once
+                (read back through a fresh connection)
+* order         in the order the user sent them
+* acknowledged  one "Got it" per reply, no more
+
+and exits 1 if any check failed.
+
+    python stress.py                                 # 5000 users x 3 replies
+    python stress.py --users 20000 --replies 2 --concurrency 2000 --duplicates 0.2
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import shutil
+from collections import Counter, defaultdict
+from typing import Optional
+
+from bench import load_bot, private_update, _free_port, _percentile
+from fakeapi import FakeBotAPI, start_fake_api
+
+USERS = 5000
+REPLIES = 3  # per user
+CONCURRENCY = 1000  # deliveries in flight (Telegram's max_connections tops out at 100; this is harsher)
+DUPLICATES = 0.1  # fraction of updates delivered a second time
+RETRY_DELAY = 0.5  # seconds before a refused delivery is sent again, doubling up to RETRY_MAX
+RETRY_MAX = 8.0
+TENANT_ID = -1003000000000
+ACK_TEXT = "Got it!"
+
+
+async def deliver(app, data: dict, stats: Counter):
+    """Hand one update to the ingest queue until it is accepted, like Telegram (which retries, backing off)."""
+    from telegram import Update
+    from ingest import IngestFull
+
+    update, delay = Update.de_json(data, app.bot), RETRY_DELAY
+    while True:
+        try:
+            await app.update_queue.put(update)
+            return
+        except IngestFull:
+            stats["redelivered"] += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX)
+
+
+async def stress(bot, api: FakeBotAPI, api_port: int, args) -> dict[str, list[str]]:
+    from dispatcher import Dispatcher
+    from storage import open_store
+
+    server = start_fake_api(api, api_port)
+    bot.DISPATCHER = Dispatcher(global_rate=1e6, concurrency=bot.TRANSPORT.concurrency, chat_limits=False)
+    app = bot.build_app()
+    bot.TENANTS.start()
+    await app.initialize()
+    await app.start()
+
+    state = bot.TENANTS.add(TENANT_ID, "Stress group")
+    now = bot.group_schedule(state).now()
+    state.set_last_prompt_time(now, bot.today_key(state, now))
+    users = [10_000_000 + i for i in range(args.users)]
+    for uid in users:
+        bot.TENANTS.see_user(uid, TENANT_ID)
+
+    rng = random.Random(args.seed)
+    update_ids = iter(range(1, 10 ** 9))
+    sends = {uid: [private_update(next(update_ids), uid, m + 1) for m in range(args.replies)] for uid in users}
+    stats: Counter = Counter()
+    limit = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+
+    async def user(uid: int):
+        # A chat's updates arrive in order; a duplicate is a second delivery of one of them
+        for update in sends[uid]:
+            deliveries = 2 if rng.random() < args.duplicates else 1
+            stats["duplicates"] += deliveries - 1
+            for _ in range(deliveries):
+                async with limit:
+                    t0 = time.perf_counter()
+                    await deliver(app, update, stats)
+                    latencies.append(time.perf_counter() - t0)
+
+    total = args.users * args.replies
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(user(uid) for uid in users))
+        # An update leaves the ingest queue's count once its handlers are done ("Got it" sent)
+        while app.update_queue.in_flight:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        await asyncio.to_thread(bot.TENANTS.flush)
+    finally:
+        await app.stop()
+        await bot.DISPATCHER.close()
+        await app.shutdown()
+        bot.TENANTS.close()
+        server.stop()
+
+    print(f"{total} replies from {args.users} users in {elapsed:.1f}s ({total / elapsed:,.0f}/s), "
+          f"{stats['duplicates']} duplicate deliveries, {stats['redelivered']} refused and sent again; "
+          f"delivery p50 {_percentile(latencies, 0.5) * 1000:.0f}ms p99 {_percentile(latencies, 0.99) * 1000:.0f}ms")
+
+    # Read back what reached the database, not the in-memory copy
+    stored = open_store(bot.STATE_DB).get_replies(TENANT_ID)
+    acks = Counter(int(p["chat_id"]) for method, p in api.log
+                   if method == "sendMessage" and p.get("text", "").startswith(ACK_TEXT))
+    failures: dict[str, list[str]] = defaultdict(list)
+    for uid in users:
+        expected = [u["message"]["message_id"] for u in sends[uid]]
+        got = [r.message_id for r in stored.get(uid, [])]
+        if sorted(got) != expected:
+            failures["stored"].append(f"user {uid}: sent {expected}, stored {got}")
+        elif got != expected:
+            failures["order"].append(f"user {uid}: sent {expected}, stored in the order {got}")
+        if acks[uid] != len(expected):
+            failures["acknowledged"].append(f"user {uid}: {len(expected)} replies, {acks[uid]} acknowledgement(s)")
+    return failures
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Send thousands of concurrent DMs and check none is lost")
+    parser.add_argument("--users", type=int, default=USERS)
+    parser.add_argument("--replies", type=int, default=REPLIES, help="replies per user")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="deliveries in flight")
+    parser.add_argument("--duplicates", type=float, default=DUPLICATES, help="fraction of updates delivered twice")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API median latency in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    api = FakeBotAPI(latency=args.latency, record=True, seed=args.seed)
+    api_port = _free_port()
+    workdir = tempfile.mkdtemp(prefix="ripple-stress-")
+    try:
+        bot = load_bot(f"http://127.0.0.1:{api_port}", workdir)
+        failures = asyncio.run(stress(bot, api, api_port, args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if not failures:
+        print("Every reply stored once, in order, and acknowledged.")
+        return 0
+    for kind, messages in sorted(failures.items()):
+        print(f"{kind}: {len(messages)} user(s), e.g. {messages[0]}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# transport.py
+"""
+Outbound HTTP transport profiles.
+
+A `TransportProfile` sizes everything between the dispatcher and the
+Bot API: how many calls the dispatcher runs at once, the connection pool
+behind them, how long idle connections are kept alive, HTTP/2 and the
+timeouts. Timeouts are per method class, because the two kinds of calls
+fail differently: message sends (sendMessage, forwardMessages, ...)
+are bulk and should fail fast so the dispatcher can retry them, while
+admin actions (banChatMember, createChatInviteLink, ...) are few and
+slow on Telegram's side.
+
+Presets (HTTP_PROFILE):
+    "default"     PTB's own settings and 16 calls in flight (what the bot always used)
+    "production"  24 in flight on a matching pool, long keep-alive, HTTP/2 when available
+    "fanout"      64 in flight, for big groups whose reveal/cleanup fan-outs dominate;
+                  needs HTTP/2 to pay off
+
+A pool much bigger than the calls in flight only costs CPU: httpcore
+checks every pooled connection on every request. On HTTP/1.1 that check
+is what caps throughput; in bench.py (50ms fake API) cleanup fan-outs
+get faster up to about 24 calls in flight and then collapse.
+
+Any field can be overridden from the environment (see `profile_from_env`).
+HTTP/2 needs h2 (python-telegram-bot's http2 extra, in requirements.txt);
+without it the profile falls back to HTTP/1.1 with a warning.
+"""
+import logging
+import importlib.util
+from dataclasses import dataclass, field, replace
+from typing import Optional
+
+import httpx
+from telegram.request import HTTPXRequest, RequestData
+
+# Bot API method -> timeout class (anything not listed is "admin")
+MESSAGE_METHODS = {
+    "sendMessage", "forwardMessage", "forwardMessages", "copyMessage", "copyMessages", "sendVoice",
+    "sendAudio", "sendPhoto", "sendDocument", "editMessageText", "answerCallbackQuery",
+}
+METHOD_CLASSES = ("message", "admin")
+
+
+@dataclass(frozen=True, slots=True)
+class Timeouts:
+    connect: float
+    read: float
+    write: float
+
+
+@dataclass(frozen=True, slots=True)
+class TransportProfile:
+    name: str
+    concurrency: int  # dispatcher workers: Bot API calls in flight
+    pool_size: int  # connections open at most
+    keepalive: int  # idle connections kept open
+    keepalive_expiry: float  # seconds an idle connection is kept
+    http2: bool
+    pool_timeout: float  # seconds a call may wait for a free connection
+    timeouts: dict = field(default_factory=dict)  # method class -> Timeouts
+
+    def timeouts_for(self, method: str) -> Timeouts:
+        return self.timeouts["message" if method in MESSAGE_METHODS else "admin"]
+
+
+PRESETS = {
+    "default": TransportProfile(
+        "default", concurrency=16, pool_size=256, keepalive=256, keepalive_expiry=5.0, http2=False,
+        pool_timeout=1.0, timeouts={"message": Timeouts(5.0, 5.0, 5.0), "admin": Timeouts(5.0, 5.0, 5.0)},
+    ),
+    "production": TransportProfile(
+        "production", concurrency=24, pool_size=24, keepalive=24, keepalive_expiry=120.0, http2=True,
+        pool_timeout=5.0, timeouts={"message": Timeouts(5.0, 10.0, 10.0), "admin": Timeouts(5.0, 20.0, 5.0)},
+    ),
+    "fanout": TransportProfile(
+        "fanout", concurrency=64, pool_size=64, keepalive=64, keepalive_expiry=120.0, http2=True,
+        pool_timeout=10.0, timeouts={"message": Timeouts(5.0, 15.0, 10.0), "admin": Timeouts(5.0, 30.0, 5.0)},
+    ),
+}
+
+
+def _parse_timeouts(value: str) -> Timeouts:
+    connect, read, write = (float(x) for x in value.split(","))
+    return Timeouts(connect, read, write)
+
+
+def profile_from_env(env: dict) -> TransportProfile:
+    """
+    HTTP_PROFILE's preset with single fields overridden by HTTP_CONCURRENCY, HTTP_POOL_SIZE, HTTP_KEEPALIVE,
+    HTTP_KEEPALIVE_EXPIRY, HTTP2 (1/0), HTTP_POOL_TIMEOUT, HTTP_TIMEOUT_MESSAGE and HTTP_TIMEOUT_ADMIN
+    (the last two as "connect,read,write" seconds).
+    """
+    name = env.get("HTTP_PROFILE", "default")
+    if name not in PRESETS:
+        raise ValueError(f"HTTP_PROFILE must be one of {', '.join(PRESETS)}")
+    profile = PRESETS[name]
+    changes = {}
+    for key, attr, cast in (("HTTP_CONCURRENCY", "concurrency", int), ("HTTP_POOL_SIZE", "pool_size", int),
+                            ("HTTP_KEEPALIVE", "keepalive", int), ("HTTP_KEEPALIVE_EXPIRY", "keepalive_expiry", float),
+                            ("HTTP_POOL_TIMEOUT", "pool_timeout", float)):
+        if env.get(key):
+            changes[attr] = cast(env[key])
+    if env.get("HTTP2"):
+        changes["http2"] = env["HTTP2"].lower() in ("1", "true", "yes")
+    timeouts = dict(profile.timeouts)
+    for cls in METHOD_CLASSES:
+        if env.get(f"HTTP_TIMEOUT_{cls.upper()}"):
+            timeouts[cls] = _parse_timeouts(env[f"HTTP_TIMEOUT_{cls.upper()}"])
+    if changes or timeouts != profile.timeouts:
+        profile = replace(profile, timeouts=timeouts, **changes)
+    return profile
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class ProfiledRequest(HTTPXRequest):
+    """HTTPXRequest sized by a TransportProfile, applying its per-method-class timeouts."""
+
+    __slots__ = ("profile",)
+
+    def __init__(self, profile: TransportProfile):
+        http2 = profile.http2 and _http2_available()
+        if profile.http2 and not http2:
+            logging.warning("HTTP/2 requested by transport profile %r but h2 is not installed "
+                            "(pip install -r requirements.txt); using HTTP/1.1", profile.name)
+        timeouts = profile.timeouts["admin"]
+        # PTB keeps every pooled connection alive for httpx's default 5s; use the profile's limits instead
+        limits = httpx.Limits(max_connections=profile.pool_size,
+                              max_keepalive_connections=min(profile.keepalive, profile.pool_size),
+                              keepalive_expiry=profile.keepalive_expiry)
+        # http1 stays on next to HTTP/2: TLS negotiates h2 with Telegram, and a plain-http local
+        # server (fakeapi.py, a local Bot API server) gets HTTP/1.1 instead of h2 it can't speak
+        super().__init__(connection_pool_size=profile.pool_size, connect_timeout=timeouts.connect,
+                         read_timeout=timeouts.read, write_timeout=timeouts.write,
+                         pool_timeout=profile.pool_timeout, http_version="2" if http2 else "1.1",
+                         httpx_kwargs={"limits": limits, "http1": True})
+        self.profile = profile
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=HTTPXRequest.DEFAULT_NONE, write_timeout=HTTPXRequest.DEFAULT_NONE,
+                         connect_timeout=HTTPXRequest.DEFAULT_NONE, pool_timeout=HTTPXRequest.DEFAULT_NONE):
+        # Timeouts a caller passed explicitly win; uploads keep PTB's longer media write timeout
+        timeouts = self.profile.timeouts_for(url.rsplit("/", 1)[-1])
+        if read_timeout is self.DEFAULT_NONE:
+            read_timeout = timeouts.read
+        if connect_timeout is self.DEFAULT_NONE:
+            connect_timeout = timeouts.connect
+        if write_timeout is self.DEFAULT_NONE and not (request_data and request_data.contains_files):
+            write_timeout = timeouts.write
+        return await super().do_request(url, method, request_data, read_timeout=read_timeout,
+                                        write_timeout=write_timeout, connect_timeout=connect_timeout,
+                                        pool_timeout=pool_timeout)
@@ -0,0 +1,114 @@
+# welcome.py
+"""
+Coalesced welcome messages.
+
+When the reveal DMs its invite links, dozens of people can join the
+discussion group within seconds. One welcome per join spams the group
+and runs into Telegram's per-group rate limit (about 20 messages a
+minute), so `WelcomeBatcher` collects the joins per chat and sends one
+welcome naming all of them once the chat has been quiet for `window`
+seconds (or `max_wait` seconds after the first join, whichever comes
+first). A welcome is only split when the names don't fit in one message
+(4096 characters, counted as Telegram does after parsing the HTML).
+
+Welcomes are templates with a `{name}` placeholder (see render.py); the
+names are escaped here, and the newest template of a chat is used.
+"""
+import re
+import html
+import asyncio
+import logging
+from typing import Optional, Callable, Awaitable
+
+from digest import LIMIT, text_length
+
+WINDOW = 3.0  # seconds without a new join before the chat is welcomed
+MAX_WINDOWS = 5  # ...but nobody waits longer than this many windows
+
+
+def _visible_length(text: str) -> int:
+    """Length of an HTML message once Telegram has parsed it (tags dropped, entities resolved)."""
+    return text_length(html.unescape(re.sub(r"<[^>]*>", "", text)))
+
+
+def join_names(names: list[str]) -> str:
+    """"A", "A and B", "A, B and C"."""
+    return names[0] if len(names) == 1 else f"{', '.join(names[:-1])} and {names[-1]}"
+
+
+def pack_welcomes(template: str, names: list[str], limit: int = LIMIT) -> list[str]:
+    """`template` with `{name}` filled in, as few messages as fit: all names in one unless it is too long."""
+    room = limit - (_visible_length(template) - len("{name}"))
+    messages: list[list[str]] = [[]]
+    size = 0
+    for name in names:
+        cost = text_length(name) + (2 if messages[-1] else 0) + (3 if len(messages[-1]) == 1 else 0)  # ", " / " and "
+        if messages[-1] and size + cost > room:
+            messages.append([])
+            size, cost = 0, text_length(name)
+        messages[-1].append(name)
+        size += cost
+    return [template.replace("{name}", html.escape(join_names(chunk))) for chunk in messages if chunk]
+
+
+class _Pending:
+    __slots__ = ("bot", "names", "template", "first", "timer")
+
+    def __init__(self, bot, template: str, first: float):
+        self.bot = bot
+        self.names: list[str] = []
+        self.template = template
+        self.first = first  # loop time of the first join
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class WelcomeBatcher:
+    """Debounced welcomes: joins per chat are gathered and welcomed in one message."""
+
+    def __init__(self, send: Callable[..., Awaitable], window: float = WINDOW, max_wait: Optional[float] = None):
+        self.send = send  # send(bot, chat_id, html_text)
+        self.window = window
+        self.max_wait = max_wait if max_wait is not None else window * MAX_WINDOWS
+        self._pending: dict[int, _Pending] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, bot, chat_id: int, name: str, template: str):
+        """Queue a welcome for `name` in `chat_id` (on the event loop)."""
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            pending = self._pending[chat_id] = _Pending(bot, template, loop.time())
+        pending.names.append(name)
+        pending.template = template
+        if pending.timer is not None:
+            pending.timer.cancel()
+        delay = min(self.window, pending.first + self.max_wait - loop.time())
+        pending.timer = loop.call_later(max(delay, 0.0), self._flush, chat_id)
+
+    def pending(self) -> int:
+        """Joins waiting to be welcomed."""
+        return sum(len(p.names) for p in self._pending.values())
+
+    async def close(self):
+        """Welcome everyone still waiting, now (shutdown)."""
+        for chat_id in list(self._pending):
+            self._flush(chat_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush(self, chat_id: int):
+        pending = self._pending.pop(chat_id, None)
+        if pending is None:
+            return
+        if pending.timer is not None:
+            pending.timer.cancel()
+        task = asyncio.get_running_loop().create_task(self._send(chat_id, pending), name=f"welcome-{chat_id}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, chat_id: int, pending: _Pending):
+        for text in pack_welcomes(pending.template, pending.names):
+            try:
+                await self.send(pending.bot, chat_id, text)
+            except Exception as e:
+                logging.warning("Welcome for %d member(s) in %s failed: %s", len(pending.names), chat_id, e)